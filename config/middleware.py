@@ -0,0 +1,125 @@
+import heapq
+import itertools
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_current_metrics = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Счетчики одного запроса: SQL, время БД и отмеченные участки кода"""
+
+    def __init__(self, slow_query_limit):
+        self.queries = 0
+        self.db_time = 0.0
+        self.sections = {}
+        self.active = set()
+        self.view_name = None
+        self.slow_query_limit = slow_query_limit
+        self.slow_queries = []
+        self._counter = itertools.count()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.queries += 1
+            self.db_time += duration
+            item = (duration, next(self._counter), sql)
+            if len(self.slow_queries) < self.slow_query_limit:
+                heapq.heappush(self.slow_queries, item)
+            else:
+                heapq.heappushpop(self.slow_queries, item)
+
+    def add(self, name, duration):
+        self.sections[name] = self.sections.get(name, 0.0) + duration
+
+    def server_timing(self, total):
+        other = sum(self.sections.values())
+        entries = [f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"']
+        entries += [f'{name};dur={duration * 1000:.1f}' for name, duration in self.sections.items()]
+        entries.append(f'app;dur={max(total - self.db_time - other, 0) * 1000:.1f}')
+        entries.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(entries)
+
+
+@contextmanager
+def track(name):
+    """Засекает время участка кода (например, вызовов Stripe) для заголовка Server-Timing.
+
+    Время SQL внутри участка уже учтено в db и не входит в участок; вложенный участок с тем же
+    именем не считается второй раз.
+    """
+    metrics = _current_metrics.get()
+    if metrics is None or name in metrics.active:
+        yield
+        return
+    metrics.active.add(name)
+    start, db_start = time.perf_counter(), metrics.db_time
+    try:
+        yield
+    finally:
+        metrics.active.discard(name)
+        metrics.add(name, time.perf_counter() - start - (metrics.db_time - db_start))
+
+
+def get_view_name(request, view_func):
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return f'{view_func.__module__}.{view_func.__qualname__}'
+    actions = getattr(view_func, 'actions', None) or {}
+    return f'{view_class.__name__}.{actions.get(request.method.lower(), request.method.lower())}'
+
+
+class QueryTimingMiddleware:
+    """Считает SQL-запросы и время обработки запроса без опоры на DEBUG и connection.queries"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_query_ms = getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', 100)
+        self.slow_query_limit = getattr(settings, 'SLOW_QUERY_LOG_LIMIT', 5)
+
+    def __call__(self, request):
+        metrics = RequestMetrics(self.slow_query_limit)
+        token = _current_metrics.set(metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _current_metrics.reset(token)
+            render_started = getattr(request, '_render_started', None)
+            if render_started is not None:
+                metrics.add('render', time.perf_counter() - render_started)
+
+        response['Server-Timing'] = metrics.server_timing(time.perf_counter() - start)
+        self.log_slow_queries(request, metrics)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = _current_metrics.get()
+        if metrics is not None:
+            metrics.view_name = get_view_name(request, view_func)
+
+    def process_template_response(self, request, response):
+        # DRF Response рендерится (сериализуется в JSON) сразу после этого хука
+        request._render_started = time.perf_counter()
+        return response
+
+    def log_slow_queries(self, request, metrics):
+        view_name = metrics.view_name or request.path
+        for duration, _, sql in sorted(metrics.slow_queries, reverse=True):
+            if duration * 1000 < self.slow_query_ms:
+                break
+            logger.warning('Slow query in %s (%.1f ms): %s', view_name, duration * 1000, sql[:1000])
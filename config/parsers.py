@@ -0,0 +1,23 @@
+from io import BytesIO
+
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+
+from config.renderers import ORJSONRenderer, orjson
+
+
+class ORJSONParser(JSONParser):
+    """JSONParser на orjson; без orjson, а также на телах, которые orjson не разобрал, работает как JSONParser"""
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        body = stream.read()
+        try:
+            return orjson.loads(body if encoding.lower() in ('utf-8', 'utf8') else body.decode(encoding))
+        except (orjson.JSONDecodeError, UnicodeDecodeError, LookupError):
+            # Стандартный json сохраняет прежние сообщения об ошибках
+            return super().parse(BytesIO(body), media_type, parser_context)
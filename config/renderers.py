@@ -0,0 +1,32 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSONRenderer на orjson с тем же выводом, что у стандартного; без orjson работает как JSONRenderer.
+
+    orjson сам пишет datetime, UUID и подклассы dict/list (ReturnDict, объекты stripe), остальное (Decimal,
+    timedelta, lazy-строки, QuerySet) отдается в encoder DRF. Отступы, ASCII-вывод и данные, которые orjson
+    не кодирует (например, целые больше 64 бит), уходят в стандартный рендерер.
+
+    Отличие от JSONRenderer: NaN и Infinity orjson пишет как null, а стандартный рендерер при STRICT_JSON
+    падает с ValueError. Проверять каждое число ради этого дорого, а float-полей в моделях нет.
+    """
+    options = (orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z) if orjson else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=self.options)
+        except (orjson.JSONEncodeError, ValueError):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Как и JSONRenderer, экранируем U+2028 и U+2029, чтобы ответ оставался корректным JavaScript
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
@@ -0,0 +1,21 @@
+from rest_framework import serializers
+
+from config.middleware import track
+
+
+class TimedDataMixin:
+    """Время построения serializer.data попадает в Server-Timing как serialize"""
+
+    @property
+    def data(self):
+        with track('serialize'):
+            return super().data
+
+
+class TimedListSerializer(TimedDataMixin, serializers.ListSerializer):
+    pass
+
+
+class TimedModelSerializer(TimedDataMixin, serializers.ModelSerializer):
+    """ModelSerializer с замером serialize; для many=True в Meta указывается list_serializer_class,
+    унаследованный от TimedListSerializer"""
@@ -53,6 +53,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'config.middleware.QueryTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -96,6 +97,53 @@ DATABASES = {
     }
 }
 
+# Запросы к БД медленнее порога (в мс) попадают в лог вместе с именем вьюхи
+SLOW_QUERY_THRESHOLD_MS = int(os.getenv('SLOW_QUERY_THRESHOLD_MS', 100))
+
+# Сколько самых медленных запросов запоминать на один HTTP-запрос
+SLOW_QUERY_LOG_LIMIT = 5
+
+# Кэш; без REDIS_CACHE_URL (например, redis://redis:6379/1) используется память процесса
+REDIS_CACHE_URL = os.getenv('REDIS_CACHE_URL')
+
+if REDIS_CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Время жизни закэшированных ответов курсов и уроков, в секундах
+MATERIALS_CACHE_TTL = int(os.getenv('MATERIALS_CACHE_TTL', 5 * 60))
+
+# Списки курсов, уроков, пользователей и платежей собираются из .values() без экземпляров моделей
+FAST_LIST_SERIALIZERS = os.getenv('FAST_LIST_SERIALIZERS', 'False') == 'True'
+
+# Сколько строк выгрузки (export/) читается из базы за раз; память процесса зависит от него, а не от объема выгрузки
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 2000))
+
+# Сколько уроков можно создать, изменить или удалить одним запросом к lesson/bulk/
+LESSON_BULK_MAX_SIZE = 1000
+
+# Начиная с такого числа строк в таблице пагинация отдает приблизительный count вместо COUNT(*)
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = int(os.getenv('PAGINATION_COUNT_ESTIMATE_THRESHOLD', 10000))
+
+# Время жизни закэшированного count для отфильтрованных списков, в секундах
+PAGINATION_COUNT_CACHE_TTL = 10 * 60
+
+# Сколько секунд помнить оценку числа строк таблицы (pg_class.reltuples); она меняется только после ANALYZE
+PAGINATION_ESTIMATE_CACHE_TTL = 60
+
+# Сколько секунд помнить членство пользователя в группе администраторов DRF
+ROLES_CACHE_TTL = 60 * 60
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -162,14 +210,49 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny'
     ],
+    # JSON кодируется и разбирается через orjson, если он установлен
+    'DEFAULT_RENDERER_CLASSES': [
+        'config.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'config.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=1500),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    # last_login ставится только при входе (выдаче токена), его читает check_login
+    'UPDATE_LAST_LOGIN': True,
 }
 
 STRIPE_API_KEY = os.getenv('STRIPE_API_KEY')
+# Адрес API Stripe; для замеров его подменяют локальной заглушкой (users.stripe_stub)
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE')
+
+# Таймаут одного запроса к API Stripe (в секундах)
+STRIPE_TIMEOUT = int(os.getenv('STRIPE_TIMEOUT', 10))
+
+# Сколько раз клиент stripe повторяет запрос при сетевой ошибке
+STRIPE_MAX_NETWORK_RETRIES = 2
+
+# Сколько секунд кэшируется незавершенный статус сессии оплаты (завершенный хранится бессрочно)
+STRIPE_STATUS_CACHE_TTL = int(os.getenv('STRIPE_STATUS_CACHE_TTL', 5))
+
+# Секрет подписи вебхуков Stripe и сколько событий применяется за одну транзакцию
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET', '')
+STRIPE_EVENT_BATCH_SIZE = 500
+
+# Сверка незавершенных платежей со Stripe: число параллельных запросов, размер пачки,
+# повторы при ответе 429 и начальная пауза между ними (в секундах)
+STRIPE_RECONCILE_CONCURRENCY = int(os.getenv('STRIPE_RECONCILE_CONCURRENCY', 8))
+STRIPE_RECONCILE_BATCH_SIZE = 500
+STRIPE_RECONCILE_MAX_RETRIES = 4
+STRIPE_RECONCILE_BACKOFF = 0.5
+STRIPE_RECONCILE_INTERVAL = timedelta(minutes=10)
 
 # URL-адрес брокера сообщений
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL')  # Например, Redis, который по умолчанию работает на порту 6379
@@ -186,10 +269,41 @@ CELERY_TASK_TRACK_STARTED = True
 # Максимальное время на выполнение задачи
 CELERY_TASK_TIME_LIMIT = 30 * 60
 
+# Окно (в секундах), в котором правки курса и его уроков собираются в одно уведомление подписчикам
+COURSE_NOTIFICATION_WINDOW = int(os.getenv('COURSE_NOTIFICATION_WINDOW', 15 * 60))
+
+# Сколько подписчиков обрабатывает одна задача рассылки об обновлении курса
+COURSE_MAIL_CHUNK_SIZE = 500
+
+# Сколько пользователей отключает один UPDATE в задаче check_login
+CHECK_LOGIN_CHUNK_SIZE = 1000
+
+# Как часто relay_outbox отправляет накопленные в outbox задачи в брокер (в секундах)
+OUTBOX_RELAY_INTERVAL = int(os.getenv('OUTBOX_RELAY_INTERVAL', 5))
+
+# Сколько задач outbox отправляется за одну транзакцию
+OUTBOX_BATCH_SIZE = 500
+
+# Сколько хранятся уже отправленные записи outbox и как часто их чистит purge_outbox_records
+OUTBOX_RETENTION = timedelta(days=1)
+OUTBOX_PURGE_INTERVAL = timedelta(hours=1)
+
 CELERY_BEAT_SCHEDULE = {
     'task-name': {
         'task': 'materials.tasks.check_login',  # Путь к задаче
         'schedule': timedelta(days=1),  # Расписание выполнения задачи (например, каждые 10 минут)
     },
+    'relay-outbox': {
+        'task': 'materials.tasks.relay_outbox',
+        'schedule': timedelta(seconds=OUTBOX_RELAY_INTERVAL),
+    },
+    'purge-outbox': {
+        'task': 'materials.tasks.purge_outbox_records',
+        'schedule': OUTBOX_PURGE_INTERVAL,
+    },
+    'reconcile-payments': {
+        'task': 'users.tasks.reconcile_payment_statuses',
+        'schedule': STRIPE_RECONCILE_INTERVAL,
+    },
 }
 
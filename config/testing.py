@@ -0,0 +1,34 @@
+from abc import ABC, abstractmethod
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin(ABC):
+    """Проверяет, что число запросов к БД не растет вместе с объемом данных"""
+    dataset_sizes = (1, 5, 20)
+
+    @abstractmethod
+    def seed(self, size):
+        """Доводит объем данных до size строк"""
+
+    def assertQueryBudget(self, make_request, max_queries, max_bytes, per_row=False):
+        queries = {}
+        payloads = {}
+        for size in self.dataset_sizes:
+            self.seed(size)
+            method, url, data = make_request()
+            with CaptureQueriesContext(connection) as context:
+                response = getattr(self.client, method)(url, data=data, format='json')
+            self.assertLess(response.status_code, 400, f'{method.upper()} {url}: {response.content[:200]}')
+            # Точки сохранения появляются только из-за транзакции, в которую TestCase оборачивает тест
+            queries[size] = sum(not query['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))
+                                for query in context.captured_queries)
+            payloads[size] = len(response.content) / size if per_row else len(response.content)
+
+        endpoint = f'{method.upper()} {url}'
+        scaling = ', '.join(f'{size} rows: {queries[size]} queries / {payloads[size]:.0f} bytes' for size in queries)
+        self.assertLessEqual(max(queries.values()), max_queries, f'{endpoint} over query budget ({scaling})')
+        self.assertEqual(max(queries.values()), queries[self.dataset_sizes[0]],
+                         f'{endpoint} queries grow with rows ({scaling})')
+        self.assertLessEqual(max(payloads.values()), max_bytes, f'{endpoint} over payload budget ({scaling})')
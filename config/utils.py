@@ -0,0 +1,59 @@
+import math
+from contextlib import contextmanager
+from itertools import islice
+
+from materials.cache import invalidate
+from materials.models import Course, Lesson, Subscription
+from materials.signals import invalidate_lessons
+from users.models import User
+from users.roles import forget_roles
+
+
+def iter_chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(len(ordered) * percent / 100) - 1)]
+
+
+def change(old, new):
+    """Изменение метрики между двумя прогонами для сравнения результатов замеров"""
+    if old is None or new is None:
+        return f'{old} -> {new}'
+    delta = f' ({(new - old) / old:+.0%})' if old else ''
+    return f'{old} -> {new}{delta}'
+
+
+@contextmanager
+def preserve_auto_dates(models):
+    """Отключает auto_now/auto_now_add, чтобы bulk_create сохранил переданные даты, как loaddata"""
+    changed = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                changed.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in changed:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def invalidate_imported(model, instances):
+    """Сбрасывает кэш ответов и ролей, который сигналы сбросили бы при обычном сохранении"""
+    if model is Course:
+        invalidate('courses:admin', 'count:materials.course',
+                   *{f'course:{course.pk}' for course in instances},
+                   *{f'courses:owner:{course.owner_id}' for course in instances})
+    elif model is Lesson:
+        invalidate_lessons([(lesson.pk, lesson.owner_id, lesson.course_id) for lesson in instances],
+                           count_changed=True)
+    elif model is Subscription:
+        invalidate(*{f'subscriptions:{subscription.user_id}' for subscription in instances})
+    elif model is User.groups.through:
+        forget_roles({row.user_id for row in instances})
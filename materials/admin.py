@@ -1,8 +1,8 @@
 from django.contrib import admin
 
-from materials.models import Course, Lesson
+from materials.models import Course, Lesson, TaskOutbox
 
 
 admin.site.register(Course)
 admin.site.register(Lesson)
-
+admin.site.register(TaskOutbox)
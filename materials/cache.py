@@ -0,0 +1,112 @@
+import hashlib
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+CACHED_VIEWS = (
+    'CourseViewSet.list',
+    'CourseViewSet.retrieve',
+    'LessonListAPIView.get',
+    'LessonDetailAPIView.get',
+)
+_trackers = []
+
+
+def _tag_key(tag):
+    return f'materials:tag:{tag}'
+
+
+def _stats_key(name, kind):
+    return f'materials:stats:{name}:{kind}'
+
+
+def _incr(key, initial):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, initial, timeout=None)
+
+
+def get_tag_versions(tags):
+    """Возвращает текущие версии тегов, заводя недостающие"""
+    keys = [_tag_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, time.time_ns(), timeout=None)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key, 0) for key in keys]
+
+
+def _bump(tags):
+    for tag in tags:
+        _incr(_tag_key(tag), time.time_ns())
+    for tracked in _trackers:
+        tracked.update(tags)
+
+
+@contextmanager
+def track_invalidations():
+    """Собирает теги, сброшенные внутри блока"""
+    tracked = set()
+    _trackers.append(tracked)
+    try:
+        yield tracked
+    finally:
+        _trackers.remove(tracked)
+
+
+def invalidate(*tags):
+    """Сбрасывает закэшированные ответы, помеченные тегами (сразу и после коммита транзакции)"""
+    tags = [tag for tag in tags if tag]
+    if tags:
+        _bump(tags)
+        transaction.on_commit(lambda: _bump(tags))
+
+
+def record(name, kind):
+    _incr(_stats_key(name, kind), 1)
+
+
+def cache_stats():
+    """Счетчики попаданий и промахов по закэшированным вьюхам"""
+    keys = [_stats_key(name, kind) for name in CACHED_VIEWS for kind in ('hits', 'misses')]
+    values = cache.get_many(keys)
+    stats = {}
+    for name in CACHED_VIEWS:
+        hits = values.get(_stats_key(name, 'hits'), 0)
+        misses = values.get(_stats_key(name, 'misses'), 0)
+        stats[name] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None,
+        }
+    return stats
+
+
+class CachedResponseMixin:
+    """Кэширует успешные GET-ответы по имени вьюхи, области видимости, URL и версиям тегов"""
+
+    def cached_response(self, request, scope, tags, build):
+        name = f'{type(self).__name__}.{getattr(self, "action", None) or request.method.lower()}'
+        versions = get_tag_versions(tags)
+        raw_key = '|'.join([name, scope, request.build_absolute_uri(), *tags, *map(str, versions)])
+        key = 'materials:response:' + hashlib.md5(raw_key.encode()).hexdigest()
+
+        data = cache.get(key)
+        if data is not None:
+            record(name, 'hits')
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        record(name, 'misses')
+        response = build()
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, settings.MATERIALS_CACHE_TTL)
+        response['X-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,170 @@
+from collections import defaultdict
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import FileField, Prefetch
+from django.db.models.fields.related_descriptors import ReverseManyToOneDescriptor
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from config.middleware import track
+
+
+class UnsupportedField(Exception):
+    pass
+
+
+class ValuesMapper:
+    """Собирает представление ModelSerializer из строк .values(), не создавая экземпляры модели.
+
+    Поддерживаются поля и аннотации модели, первичные ключи связей, файлы, методы сериализатора,
+    читающие только поля и аннотации строки, и вложенные списки по обратному внешнему ключу.
+    Для остального бросается UnsupportedField, и вызывающий код идет обычным путем. Что метод сериализатора
+    обращается к связям, выясняется только при вызове: represent() тогда сериализует строки обычным путем.
+    """
+
+    def __init__(self, serializer, queryset):
+        self.queryset = queryset
+        self.pk_column = queryset.model._meta.pk.attname
+        self.columns = [self.pk_column]
+        self.nested = []
+        self.needs_object = False
+        self.getters = [
+            (name, self.compile(field)) for name, field in serializer.fields.items() if not field.write_only
+        ]
+
+    def add_column(self, column):
+        if column not in self.columns:
+            self.columns.append(column)
+
+    def compile(self, field):
+        if isinstance(field, serializers.SerializerMethodField):
+            return self.compile_method(field)
+        if isinstance(field, serializers.ListSerializer):
+            return self.compile_nested(field)
+        if field.source == '*' or '.' in field.source:
+            raise UnsupportedField(field.field_name)
+
+        try:
+            model_field = self.queryset.model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            if field.source not in self.queryset.query.annotations:
+                raise UnsupportedField(field.field_name)
+            model_field = None
+
+        if isinstance(field, serializers.PrimaryKeyRelatedField):
+            if field.pk_field is not None or model_field is None or not model_field.many_to_one:
+                raise UnsupportedField(field.field_name)
+            column = model_field.attname
+            self.add_column(column)
+            return lambda row, obj: row[column]
+        if isinstance(field, (serializers.RelatedField, serializers.ManyRelatedField, serializers.BaseSerializer)):
+            raise UnsupportedField(field.field_name)
+        if model_field is not None and model_field.is_relation:
+            raise UnsupportedField(field.field_name)
+
+        column = model_field.attname if model_field is not None else field.source
+        self.add_column(column)
+        to_representation = field.to_representation
+
+        if isinstance(model_field, FileField):
+            attr_class = model_field.attr_class
+            # DRF всегда получает FieldFile, даже пустой, и сам возвращает None для файла без имени
+            return lambda row, obj: to_representation(attr_class(None, model_field, row[column]))
+
+        def get(row, obj):
+            value = row[column]
+            return None if value is None else to_representation(value)
+        return get
+
+    def compile_method(self, field):
+        method = getattr(field.parent, field.method_name)
+        for column in self.queryset.query.annotations:
+            self.add_column(column)
+        self.needs_object = True
+
+        def call(row, obj):
+            try:
+                return method(obj)
+            except AttributeError as exc:
+                # У строки нет связей модели (например, obj.lesson_set)
+                raise UnsupportedField(field.field_name) from exc
+        return call
+
+    def compile_nested(self, field):
+        descriptor = getattr(self.queryset.model, field.source, None)
+        if not isinstance(descriptor, ReverseManyToOneDescriptor):
+            raise UnsupportedField(field.field_name)
+        foreign_key = descriptor.field
+
+        child_queryset = None
+        for lookup in self.queryset._prefetch_related_lookups:
+            if isinstance(lookup, Prefetch) and lookup.prefetch_to == field.source:
+                child_queryset = lookup.queryset
+        if child_queryset is None:
+            child_queryset = foreign_key.model._default_manager.all()
+
+        mapper = ValuesMapper(field.child, child_queryset)
+        mapper.add_column(foreign_key.attname)
+        nested = {}
+        self.nested.append((mapper, foreign_key, nested))
+        return lambda row, obj: nested.get(row[self.pk_column], [])
+
+    def values(self):
+        return self.queryset.prefetch_related(None).values(*self.columns)
+
+    def load_nested(self, rows):
+        ids = [row[self.pk_column] for row in rows]
+        for mapper, foreign_key, nested in self.nested:
+            nested.clear()
+            if not ids:
+                continue
+            children = list(mapper.values().filter(**{f'{foreign_key.name}__in': ids}))
+            grouped = defaultdict(list)
+            for child, representation in zip(children, mapper.map(children)):
+                grouped[child[foreign_key.attname]].append(representation)
+            nested.update(grouped)
+
+    def map(self, rows):
+        rows = list(rows)
+        self.load_nested(rows)
+        getters = self.getters
+        result = []
+        for row in rows:
+            obj = SimpleNamespace(**row) if self.needs_object else None
+            result.append({name: get(row, obj) for name, get in getters})
+        return result
+
+    def represent(self, rows, serializer):
+        """map(), а если метод сериализатора читает не только строку - serializer для тех же строк в том же порядке"""
+        rows = list(rows)
+        try:
+            return self.map(rows)
+        except UnsupportedField:
+            pks = [row[self.pk_column] for row in rows]
+            instances = self.queryset.in_bulk(pks)
+            return type(serializer)([instances[pk] for pk in pks if pk in instances], many=True,
+                                    context=serializer.context).data
+
+
+class FastListMixin:
+    """Опциональный быстрый путь list() для чтения (FAST_LIST_SERIALIZERS): строки из .values()
+    и заранее собранные преобразователи полей вместо экземпляров модели и обхода полей DRF"""
+
+    def list(self, request, *args, **kwargs):
+        if not settings.FAST_LIST_SERIALIZERS:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = self.get_serializer()
+        try:
+            mapper = ValuesMapper(serializer, queryset)
+        except UnsupportedField:
+            return super().list(request, *args, **kwargs)
+
+        page = self.paginate_queryset(mapper.values())
+        with track('serialize'):
+            data = mapper.represent(page if page is not None else mapper.values(), serializer)
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
@@ -0,0 +1,71 @@
+import time
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from materials.fast_serializers import ValuesMapper
+from materials.models import Course, Lesson, Subscription
+from materials.views import CourseViewSet, LessonListAPIView
+from users.models import Payments, User
+from users.views import PaymentsViewSet, UserListView
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает обычную сериализацию списков с быстрым путем из .values(); данные откатываются после замера'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--lessons', type=int, default=3, help='уроков на курс')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = self.seed(options['rows'], options['lessons'])
+            request = Request(APIRequestFactory().get('/'))
+            request.user = user
+            for view_class in (CourseViewSet, LessonListAPIView, UserListView, PaymentsViewSet):
+                self.bench(view_class, request, options['repeat'])
+            transaction.set_rollback(True)
+
+    def seed(self, rows, lessons):
+        stamp = time.time_ns()
+        user = User.objects.create(email=f'bench-{stamp}@example.com', is_superuser=True)
+        users = User.objects.bulk_create([User(email=f'bench-{stamp}-{i}@example.com', city='Москва')
+                                          for i in range(rows)])
+        courses = Course.objects.bulk_create([Course(name=f'course {i}', owner=user, description='описание')
+                                              for i in range(rows)])
+        Lesson.objects.bulk_create([Lesson(name=f'lesson {j}', course=course, owner=user,
+                                           video='https://www.youtube.com/123')
+                                    for course in courses for j in range(lessons)])
+        Subscription.objects.bulk_create([Subscription(course=course, user=user) for course in courses[::2]])
+        Payments.objects.bulk_create([Payments(user=users[i], paid_course=courses[i], pay_sum=1000,
+                                               payment_status=Payments.STATUS_PAID) for i in range(rows)])
+        return user
+
+    def bench(self, view_class, request, repeat):
+        view = view_class()
+        view.request, view.format_kwarg, view.args, view.kwargs, view.action = request, None, (), {}, 'list'
+
+        def regular():
+            return view.get_serializer(view.get_queryset(), many=True).data
+
+        def fast():
+            mapper = ValuesMapper(view.get_serializer(), view.get_queryset())
+            return mapper.map(mapper.values())
+
+        rows = len(regular())
+        timings = {}
+        for name, build in (('regular', regular), ('fast', fast)):
+            best = min(self.measure(build) for _ in range(repeat))
+            timings[name] = best
+            self.stdout.write(f'{view_class.__name__:<20} {name:<8} {rows} rows: '
+                              f'{best / rows * 1000 * 1000:.1f} ms per 1000 rows ({rows / best:.0f} rows/s)')
+        self.stdout.write(f'{view_class.__name__:<20} speedup x{timings["regular"] / timings["fast"]:.1f}')
+
+    @staticmethod
+    def measure(build):
+        start = time.perf_counter()
+        build()
+        return time.perf_counter() - start
@@ -0,0 +1,62 @@
+import time
+from io import BytesIO
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from config.parsers import ORJSONParser
+from config.renderers import ORJSONRenderer
+from materials.models import Course, Lesson
+from materials.views import CourseViewSet
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает JSONRenderer/JSONParser с orjson на списке курсов с уроками; данные откатываются после замера'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--lessons', type=int, default=5, help='уроков на курс')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = self.seed(options['rows'], options['lessons'])
+            request = Request(APIRequestFactory().get('/'))
+            request.user = user
+            view = CourseViewSet()
+            view.request, view.format_kwarg, view.args, view.kwargs, view.action = request, None, (), {}, 'list'
+            data = view.get_serializer(view.get_queryset(), many=True).data
+            transaction.set_rollback(True)
+
+        repeat = options['repeat']
+        body = JSONRenderer().render(data)
+        self.stdout.write(f'{len(data)} courses, {len(body) / 1024:.0f} KiB')
+        render = {name: min(self.measure(lambda: renderer.render(data)) for _ in range(repeat))
+                  for name, renderer in (('json', JSONRenderer()), ('orjson', ORJSONRenderer()))}
+        parse = {name: min(self.measure(lambda: parser.parse(BytesIO(body))) for _ in range(repeat))
+                 for name, parser in (('json', JSONParser()), ('orjson', ORJSONParser()))}
+        for action, timings in (('render', render), ('parse', parse)):
+            for name, best in timings.items():
+                self.stdout.write(f'{action:<7} {name:<7} {best * 1000:.1f} ms ({len(body) / best / 2 ** 20:.0f} MiB/s)')
+            self.stdout.write(f'{action:<7} speedup x{timings["json"] / timings["orjson"]:.1f}')
+
+    def seed(self, rows, lessons):
+        stamp = time.time_ns()
+        user = User.objects.create(email=f'bench-{stamp}@example.com', is_superuser=True)
+        courses = Course.objects.bulk_create([Course(name=f'курс {i}', owner=user, description='описание курса')
+                                              for i in range(rows)])
+        Lesson.objects.bulk_create([Lesson(name=f'урок {j}', course=course, owner=user, description='описание урока',
+                                           video='https://www.youtube.com/123')
+                                    for course in courses for j in range(lessons)])
+        return user
+
+    @staticmethod
+    def measure(build):
+        start = time.perf_counter()
+        build()
+        return time.perf_counter() - start
@@ -0,0 +1,174 @@
+import json
+import time
+import tracemalloc
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from config.utils import change
+from materials.models import Course, Lesson
+from materials.serializers import CourseSerializer, LessonSerializer
+from users.models import Payments, User
+from users.serializers import PaymentsSerializer, UserSerializer
+
+SERIALIZERS = ('course', 'lesson', 'user', 'payments')
+
+
+def prefetched(instance, related, objects):
+    """Кладет связанные объекты в кэш prefetch_related, как после запроса с Prefetch"""
+    cache_name = related.field.remote_field.get_cache_name()
+    instance._prefetched_objects_cache = {cache_name: objects}
+
+
+class Command(BaseCommand):
+    help = ('Замеряет представление и валидацию CourseSerializer, LessonSerializer, UserSerializer (с платежами) и '
+            'PaymentsSerializer: лучшее время из --repeat и пик выделенной памяти (tracemalloc)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 100, 10000])
+        parser.add_argument('--nested', type=int, nargs='+', default=[0, 5, 20],
+                            help='уроков в курсе и платежей у пользователя')
+        parser.add_argument('--serializers', nargs='+', choices=SERIALIZERS, default=list(SERIALIZERS))
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--output', help='куда записать результаты в JSON')
+        parser.add_argument('--compare', help='сравнить с сохраненными результатами')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be positive')
+        self.repeat = options['repeat']
+        self.results = []
+        self.stdout.write(f'{"benchmark":<44} {"best ms":>10} {"us/obj":>9} {"peak KiB":>10} {"queries":>8}')
+        with transaction.atomic():
+            self.owner = User.objects.create(email=f'bench-{time.time_ns()}@example.com', is_superuser=True)
+            self.course = Course.objects.create(name='bench', owner=self.owner)
+            request = Request(APIRequestFactory().get('/'))
+            request.user = self.owner
+            self.context = {'request': request}
+            self.now = timezone.now()
+            for name in options['serializers']:
+                for size in options['sizes']:
+                    getattr(self, f'bench_{name}')(size, options['nested'])
+            transaction.set_rollback(True)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump({'results': self.results}, file, ensure_ascii=False, indent=2)
+        if options['compare']:
+            self.compare(options['compare'])
+
+    def measure(self, name, size, build):
+        """Лучшее время из repeat прогонов и отдельный прогон под tracemalloc, чтобы он не искажал время"""
+        timings = []
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            for _ in range(self.repeat):
+                start = time.perf_counter()
+                build()
+                timings.append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            build()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        best = min(timings)
+        result = {'name': name, 'size': size, 'best_ms': round(best * 1000, 3),
+                  'per_object_us': round(best / size * 1e6, 2), 'peak_kib': round(peak / 1024, 1),
+                  'queries': len(queries) // self.repeat}
+        self.results.append(result)
+        self.stdout.write(f'{name:<44} {result["best_ms"]:>10.2f} {result["per_object_us"]:>9.1f} '
+                          f'{result["peak_kib"]:>10.1f} {result["queries"]:>8}')
+
+    def lesson(self, pk, course_id):
+        return Lesson(pk=pk, name=f'Урок {pk}', description='описание урока', course_id=course_id,
+                      owner_id=self.owner.pk, video='https://www.youtube.com/watch?v=bench')
+
+    def lesson_payload(self, i):
+        return {'name': f'Урок {i}', 'description': 'описание урока', 'course': self.course.pk,
+                'owner': self.owner.pk, 'video': 'https://www.youtube.com/watch?v=bench'}
+
+    def bench_course(self, size, nested_counts):
+        for nested in nested_counts:
+            courses = []
+            for i in range(size):
+                course = Course(pk=i + 1, name=f'Курс {i}', owner_id=self.owner.pk, description='описание курса',
+                                preview='materials/course.png' if i % 2 else None, last_update=self.now)
+                course.lesson_count, course.is_subscribed = nested, i % 3 == 0
+                prefetched(course, Course.lesson_set, [self.lesson(i * nested + j + 1, course.pk)
+                                                       for j in range(nested)])
+                courses.append(course)
+            self.measure(f'course to_representation n={size} lessons={nested}', size,
+                         lambda: CourseSerializer(courses, many=True, context=self.context).data)
+
+        payload = [{'name': f'Курс {i}', 'description': 'описание курса', 'owner': self.owner.pk}
+                   for i in range(size)]
+        self.measure(f'course validate n={size}', size,
+                     lambda: CourseSerializer(data=payload, many=True, context=self.context).is_valid(
+                         raise_exception=True))
+
+    def bench_lesson(self, size, nested_counts):
+        lessons = [self.lesson(i + 1, self.course.pk) for i in range(size)]
+        self.measure(f'lesson to_representation n={size}', size,
+                     lambda: LessonSerializer(lessons, many=True, context=self.context).data)
+
+        payload = [self.lesson_payload(i) for i in range(size)]
+        self.measure(f'lesson validate n={size}', size,
+                     lambda: LessonSerializer(data=payload, many=True, context=self.context).is_valid(
+                         raise_exception=True))
+
+    def payment(self, pk, user_id):
+        return Payments(pk=pk, user_id=user_id, pay_date=self.now, paid_course_id=self.course.pk, pay_sum=1000,
+                        session_id=f'cs_bench_{pk}', payment_link='https://checkout.stripe.com/pay/cs_bench',
+                        payment_status=Payments.STATUS_PAID)
+
+    def bench_user(self, size, nested_counts):
+        for nested in nested_counts:
+            users = []
+            for i in range(size):
+                user = User(pk=i + 1, email=f'user{i}@example.com', password='x', phone='+7 900 000-00-00',
+                            city='Москва', last_login=self.now, avatar='users/avatar.png' if i % 2 else None)
+                prefetched(user, User.payments_set, [self.payment(i * nested + j + 1, user.pk) for j in range(nested)])
+                users.append(user)
+            self.measure(f'user to_representation n={size} payments={nested}', size,
+                         lambda: UserSerializer(users, many=True, context=self.context).data)
+
+        payload = [{'email': f'new-user{i}@example.com', 'password': 'x', 'city': 'Москва'} for i in range(size)]
+        self.measure(f'user validate n={size}', size,
+                     lambda: UserSerializer(data=payload, many=True, context=self.context).is_valid(
+                         raise_exception=True))
+
+    def bench_payments(self, size, nested_counts):
+        payments = [self.payment(i + 1, self.owner.pk) for i in range(size)]
+        self.measure(f'payments to_representation n={size}', size,
+                     lambda: PaymentsSerializer(payments, many=True, context=self.context).data)
+
+        payload = [{'user': self.owner.pk, 'paid_course': self.course.pk, 'pay_sum': 1000, 'pay_transfer': False}
+                   for _ in range(size)]
+        self.measure(f'payments validate n={size}', size,
+                     lambda: PaymentsSerializer(data=payload, many=True, context=self.context).is_valid(
+                         raise_exception=True))
+
+    def compare(self, path):
+        try:
+            with open(path, encoding='utf-8') as file:
+                base = {result['name']: result for result in json.load(file)['results']}
+        except (OSError, ValueError, KeyError) as exc:
+            raise CommandError(f'Cannot read results {path}: {exc}')
+        for result in self.results:
+            old = base.get(result['name'])
+            if old is None:
+                self.stdout.write(f'{result["name"]:<44} only in current results')
+                continue
+            self.stdout.write(f'{result["name"]:<44} best ms {change(old["best_ms"], result["best_ms"])}, '
+                              f'peak KiB {change(old["peak_kib"], result["peak_kib"])}, '
+                              f'queries {change(old["queries"], result["queries"])}')
@@ -0,0 +1,158 @@
+import random
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from config.utils import invalidate_imported, iter_chunks, preserve_auto_dates
+from materials.models import Course, Lesson, Subscription
+from users.models import Payments, User
+
+PAYMENT_STATUS_WEIGHTS = {
+    Payments.STATUS_PAID: 70,
+    Payments.STATUS_EXPIRED: 12,
+    Payments.STATUS_OPEN: 8,
+    Payments.STATUS_COMPLETE: 3,
+    Payments.STATUS_PENDING: 3,
+    Payments.STATUS_FAILED: 4,
+}
+PRICES = (990, 1490, 2990, 4990, 9990)
+
+
+def parse_range(value):
+    low, _, high = value.partition('-')
+    try:
+        low, high = int(low), int(high or low)
+    except ValueError:
+        raise CommandError(f'Expected N or MIN-MAX, got {value!r}')
+    if not 0 <= low <= high:
+        raise CommandError(f'Expected 0 <= MIN <= MAX, got {value!r}')
+    return low, high
+
+
+class Command(BaseCommand):
+    help = ('Генерирует нагрузочный набор пользователей, курсов, уроков, подписок и платежей; '
+            'при одном и том же --seed данные совпадают')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--courses', type=int, default=1000)
+        parser.add_argument('--authors', type=float, default=0.05, help='доля пользователей, владеющих курсами')
+        parser.add_argument('--lessons-per-course', default='3-20', help='N или MIN-MAX, равномерно')
+        parser.add_argument('--subscriptions', type=int, default=50000, help='всего подписок')
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help='показатель распределения Ципфа для популярности курсов (0 - равномерно)')
+        parser.add_argument('--payments-per-user', type=float, default=2.0, help='в среднем')
+        parser.add_argument('--days', type=int, default=365, help='за сколько дней раскидать даты')
+        parser.add_argument('--anchor', type=date.fromisoformat, default=date(2024, 6, 1),
+                            help='дата (YYYY-MM-DD), от которой отсчитываются --days назад')
+        parser.add_argument('--prefix', default='load', help='префикс email сгенерированных пользователей')
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = datetime.combine(options['anchor'], datetime.min.time(), tzinfo=dt_timezone.utc)
+        self.seconds = options['days'] * 24 * 3600
+        self.counts = Counter()
+        email_prefix = f'{options["prefix"]}-{options["seed"]}-'
+        if User.objects.filter(email__startswith=email_prefix).exists():
+            raise CommandError(f'Users {email_prefix}* already exist, pick another --seed or --prefix')
+        if options['users'] < 1 or options['courses'] < 1:
+            raise CommandError('Need at least one user and one course')
+        if options['days'] < 1:
+            raise CommandError('--days must be positive')
+
+        start = time.perf_counter()
+        with transaction.atomic(), preserve_auto_dates([User, Course, Payments]):
+            user_ids = self.create_users(options['users'], email_prefix)
+            authors = user_ids[:max(1, int(len(user_ids) * options['authors']))]
+            course_ids, owners = self.create_courses(options['courses'], authors)
+            self.create_lessons(course_ids, owners, parse_range(options['lessons_per_course']))
+            popularity = self.popularity(len(course_ids), options['zipf'])
+            self.create_subscriptions(options['subscriptions'], user_ids, course_ids, popularity)
+            self.create_payments(int(len(user_ids) * options['payments_per_user']), user_ids, course_ids, popularity)
+        with connection.cursor() as cursor:
+            # Свежая статистика нужна планировщику и оценке count в пагинации (pg_class.reltuples)
+            for model in (User, Course, Lesson, Subscription, Payments):
+                cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+
+        elapsed = time.perf_counter() - start
+        for label, count in self.counts.items():
+            self.stdout.write(f'{label:<25} {count}')
+        total = sum(self.counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {total} rows in {elapsed:.1f} s ({total / elapsed:.0f} rows/s)'))
+
+    def dates(self, count):
+        return [self.now - timedelta(seconds=self.rng.randrange(self.seconds)) for _ in range(count)]
+
+    def popularity(self, count, exponent):
+        """Накопленные веса курсов: вес курса ранга r равен 1 / r ** exponent, ранги перемешаны"""
+        ranks = list(range(1, count + 1))
+        self.rng.shuffle(ranks)
+        return list(accumulate(1 / rank ** exponent for rank in ranks))
+
+    def insert(self, model, objects):
+        """Пишет объекты пачками по мере генерации и возвращает их pk"""
+        pks = []
+        for chunk in iter_chunks(objects, self.batch_size):
+            batch = model.objects.bulk_create(chunk)
+            invalidate_imported(model, batch)
+            pks.extend(obj.pk for obj in batch)
+        self.counts[model._meta.label] += len(pks)
+        return pks
+
+    def create_users(self, count, email_prefix):
+        password = make_password(None)
+        cities = self.rng.choices(('Москва', 'Санкт-Петербург', 'Казань', 'Новосибирск', None),
+                                  cum_weights=(40, 60, 70, 80, 100), k=count)
+        logins = self.dates(count)
+        return self.insert(User, (
+            User(email=f'{email_prefix}{i}@example.com', password=password, city=city, last_login=last_login)
+            for i, city, last_login in zip(range(count), cities, logins)
+        ))
+
+    def create_courses(self, count, authors):
+        owners = self.rng.choices(authors, k=count)
+        dates = self.dates(count)
+        course_ids = self.insert(Course, (
+            Course(name=f'Курс {i}', owner_id=owner, description='описание курса ' * self.rng.randint(1, 20),
+                   last_update=last_update)
+            for i, owner, last_update in zip(range(count), owners, dates)
+        ))
+        return course_ids, owners
+
+    def create_lessons(self, course_ids, owners, lessons_range):
+        self.insert(Lesson, (
+            Lesson(name=f'Урок {j}', course_id=course_id, owner_id=owner,
+                   video=f'https://www.youtube.com/watch?v={self.rng.getrandbits(40):x}')
+            for course_id, owner in zip(course_ids, owners)
+            for j in range(self.rng.randint(*lessons_range))
+        ))
+
+    def create_subscriptions(self, count, user_ids, course_ids, popularity):
+        # Повторные пары пользователь-курс отбрасываются, поэтому подписок может выйти чуть меньше count
+        users = self.rng.choices(user_ids, k=count)
+        courses = self.rng.choices(course_ids, cum_weights=popularity, k=count)
+        self.insert(Subscription, (Subscription(user_id=user_id, course_id=course_id)
+                                   for user_id, course_id in sorted(set(zip(users, courses)))))
+
+    def create_payments(self, count, user_ids, course_ids, popularity):
+        prices = dict(zip(course_ids, self.rng.choices(PRICES, k=len(course_ids))))
+        users = self.rng.choices(user_ids, k=count)
+        courses = self.rng.choices(course_ids, cum_weights=popularity, k=count)
+        statuses = self.rng.choices(list(PAYMENT_STATUS_WEIGHTS), list(PAYMENT_STATUS_WEIGHTS.values()), k=count)
+        dates = self.dates(count)
+        self.insert(Payments, (
+            Payments(user_id=user_id, paid_course_id=course_id, pay_sum=prices[course_id], pay_date=pay_date,
+                     pay_transfer=self.rng.random() < 0.2, payment_status=payment_status,
+                     session_id=None if payment_status == Payments.STATUS_PENDING
+                     else f'cs_load_{self.rng.getrandbits(64):016x}')
+            for user_id, course_id, payment_status, pay_date in zip(users, courses, statuses, dates)
+        ))
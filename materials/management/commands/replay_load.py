@@ -0,0 +1,424 @@
+import json
+import math
+import random
+import re
+import subprocess
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager, nullcontext
+
+import requests
+import stripe
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from config.middleware import RequestMetrics
+from config.utils import change, percentile
+from materials.cache import invalidate, track_invalidations
+from materials.models import Course, Lesson, TaskOutbox
+from materials.paginators import MaterialsPagination
+from users.models import Payments, User
+from users.services import forget_statuses, track_statuses
+from users.stripe_stub import StripeStubServer
+from users.tasks import provision_checkout
+
+# Формат строки трассы (--trace, JSONL) тот же: name, method, path, data, weight, as (owner|admin) и saves -
+# пул created_*, в который попадает id из ответа. В path и data подставляются {course}, {own_course}, {own_lesson},
+# {open_payment}, {user}, {page}, {n} и {created_*}
+DEFAULT_MIX = [
+    {'name': 'course_list', 'method': 'GET', 'path': '/courses/', 'weight': 20},
+    {'name': 'course_list_admin', 'method': 'GET', 'path': '/courses/?page={page}', 'weight': 8, 'as': 'admin'},
+    {'name': 'course_retrieve', 'method': 'GET', 'path': '/courses/{own_course}/', 'weight': 15},
+    {'name': 'lesson_list', 'method': 'GET', 'path': '/lesson/', 'weight': 10},
+    {'name': 'lesson_retrieve', 'method': 'GET', 'path': '/lesson/{own_lesson}/', 'weight': 10},
+    {'name': 'lesson_create', 'method': 'POST', 'path': '/lesson/create/', 'weight': 6, 'saves': 'created_lesson',
+     'data': {'name': 'replay {n}', 'course': '{own_course}', 'video': 'https://www.youtube.com/watch?v=replay'}},
+    {'name': 'lesson_update', 'method': 'PATCH', 'path': '/lesson/update/{own_lesson}/', 'weight': 5,
+     'data': {'description': 'replay {n}'}},
+    {'name': 'lesson_delete', 'method': 'DELETE', 'path': '/lesson/delete/{created_lesson}/', 'weight': 4},
+    {'name': 'subscription_toggle', 'method': 'POST', 'path': '/subs/create/', 'weight': 10,
+     'data': {'course': '{course}'}},
+    {'name': 'payment_create', 'method': 'POST', 'path': '/payments/', 'weight': 6,
+     'data': {'user': '{user}', 'paid_course': '{course}', 'pay_sum': 1000}},
+    {'name': 'payment_status', 'method': 'GET', 'path': '/payments/{open_payment}/status/', 'weight': 6},
+]
+ADMIN_EMAIL = 'replay-admin@example.com'
+PLACEHOLDER = re.compile(r'\{(\w+)\}')
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+# Задачи из outbox, которые в процессе выполняются сразу после запроса; их замеры идут отдельным маршрутом
+INLINE_TASKS = {provision_checkout.name: provision_checkout}
+
+
+class Skip(Exception):
+    """Для шаблона нет подходящих данных (например, еще нечего удалять) - берется другой запрос"""
+
+
+def summarize(samples, elapsed):
+    latencies = [latency * 1000 for latency, _, _ in samples]
+    queries = [count for _, count, _ in samples if count is not None]
+    return {
+        'requests': len(samples),
+        'rps': round(len(samples) / elapsed, 1),
+        'errors': sum(code >= 400 for _, _, code in samples),
+        'statuses': dict(Counter(str(code) for _, _, code in samples)),
+        'mean_ms': round(sum(latencies) / len(latencies), 2),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'queries_mean': round(sum(queries) / len(queries), 2) if queries else None,
+        'queries_max': max(queries) if queries else None,
+    }
+
+
+class Actor:
+    def __init__(self, user, courses, lessons):
+        self.user = user
+        self.token = str(AccessToken.for_user(user))
+        self.pools = {'own_course': courses, 'own_lesson': lessons}
+
+
+class Workload:
+    """Пользователи, от имени которых идут запросы, и пулы id для подстановки в шаблоны"""
+
+    def __init__(self, rng, actors, admin=None, sample_size=1000):
+        self.rng = rng
+        self.lock = threading.Lock()
+        owner_ids = list(Course.objects.filter(owner__isnull=False).order_by('owner_id')
+                         .values_list('owner_id', flat=True).distinct()[:sample_size])
+        if not owner_ids:
+            raise CommandError('No courses with owners, fill the database first (generate_dataset)')
+        courses = list(Course.objects.order_by('pk').values_list('pk', flat=True)[:sample_size])
+        lessons = list(Lesson.objects.order_by('pk').values_list('pk', flat=True)[:sample_size])
+        self.pages = max(1, math.ceil(Course.objects.count() / MaterialsPagination.page_size))
+        self.pools = {
+            'course': courses,
+            'open_payment': list(Payments.objects.filter(session_id__isnull=False)
+                                 .exclude(payment_status__in=Payments.TERMINAL_STATUSES)
+                                 .order_by('pk').values_list('pk', flat=True)[:sample_size]),
+        }
+
+        self.actors = {'admin': [Actor(admin, courses, lessons)] if admin else [], 'owner': []}
+        for owner in User.objects.filter(pk__in=rng.sample(owner_ids, min(actors, len(owner_ids)))).order_by('pk'):
+            self.actors['owner'].append(Actor(
+                owner,
+                list(Course.objects.filter(owner=owner).order_by('pk').values_list('pk', flat=True)[:sample_size]),
+                list(Lesson.objects.filter(owner=owner).order_by('pk').values_list('pk', flat=True)[:sample_size]),
+            ))
+
+    def value(self, name, actor, n):
+        if name == 'n':
+            return n
+        if name == 'user':
+            return actor.user.pk
+        if name == 'page':
+            return self.rng.randint(1, self.pages)
+        if name.startswith('created_'):
+            # Созданные запросами объекты расходуются: каждый удаляется не больше одного раза
+            created = actor.pools.setdefault(name, [])
+            if not created:
+                raise Skip(name)
+            return created.pop(self.rng.randrange(len(created)))
+        pool = actor.pools.get(name, self.pools.get(name))
+        if pool is None:
+            raise CommandError(f'Unknown placeholder {{{name}}}')
+        if not pool:
+            raise Skip(name)
+        return self.rng.choice(pool)
+
+    def build(self, mix, weights, n):
+        """Выбирает шаблон запроса и подставляет в него значения; одинаковые плейсхолдеры получают одно значение"""
+        with self.lock:
+            entry = self.rng.choices(mix, weights)[0]
+            actor = self.rng.choice(self.actors[entry.get('as', 'owner')])
+            values = {}
+
+            def substitute(template):
+                if not isinstance(template, str):
+                    return template
+                whole = PLACEHOLDER.fullmatch(template)
+                for name in PLACEHOLDER.findall(template):
+                    if name not in values:
+                        values[name] = self.value(name, actor, n)
+                if whole:
+                    return values[whole.group(1)]
+                return PLACEHOLDER.sub(lambda match: str(values[match.group(1)]), template)
+
+            path = substitute(entry['path'])
+            data = {key: substitute(value) for key, value in entry['data'].items()} if 'data' in entry else None
+        return entry, actor, path, data
+
+    def saved(self, entry, actor, body):
+        if entry.get('saves'):
+            try:
+                pk = json.loads(body)['id']
+            except (ValueError, KeyError, TypeError):
+                return
+            with self.lock:
+                actor.pools.setdefault(entry['saves'], []).append(pk)
+
+
+class InProcessSender:
+    """Запросы через тестовый клиент Django в текущем процессе, в той же транзакции, что и подготовка данных"""
+
+    def __init__(self):
+        self.client = Client()
+        self.last_task = TaskOutbox.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+    def send(self, method, path, data, token):
+        response = self.client.generic(method, path, json.dumps(data) if data is not None else '',
+                                       content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return response.status_code, response.get('Server-Timing', ''), response.content
+
+    def run_tasks(self):
+        """Выполняет задачи INLINE_TASKS, поставленные в outbox последним запросом, и отмечает их отправленными,
+        чтобы relay_outbox не отправил их еще раз. Возвращает (маршрут, время, SQL-запросы, код) по каждой задаче"""
+        rows = list(TaskOutbox.objects.filter(pk__gt=self.last_task, task__in=INLINE_TASKS,
+                                              published_at__isnull=True).order_by('pk'))
+        self.last_task = TaskOutbox.objects.order_by('-pk').values_list('pk', flat=True).first() or self.last_task
+        samples = []
+        for row in rows:
+            metrics = RequestMetrics(slow_query_limit=0)
+            start = time.perf_counter()
+            with connection.execute_wrapper(metrics):
+                result = INLINE_TASKS[row.task].apply(args=row.args, kwargs=row.kwargs)
+            latency = time.perf_counter() - start
+            samples.append((row.task.rsplit('.', 1)[-1], latency, metrics.queries, 500 if result.failed() else 200))
+        if rows:
+            TaskOutbox.objects.filter(pk__in=[row.pk for row in rows]).update(published_at=timezone.now())
+        return samples
+
+
+class HTTPSender:
+    """Запросы к запущенному серверу; у каждого потока свое keep-alive соединение"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.local = threading.local()
+
+    def send(self, method, path, data, token):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        response = session.request(method, self.base_url + path, json=data, timeout=60,
+                                   headers={'Authorization': f'Bearer {token}'})
+        return response.status_code, response.headers.get('Server-Timing', ''), response.content
+
+    def run_tasks(self):
+        # Задачи выполняют воркеры Celery запущенного сервера
+        return []
+
+
+def current_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                                capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+class Command(BaseCommand):
+    help = ('Воспроизводит смесь запросов к API (в процессе или к запущенному серверу, Stripe - локальная '
+            'заглушка) и считает пропускную способность, p50/p95/p99 и число SQL-запросов по маршрутам')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--warmup', type=int, default=100, help='запросов до начала замера')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--actors', type=int, default=20, help='сколько владельцев курсов шлют запросы')
+        parser.add_argument('--trace', help='JSONL со смесью запросов вместо встроенной')
+        parser.add_argument('--base-url', help='адрес запущенного сервера; без него запросы идут в процессе')
+        parser.add_argument('--concurrency', type=int, default=1, help='параллельных запросов (только с --base-url)')
+        parser.add_argument('--commit', action='store_true',
+                            help='сохранить изменения, сделанные запросами (в процессе они откатываются)')
+        parser.add_argument('--admin', metavar='EMAIL',
+                            help='суперпользователь для запросов as=admin; нужен с --base-url и --commit, '
+                                 'без них создается временный, который откатывается вместе с прогоном')
+        parser.add_argument('--stripe-latency', type=float, default=0.02, help='задержка ответа заглушки Stripe, сек')
+        parser.add_argument('--stripe-port', type=int,
+                            help='порт заглушки Stripe; сервер для --base-url запускают с STRIPE_API_BASE на нее '
+                                 'и любым STRIPE_API_KEY')
+        parser.add_argument('--output', help='куда записать результаты в JSON')
+        parser.add_argument('--compare', nargs='+', metavar='RESULTS',
+                            help='сравнить с сохраненными результатами; с двумя файлами - только сравнить их')
+
+    def handle(self, *args, **options):
+        if options['compare'] and len(options['compare']) > 2:
+            raise CommandError('--compare takes one or two result files')
+        if options['compare'] and len(options['compare']) == 2:
+            base, current = (self.load(path) for path in options['compare'])
+            return self.compare(base, current)
+        if options['actors'] < 1 or options['requests'] < 1:
+            raise CommandError('--actors and --requests must be positive')
+        if options['concurrency'] > 1 and not options['base_url']:
+            raise CommandError('In-process replay is sequential, use --base-url for --concurrency > 1')
+
+        mix = self.load_mix(options['trace'])
+        with ExitStack() as stack:
+            stub = None
+            if not options['base_url'] or options['stripe_port'] is not None:
+                stub = StripeStubServer(options['stripe_latency'], port=options['stripe_port'] or 0)
+                stack.enter_context(stub)
+            if options['base_url']:
+                sender = HTTPSender(options['base_url'])
+                if stub is not None:
+                    self.stdout.write(f'Stripe stub at {stub.url}, the server must run with '
+                                      f'STRIPE_API_BASE={stub.url} STRIPE_API_KEY=sk_test_stub')
+            else:
+                sender = InProcessSender()
+                self.patch_stripe(stack, stub.url)
+                if not options['commit']:
+                    stack.enter_context(self.rollback())
+            results = self.run(sender, mix, options)
+
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+        if options['compare']:
+            self.compare(self.load(options['compare'][0]), results)
+
+    def load_mix(self, path):
+        if not path:
+            return DEFAULT_MIX
+        try:
+            with open(path, encoding='utf-8') as file:
+                mix = [json.loads(line) for line in file if line.strip()]
+        except (OSError, ValueError) as exc:
+            raise CommandError(f'Cannot read trace {path}: {exc}')
+        for entry in mix:
+            if not isinstance(entry, dict) or not {'name', 'method', 'path'} <= entry.keys():
+                raise CommandError(f'Trace entries need name, method and path: {entry!r:.200}')
+        return mix
+
+    @staticmethod
+    def load(path):
+        try:
+            with open(path, encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError) as exc:
+            raise CommandError(f'Cannot read results {path}: {exc}')
+
+    @staticmethod
+    def patch_stripe(stack, url):
+        api_base, api_key = stripe.api_base, stripe.api_key
+        stripe.api_base, stripe.api_key = url, 'sk_test_stub'
+        stack.callback(setattr, stripe, 'api_base', api_base)
+        stack.callback(setattr, stripe, 'api_key', api_key)
+
+    @staticmethod
+    @contextmanager
+    def rollback():
+        """Откатывает изменения запросов. on_commit-хуки при откате не срабатывают, а ответы, закэшированные
+        по ходу прогона, содержат откаченные строки, поэтому сброшенные за прогон теги сбрасываются еще раз.
+        Статусы сессий, закэшированные за прогон, пришли от заглушки Stripe и удаляются"""
+        with track_invalidations() as tags, track_statuses() as session_ids:
+            try:
+                with transaction.atomic():
+                    yield
+                    transaction.set_rollback(True)
+            finally:
+                invalidate(*tags)
+                forget_statuses(session_ids)
+
+    @staticmethod
+    def admin(mix, options):
+        if options['admin']:
+            admin = User.objects.filter(email=options['admin'], is_superuser=True).first()
+            if admin is None:
+                raise CommandError(f'No superuser with email {options["admin"]}')
+            return admin
+        if not any(entry.get('as') == 'admin' for entry in mix):
+            return None
+        if options['base_url'] or options['commit']:
+            raise CommandError('The mix has admin requests, pass --admin with an existing superuser')
+        admin, _ = User.objects.get_or_create(email=ADMIN_EMAIL, defaults={'is_superuser': True, 'is_staff': True})
+        return admin
+
+    def run(self, sender, mix, options):
+        rng = random.Random(options['seed'])
+        workload = Workload(rng, options['actors'], self.admin(mix, options))
+        weights = [entry.get('weight', 1) for entry in mix]
+        samples = defaultdict(list)
+        # Задачи, выполненные в процессе, - отдельные маршруты, не входящие в total
+        task_samples = defaultdict(list)
+
+        def one(n, record):
+            for _ in range(100):
+                try:
+                    entry, actor, path, data = workload.build(mix, weights, n)
+                    break
+                except Skip:
+                    continue
+            else:
+                raise CommandError('No request in the mix can be built from the current data')
+
+            start = time.perf_counter()
+            code, server_timing, body = sender.send(entry['method'], path, data, actor.token)
+            latency = time.perf_counter() - start
+            if code < 400:
+                workload.saved(entry, actor, body)
+            tasks = sender.run_tasks()
+            if record:
+                match = SERVER_TIMING_QUERIES.search(server_timing)
+                samples[entry['name']].append((latency, int(match.group(1)) if match else None, code))
+                for name, *sample in tasks:
+                    task_samples[name].append(tuple(sample))
+
+        for n in range(options['warmup']):
+            one(n, record=False)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) if options['concurrency'] > 1 else nullcontext() as pool:
+            if pool is None:
+                for n in range(options['requests']):
+                    one(n, record=True)
+            else:
+                list(pool.map(lambda n: one(n, record=True), range(options['requests'])))
+        # Время задач не входит в пропускную способность запросов
+        elapsed = time.perf_counter() - start
+        elapsed -= sum(latency for route in task_samples.values() for latency, _, _ in route)
+
+        all_samples = [sample for route in samples.values() for sample in route]
+        return {
+            'meta': {
+                'commit': current_commit(),
+                'created_at': timezone.now().isoformat(),
+                'mode': options['base_url'] or 'in-process',
+                'requests': options['requests'],
+                'warmup': options['warmup'],
+                'concurrency': options['concurrency'],
+                'seed': options['seed'],
+                'trace': options['trace'] or 'default',
+            },
+            'total': {**summarize(all_samples, elapsed), 'elapsed_s': round(elapsed, 2)},
+            'routes': {name: summarize(route, elapsed) for name, route in sorted({**samples, **task_samples}.items())},
+        }
+
+    def report(self, results):
+        self.stdout.write(f'{"route":<22} {"n":>6} {"rps":>8} {"p50":>8} {"p95":>8} {"p99":>8} '
+                          f'{"queries":>8} {"errors":>6}')
+        for name, row in [*results['routes'].items(), ('total', results['total'])]:
+            queries = '-' if row['queries_mean'] is None else f'{row["queries_mean"]:.1f}'
+            self.stdout.write(f'{name:<22} {row["requests"]:>6} {row["rps"]:>8.1f} {row["p50_ms"]:>8.1f} '
+                              f'{row["p95_ms"]:>8.1f} {row["p99_ms"]:>8.1f} {queries:>8} {row["errors"]:>6}')
+
+    def compare(self, base, current):
+        self.stdout.write(f'{base["meta"].get("commit")} -> {current["meta"].get("commit")}')
+        routes = {**base['routes'], **current['routes']}
+        for name in [*sorted(routes), 'total']:
+            old = base['total'] if name == 'total' else base['routes'].get(name)
+            new = current['total'] if name == 'total' else current['routes'].get(name)
+            if old is None or new is None:
+                self.stdout.write(f'{name:<22} only in {"current" if old is None else "base"} results')
+                continue
+            self.stdout.write(f'{name:<22} p50 {change(old["p50_ms"], new["p50_ms"])}, '
+                              f'p95 {change(old["p95_ms"], new["p95_ms"])}, '
+                              f'p99 {change(old["p99_ms"], new["p99_ms"])}, '
+                              f'queries {change(old["queries_mean"], new["queries_mean"])}, '
+                              f'rps {change(old["rps"], new["rps"])}')
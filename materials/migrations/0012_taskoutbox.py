@@ -0,0 +1,36 @@
+# Generated by Django 5.0.14 on 2026-10-18 10:09
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0011_remove_lesson_last_update_course_last_update'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=200, verbose_name='задача')),
+                ('args', models.JSONField(default=list, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='аргументы')),
+                ('kwargs', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='именованные аргументы')),
+                ('dedup_key', models.CharField(blank=True, max_length=200, null=True, verbose_name='ключ дедупликации')),
+                ('eta', models.DateTimeField(blank=True, null=True, verbose_name='отправить не раньше')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='создана')),
+                ('published_at', models.DateTimeField(blank=True, null=True, verbose_name='отправлена')),
+            ],
+            options={
+                'verbose_name': 'задача на отправку',
+                'verbose_name_plural': 'задачи на отправку',
+                'indexes': [models.Index(condition=models.Q(('published_at__isnull', True)), fields=['eta'], name='outbox_pending_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='taskoutbox',
+            constraint=models.UniqueConstraint(condition=models.Q(('published_at__isnull', True)), fields=('dedup_key',), name='outbox_pending_dedup_key'),
+        ),
+    ]
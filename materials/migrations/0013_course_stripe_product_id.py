@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0012_taskoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='stripe_product_id',
+            field=models.CharField(blank=True, max_length=100, null=True, verbose_name='id продукта stripe'),
+        ),
+    ]
@@ -1,15 +1,70 @@
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import Count, Exists, OuterRef, Prefetch, Q, Value
 
 NULLABLE = {'blank': True, 'null': True}
 
 
-class Course(models.Model):
+class CourseQuerySet(models.QuerySet):
+
+    def with_listing_data(self, user):
+        """Добавляет количество уроков, признак подписки пользователя и уроки одним набором запросов"""
+        if user is not None and user.id is not None:
+            subscribed = Exists(Subscription.objects.filter(course=OuterRef('pk'), user=user.id))
+        else:
+            subscribed = Value(False)
+        return self.annotate(
+            lesson_count=Count('lesson'),
+            is_subscribed=subscribed,
+        ).prefetch_related(
+            Prefetch('lesson_set', queryset=Lesson.objects.order_by('id')),
+        )
+
+
+class LoadedValuesMixin:
+    """Запоминает значения полей loaded_fields, прочитанные из базы или сохраненные в нее.
+
+    Сигналам нужно заметить переименование курса или смену владельца урока; прежние значения берутся отсюда,
+    без лишнего SELECT перед каждым сохранением.
+    """
+    loaded_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values)
+            if name in cls.loaded_fields and value is not models.DEFERRED
+        }
+        return instance
+
+    def remember_loaded_values(self, fields=None):
+        loaded = self.__dict__.setdefault('_loaded_values', {})
+        for name in self.loaded_fields:
+            field = self._meta.get_field(name)
+            if name in self.__dict__ and (fields is None or {field.name, field.attname} & set(fields)):
+                loaded[name] = self.__dict__[name]
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using, fields, **kwargs)
+        self.remember_loaded_values(fields)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.remember_loaded_values(kwargs.get('update_fields'))
+
+
+class Course(LoadedValuesMixin, models.Model):
     name = models.CharField(max_length=50, verbose_name='название курса')
     preview = models.ImageField(upload_to='materials/', verbose_name='превью', **NULLABLE)
     description = models.TextField(verbose_name='описание', **NULLABLE)
     owner = models.ForeignKey('users.User', on_delete=models.SET_NULL, verbose_name='Владелец', **NULLABLE)
     last_update = models.DateTimeField(verbose_name="Последнее обновление", **NULLABLE)
+    stripe_product_id = models.CharField(max_length=100, verbose_name='id продукта stripe', **NULLABLE)
+
+    objects = CourseQuerySet.as_manager()
+    loaded_fields = ('name', 'owner_id')
 
     def __str__(self):
         return f"{self.name}"
@@ -19,7 +74,7 @@ class Course(models.Model):
         verbose_name_plural = 'курсы'
 
 
-class Lesson(models.Model):
+class Lesson(LoadedValuesMixin, models.Model):
     name = models.CharField(max_length=50, verbose_name='название урока')
     description = models.TextField(verbose_name='описание', **NULLABLE)
     preview = models.ImageField(upload_to='materials/', verbose_name='превью', **NULLABLE)
@@ -27,6 +82,8 @@ class Lesson(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE, verbose_name='курс')
     owner = models.ForeignKey('users.User', on_delete=models.SET_NULL, verbose_name='Владелец', **NULLABLE)
 
+    loaded_fields = ('owner_id', 'course_id')
+
     def __str__(self):
         return f"{self.name}"
 
@@ -45,3 +102,28 @@ class Subscription(models.Model):
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+
+
+class TaskOutbox(models.Model):
+    """Задача Celery, записанная в одной транзакции с изменением данных и ожидающая отправки в брокер"""
+    task = models.CharField(max_length=200, verbose_name='задача')
+    args = models.JSONField(default=list, encoder=DjangoJSONEncoder, verbose_name='аргументы')
+    kwargs = models.JSONField(default=dict, encoder=DjangoJSONEncoder, verbose_name='именованные аргументы')
+    dedup_key = models.CharField(max_length=200, verbose_name='ключ дедупликации', **NULLABLE)
+    eta = models.DateTimeField(verbose_name='отправить не раньше', **NULLABLE)
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='создана')
+    published_at = models.DateTimeField(verbose_name='отправлена', **NULLABLE)
+
+    def __str__(self):
+        return f'{self.task} #{self.pk}'
+
+    class Meta:
+        verbose_name = 'задача на отправку'
+        verbose_name_plural = 'задачи на отправку'
+        constraints = [
+            models.UniqueConstraint(fields=['dedup_key'], condition=Q(published_at__isnull=True),
+                                    name='outbox_pending_dedup_key'),
+        ]
+        indexes = [
+            models.Index(fields=['eta'], condition=Q(published_at__isnull=True), name='outbox_pending_idx'),
+        ]
@@ -0,0 +1,73 @@
+from datetime import timedelta
+
+from celery import current_app
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from materials.models import TaskOutbox
+
+
+def enqueue_task(task, args=(), kwargs=None, countdown=None, dedup_key=None):
+    """Записывает задачу в outbox в текущей транзакции; в брокер ее отправит relay_outbox после коммита.
+
+    Пока задача с тем же dedup_key не отправлена, повторные вызовы ничего не добавляют.
+    """
+    TaskOutbox.objects.bulk_create([
+        TaskOutbox(
+            task=getattr(task, 'name', task),
+            args=list(args),
+            kwargs=kwargs or {},
+            dedup_key=dedup_key,
+            eta=timezone.now() + timedelta(seconds=countdown) if countdown else None,
+        )
+    ], ignore_conflicts=True)
+
+
+def relay_outbox_batch(batch_size):
+    """Отправляет в брокер одну пачку созревших задач через общий producer и отмечает их отправленными.
+
+    Доставка - не реже одного раза: если процесс упадет между отправкой и коммитом, задачи уйдут повторно.
+    При ошибке брокера посреди пачки уже отправленные задачи все равно отмечаются, а ошибка пробрасывается.
+    """
+    now = timezone.now()
+    sent = []
+    error = None
+    with transaction.atomic():
+        rows = list(
+            TaskOutbox.objects.select_for_update(skip_locked=True)
+            .filter(Q(eta__isnull=True) | Q(eta__lte=now), published_at__isnull=True)
+            .order_by('id')[:batch_size]
+        )
+        if not rows:
+            return 0
+        try:
+            with current_app.producer_or_acquire() as producer:
+                for row in rows:
+                    current_app.send_task(row.task, args=row.args, kwargs=row.kwargs,
+                                          task_id=f'outbox-{row.pk}', producer=producer)
+                    sent.append(row.pk)
+        except Exception as exc:
+            error = exc
+        TaskOutbox.objects.filter(pk__in=sent).update(published_at=now)
+    if error is not None:
+        raise error
+    return len(sent)
+
+
+def relay_outbox_pending():
+    """Выгребает outbox пачками по OUTBOX_BATCH_SIZE"""
+    published = 0
+    while True:
+        count = relay_outbox_batch(settings.OUTBOX_BATCH_SIZE)
+        published += count
+        if count < settings.OUTBOX_BATCH_SIZE:
+            break
+    return published
+
+
+def purge_outbox():
+    """Удаляет давно отправленные записи outbox; запускается редко, отдельно от relay"""
+    deleted, _ = TaskOutbox.objects.filter(published_at__lt=timezone.now() - settings.OUTBOX_RETENTION).delete()
+    return deleted
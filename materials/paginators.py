@@ -1,7 +1,148 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+
+from materials.cache import get_tag_versions
+
+
+def estimate_table_rows(queryset):
+    """Оценка числа строк таблицы по статистике PostgreSQL (pg_class.reltuples), None - если оценки нет.
+
+    Статистика меняется только после ANALYZE, поэтому оценка кэшируется, а не читается на каждой странице.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    table = queryset.model._meta.db_table
+    key = f'materials:reltuples:{queryset.db}:{table}'
+    reltuples = cache.get(key)
+    if reltuples is None:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [table])
+            row = cursor.fetchone()
+        reltuples = row[0] if row else -1
+        cache.set(key, reltuples, settings.PAGINATION_ESTIMATE_CACHE_TTL)
+    # -1 означает, что таблицу еще ни разу не анализировали
+    return int(reltuples) if reltuples >= 0 else None
+
+
+class ApproximatePage(Page):
+    """Страница при приблизительном count: есть ли следующая, решает лишняя прочитанная строка, а не count"""
+
+    def __init__(self, object_list, number, paginator, has_more):
+        super().__init__(object_list, number, paginator)
+        self.has_more = has_more
+
+    def has_next(self):
+        return self.has_more
+
+
+class ApproximateCountPaginator(Paginator):
+    """Считает точно только небольшие таблицы, для больших берет оценку или закэшированное значение"""
+    approximate = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        estimate = estimate_table_rows(queryset) if hasattr(queryset, 'query') else None
+        if estimate is None or estimate < settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD:
+            return super().count
+
+        self.approximate = True
+        if not queryset.query.has_filters():
+            return estimate
+
+        version, = get_tag_versions([f'count:{queryset.model._meta.label_lower}'])
+        sql = str(queryset.values('pk').query)
+        key = f'materials:count:{hashlib.md5(sql.encode()).hexdigest()}:{version}'
+        count = cache.get(key)
+        if count is None:
+            count = super().count
+            cache.set(key, count, settings.PAGINATION_COUNT_CACHE_TTL)
+        return count
+
+    def validate_number(self, number):
+        if not (self.count and self.approximate):
+            return super().validate_number(number)
+        # Приблизительный count не ограничивает номер страницы: пустая ли она, видно только по самим строкам
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if not self.approximate:
+            return super().page(number)
+
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage('That page contains no results')
+        has_more = len(rows) > self.per_page
+        if not has_more:
+            # Дошли до конца - count теперь известен точно
+            self.__dict__['count'] = bottom + len(rows)
+            self.approximate = False
+        elif self.count < bottom + len(rows):
+            self.__dict__['count'] = bottom + len(rows)
+        return ApproximatePage(rows[:self.per_page], number, self, has_more)
 
 
 class MaterialsPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page size'
     max_page_size = 100
+    django_paginator_class = ApproximateCountPaginator
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.page.paginator.approximate:
+            response.data['count_approximate'] = True
+        return response
+
+
+class MaterialsCursorPagination(CursorPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = 'id'
+
+
+class SwitchablePagination(BasePagination):
+    """Обычная пагинация по умолчанию, курсорная - по ?pagination=cursor (или при переданном курсоре)"""
+    mode_query_param = 'pagination'
+    page_class = MaterialsPagination
+    cursor_class = MaterialsCursorPagination
+
+    def __init__(self):
+        self.paginator = None
+
+    def use_cursor(self, request):
+        return (request.query_params.get(self.mode_query_param) == 'cursor'
+                or self.cursor_class.cursor_query_param in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        paginator_class = self.cursor_class if self.use_cursor(request) else self.page_class
+        if paginator_class is None:
+            return None
+        self.paginator = paginator_class()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    @property
+    def display_page_controls(self):
+        return getattr(self.paginator, 'display_page_controls', False)
+
+    def to_html(self):
+        return self.paginator.to_html()
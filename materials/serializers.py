@@ -1,38 +1,97 @@
 from rest_framework import serializers
 
+from config.serializers import TimedListSerializer, TimedModelSerializer
 from materials.models import Course, Lesson, Subscription
 from materials.validators import validate_youtube_url
 
 
-class LessonSerializer(serializers.ModelSerializer):
+class PrefetchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Берет связанные объекты из загруженных заранее, если они есть в контексте сериализатора"""
+
+    def to_internal_value(self, data):
+        prefetched = self.context.get('prefetched', {}).get(self.field_name)
+        if prefetched is None:
+            return super().to_internal_value(data)
+        try:
+            return prefetched[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class LessonBulkSerializer(TimedListSerializer):
+    """Массовая запись уроков: связи загружаются одним запросом на поле, запись - bulk_create/bulk_update"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.context['prefetched'] = {
+                name: field.get_queryset().in_bulk({
+                    int(item[name]) for item in data
+                    if isinstance(item, dict) and str(item.get(name, '')).isdigit()
+                })
+                for name, field in self.child.fields.items()
+                if isinstance(field, PrefetchedPrimaryKeyRelatedField) and not field.read_only
+            }
+        if self.instance is not None:
+            self._instances = iter(self.instance)
+        return super().to_internal_value(data)
+
+    def run_child_validation(self, data):
+        if self.instance is not None:
+            self.child.instance = next(self._instances)
+        return super().run_child_validation(data)
+
+    def create(self, validated_data):
+        return Lesson.objects.bulk_create([Lesson(**attrs) for attrs in validated_data])
+
+    def update(self, instances, validated_data):
+        fields = set()
+        for lesson, attrs in zip(instances, validated_data):
+            for name, value in attrs.items():
+                setattr(lesson, name, value)
+            fields.update(attrs)
+        if fields:
+            Lesson.objects.bulk_update(instances, sorted(fields))
+        return instances
+
+
+class LessonSerializer(TimedModelSerializer):
+    serializer_related_field = PrefetchedPrimaryKeyRelatedField
     video = serializers.URLField(validators=[validate_youtube_url])
 
     class Meta:
         model = Lesson
         fields = '__all__'
+        list_serializer_class = LessonBulkSerializer
 
 
-class CourseSerializer(serializers.ModelSerializer):
+class CourseSerializer(TimedModelSerializer):
     lesson_count = serializers.SerializerMethodField()
     subscription = serializers.SerializerMethodField()
     lesson = LessonSerializer(source="lesson_set", many=True, read_only=True)
 
     def get_subscription(self, course):
+        subscribed = getattr(course, 'is_subscribed', None)
+        if subscribed is not None:
+            return subscribed
         owner = self.context['request'].user
-        subscription = Subscription.objects.filter(course=course.id, user=owner.id)
-        if subscription:
-            return True
-        return False
+        return Subscription.objects.filter(course=course.id, user=owner.id).exists()
 
     def get_lesson_count(self, obj):
+        lesson_count = getattr(obj, 'lesson_count', None)
+        if lesson_count is not None:
+            return lesson_count
         return obj.lesson_set.count()
 
     class Meta:
         model = Course
         fields = ['id', 'name', 'owner', 'preview', 'last_update', 'description', 'lesson_count', 'lesson', 'subscription']
+        list_serializer_class = TimedListSerializer
 
 
-class SubscriptionSerializer(serializers.ModelSerializer):
+class SubscriptionSerializer(TimedModelSerializer):
     class Meta:
         model = Subscription
         fields = '__all__'
+        list_serializer_class = TimedListSerializer
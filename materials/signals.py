@@ -0,0 +1,106 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from materials.cache import invalidate
+from materials.models import Course, Lesson, Subscription
+
+_pending_lessons = ContextVar('pending_lessons', default=None)
+
+
+def course_tags(course_ids):
+    """Теги списков и карточек курсов, в которые вложены уроки этих курсов"""
+    tags = {'courses:admin', *(f'course:{course_id}' for course_id in course_ids)}
+    owner_ids = Course.objects.filter(pk__in=course_ids).values_list('owner_id', flat=True)
+    tags.update(f'courses:owner:{owner_id}' for owner_id in owner_ids)
+    return tags
+
+
+def _remember_previous(instance, *fields):
+    """Прежние значения полей: из прочитанных из базы, запрос - только если их нет"""
+    instance._cache_previous = {}
+    if instance._state.adding or not instance.pk:
+        return
+    loaded = getattr(instance, '_loaded_values', {})
+    if all(field in loaded for field in fields):
+        instance._cache_previous = {field: loaded[field] for field in fields}
+    else:
+        previous = type(instance).objects.filter(pk=instance.pk).values(*fields).first()
+        instance._cache_previous = previous or {}
+
+
+@receiver(pre_save, sender=Course)
+def remember_course_owner(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'owner' in update_fields:
+        _remember_previous(instance, 'owner_id')
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def invalidate_course(sender, instance, **kwargs):
+    previous = getattr(instance, '_cache_previous', {})
+    owner_ids = {instance.owner_id, previous.get('owner_id', instance.owner_id)}
+    invalidate(
+        'courses:admin',
+        f'course:{instance.pk}',
+        *(f'courses:owner:{owner_id}' for owner_id in owner_ids),
+        'count:materials.course' if kwargs.get('created', True) or len(owner_ids) > 1 else None,
+    )
+
+
+@receiver(pre_save, sender=Lesson)
+def remember_lesson_owner(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {'owner', 'course'} & set(update_fields):
+        _remember_previous(instance, 'owner_id', 'course_id')
+
+
+def invalidate_lessons(changes, count_changed=False):
+    """Сбрасывает кэш для уроков; changes - кортежи (id урока, id владельца, id курса) до и после изменения"""
+    changes = list(changes)
+    pending = _pending_lessons.get()
+    if pending is not None:
+        pending['changes'].extend(changes)
+        pending['count_changed'] = pending['count_changed'] or count_changed
+        return
+    invalidate(
+        'lessons:admin',
+        *{f'lesson:{lesson_id}' for lesson_id, _, _ in changes},
+        *{f'lessons:owner:{owner_id}' for _, owner_id, _ in changes},
+        *course_tags({course_id for _, _, course_id in changes}),
+        'count:materials.lesson' if count_changed else None,
+    )
+
+
+@contextmanager
+def batch_invalidation():
+    """Копит изменения уроков за время массовой операции и сбрасывает кэш один раз"""
+    pending = {'changes': [], 'count_changed': False}
+    token = _pending_lessons.set(pending)
+    try:
+        yield
+    finally:
+        _pending_lessons.reset(token)
+    if pending['changes']:
+        invalidate_lessons(pending['changes'], pending['count_changed'])
+
+
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Lesson)
+def invalidate_lesson(sender, instance, **kwargs):
+    previous = getattr(instance, '_cache_previous', {})
+    previous_owner_id = previous.get('owner_id', instance.owner_id)
+    invalidate_lessons(
+        [
+            (instance.pk, instance.owner_id, instance.course_id),
+            (instance.pk, previous_owner_id, previous.get('course_id', instance.course_id)),
+        ],
+        count_changed=kwargs.get('created', True) or previous_owner_id != instance.owner_id,
+    )
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_subscription(sender, instance, **kwargs):
+    invalidate(f'subscriptions:{instance.user_id}')
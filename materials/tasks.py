@@ -1,45 +1,130 @@
 import datetime
+import logging
+import time
+from functools import partial
+from itertools import islice
 
-import pytz
 from celery import shared_task
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from materials.models import Course, Subscription
+from materials.outbox import enqueue_task, purge_outbox, relay_outbox_pending
 from users.models import User
 
+logger = logging.getLogger(__name__)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _notification_key(pk):
+    return f'materials:notification:{pk}'
+
+
+def schedule_course_notification(pk: int, date: datetime.datetime):
+    """Держит не больше одного отложенного уведомления на курс в пределах окна COURSE_NOTIFICATION_WINDOW.
+
+    Уведомление пишется в outbox в текущей транзакции, поэтому откат изменений отменяет и его.
+    """
+    window = settings.COURSE_NOTIFICATION_WINDOW
+    key = _notification_key(pk)
+    pending = cache.get(key)
+    if pending is not None:
+        pending['latest_change'] = timezone.now()
+        pending['edits'] += 1
+        cache.set(key, pending, timeout=window * 2)
+        return False
+
+    enqueue_task(sending_mail, (pk, date), countdown=window, dedup_key=f'sending_mail:{pk}')
+    pending = {'first_change': date, 'latest_change': timezone.now(), 'edits': 1}
+    transaction.on_commit(partial(cache.add, key, pending, timeout=window * 2))
+    return True
+
+
+@shared_task
+def relay_outbox():
+    return relay_outbox_pending()
+
 
 @shared_task
-def sending_mail(pk: int, date: datetime.datetime):
+def purge_outbox_records():
+    return purge_outbox()
+
+
+@shared_task
+def sending_mail(pk: int, date: datetime.datetime | str | None):
+    pending = cache.get(_notification_key(pk))
+    cache.delete(_notification_key(pk))
+    if pending:
+        logger.info('Course %s: %d edits coalesced, latest at %s', pk, pending['edits'], pending['latest_change'])
+
+    if isinstance(date, str):
+        date = parse_datetime(date)
     instance = Course.objects.filter(id=pk).first()
-    if instance:
-        hour_delta = (instance.last_update - date).total_seconds() / 3600
-        if hour_delta > 4:
-            subs = Subscription.objects.filter(course=instance)
-            if len(list(subs)) > 0:
-                subscribers = []
-                for sub in subs:
-                    subscribers.append(User.objects.get(id=sub.user.id).email)
-                send_mail(
-                    subject=f"Курс {instance.name} обновлен",
-                    message=f"Курс {instance.name} получил обновления",
-                    from_email=settings.EMAIL_HOST_USER,
-                    recipient_list=subscribers,
-                    fail_silently=False,
-                )
+    if instance and instance.last_update:
+        hour_delta = (instance.last_update - date).total_seconds() / 3600 if date else None
+        if hour_delta is None or hour_delta > 4:
+            start = time.monotonic()
+            emails = Subscription.objects.filter(
+                course=instance, user__isnull=False
+            ).values_list('user__email', flat=True).distinct().iterator(chunk_size=settings.COURSE_MAIL_CHUNK_SIZE)
+
+            recipients = chunks = 0
+            for chunk in chunked(emails, settings.COURSE_MAIL_CHUNK_SIZE):
+                send_course_update_chunk.delay(instance.name, chunk)
+                recipients += len(chunk)
+                chunks += 1
+
+            elapsed = time.monotonic() - start
+            logger.info('Course %s: %d recipients split into %d chunks in %.2fs',
+                        pk, recipients, chunks, elapsed)
+            return {'recipients': recipients, 'chunks': chunks}
+
+
+@shared_task
+def send_course_update_chunk(course_name: str, emails: list):
+    """Отправляет письма об обновлении курса части подписчиков через одно SMTP-соединение"""
+    start = time.monotonic()
+    messages = [
+        EmailMessage(
+            subject=f"Курс {course_name} обновлен",
+            body=f"Курс {course_name} получил обновления",
+            from_email=settings.EMAIL_HOST_USER,
+            to=[email],
+        )
+        for email in emails
+    ]
+    with get_connection(fail_silently=False) as connection:
+        sent = connection.send_messages(messages)
+
+    elapsed = time.monotonic() - start
+    logger.info('Sent %d course update emails in %.2fs (%.1f emails/s)',
+                sent, elapsed, sent / elapsed if elapsed else sent)
+    return {'sent': sent, 'seconds': round(elapsed, 3)}
 
 
 @shared_task
 def check_login():
-    users = User.objects.filter(is_active=True)
-    if users.exists():
-        for user in users:
-            try:
-                if datetime.datetime.now(
-                        pytz.timezone("Europe/Moscow")
-                ) - user.last_login > datetime.timedelta(weeks=4):
-                    user.is_active = False
-                    user.save()
-            except TypeError:
-                user.last_login = datetime.now()
-                user.save()
+    """Отключает пользователей, не заходивших дольше 4 недель, пакетными UPDATE без загрузки строк в память"""
+    now = timezone.now()
+    cutoff = now - datetime.timedelta(weeks=4)
+
+    stamped = User.objects.filter(is_active=True, last_login__isnull=True).update(last_login=now)
+
+    stale = User.objects.filter(is_active=True, last_login__lt=cutoff).order_by('pk')
+    deactivated = 0
+    while updated := User.objects.filter(
+            pk__in=stale.values('pk')[:settings.CHECK_LOGIN_CHUNK_SIZE]
+    ).update(is_active=False):
+        deactivated += updated
+
+    logger.info('check_login: %d users deactivated, %d users got last_login', deactivated, stamped)
+    return {'deactivated': deactivated, 'stamped': stamped}
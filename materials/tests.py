@@ -1,8 +1,42 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO
+from unittest import mock
+
+from django.contrib.auth.models import Group
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APITestCase, APIClient
-from users.models import User
-from materials.models import Lesson, Course, Subscription
+from users.models import Payments, User
+from users.services import cache_statuses
+from materials.models import Lesson, Course, Subscription, TaskOutbox
+from materials.fast_serializers import ValuesMapper
+from materials.views import CourseViewSet
+from materials.management.commands.replay_load import ADMIN_EMAIL, DEFAULT_MIX, Command as ReplayLoadCommand
+from materials.outbox import enqueue_task, purge_outbox, relay_outbox_pending
+from materials.tasks import check_login, schedule_course_notification, send_course_update_chunk, sending_mail
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework import status
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from django.utils.module_loading import import_string
+
+from config.parsers import ORJSONParser
+from config.renderers import ORJSONRenderer
+from config.testing import QueryBudgetMixin
+from config.utils import change, percentile
 
 
 class LessonTestCase(APITestCase):
@@ -87,6 +121,25 @@ class LessonTestCase(APITestCase):
              'owner': self.user.pk, 'description': None, 'preview': None}
         )
 
+    def test_retrieve_foreign_lesson(self):
+        other = User.objects.create(email='other@test.com', password='12345')
+        self.client.force_authenticate(user=other)
+
+        response = self.client.get(
+            reverse('materials:lesson', kwargs={'pk': self.lesson.pk}),
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        Group.objects.get_or_create(name='Администраторы DRF')[0].user_set.add(other)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                reverse('materials:lesson', kwargs={'pk': self.lesson.pk}),
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
     def test_delete_lesson(self):
         response = self.client.delete(
             reverse('materials:lesson_delete', kwargs={'pk': self.lesson.pk}),
@@ -178,6 +231,39 @@ class CourseTestCase(APITestCase):
                           'description': None, 'owner': self.user.pk, 'preview': None, 'subscription': False}]}
         )
 
+    def test_list_course_queries(self):
+        for i in range(20):
+            course = Course.objects.create(name=f'test {i}', owner=self.user)
+            Lesson.objects.create(name='test', course=course, video='https://www.youtube.com/123', owner=self.user)
+            Subscription.objects.create(course=course, user=self.user)
+        # оценка размера таблицы для пагинации еще не закэширована
+        cache.clear()
+
+        with self.assertNumQueries(5):
+            response = self.client.get('/courses/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['count'], 21)
+        self.assertTrue(all(course['lesson_count'] == 1 for course in response.json()['results']))
+        self.assertEqual([course['subscription'] for course in response.json()['results']], [False] + [True] * 9)
+
+    def test_list_course_cursor(self):
+        for i in range(14):
+            Course.objects.create(name=f'test {i}', owner=self.user)
+
+        response = self.client.get('/courses/?pagination=cursor')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.json())
+        self.assertEqual(len(response.json()['results']), 10)
+        self.assertEqual(response.json()['results'][0]['id'], self.course.pk)
+
+        response = self.client.get(response.json()['next'])
+
+        self.assertEqual(len(response.json()['results']), 5)
+        self.assertIsNone(response.json()['next'])
+        self.assertIsNotNone(response.json()['previous'])
+
     def test_create_course(self):
         data = {
             "name": self.course.name
@@ -247,3 +333,833 @@ class CourseTestCase(APITestCase):
             response.status_code,
             status.HTTP_204_NO_CONTENT
         )
+
+
+@override_settings(PAGINATION_COUNT_ESTIMATE_THRESHOLD=5)
+class ApproximateCountTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = User.objects.create(email='test@test.com', password='12345')
+        self.client.force_authenticate(user=self.user)
+        for i in range(10):
+            Course.objects.create(name=f'test {i}', owner=self.user)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE materials_course')
+        cache.clear()
+
+    def test_small_table_exact_count(self):
+        with override_settings(PAGINATION_COUNT_ESTIMATE_THRESHOLD=1000):
+            response = self.client.get('/courses/')
+
+        self.assertEqual(response.json()['count'], 10)
+        self.assertNotIn('count_approximate', response.json())
+
+    def test_unfiltered_count_estimated(self):
+        self.user.is_superuser = True
+        self.user.save()
+
+        response = self.client.get('/courses/?page size=3')
+
+        self.assertTrue(response.json()['count_approximate'])
+        self.assertEqual(response.json()['count'], 10)
+
+    def test_filtered_count_cached_until_insert(self):
+        self.assertEqual(self.client.get('/courses/?page size=3').json()['count'], 10)
+
+        Course.objects.create(name='test', owner=self.user)
+        response = self.client.get('/courses/?page size=3')
+
+        self.assertTrue(response.json()['count_approximate'])
+        self.assertEqual(response.json()['count'], 11)
+
+    def test_estimate_cached(self):
+        self.client.get('/courses/')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/courses/')
+
+        self.assertFalse(any('pg_class' in query['sql'] for query in queries.captured_queries))
+
+    def test_low_estimate_serves_trailing_pages(self):
+        self.user.is_superuser = True
+        self.user.save()
+
+        with mock.patch('materials.paginators.estimate_table_rows', return_value=5):
+            response = self.client.get('/courses/?page size=3&page=4')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertIsNone(response.json()['next'])
+        self.assertEqual(response.json()['count'], 10)
+        self.assertNotIn('count_approximate', response.json())
+
+    def test_high_estimate_has_no_phantom_pages(self):
+        self.user.is_superuser = True
+        self.user.save()
+
+        with mock.patch('materials.paginators.estimate_table_rows', return_value=100):
+            middle = self.client.get('/courses/?page size=3&page=2').json()
+            last = self.client.get('/courses/?page size=3&page=4').json()
+            beyond = self.client.get('/courses/?page size=3&page=5')
+
+        self.assertIsNotNone(middle['next'])
+        self.assertEqual(middle['count'], 100)
+        self.assertIsNone(last['next'])
+        self.assertEqual(last['count'], 10)
+        self.assertEqual(beyond.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class QueryTimingTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = User.objects.create(email='test@test.com', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(name='test', owner=self.user)
+        cache.clear()
+
+    def test_server_timing(self):
+        response = self.client.get('/courses/')
+
+        server_timing = response['Server-Timing']
+        self.assertIn('db;dur=', server_timing)
+        self.assertIn('desc="5 queries"', server_timing)
+        self.assertIn('serialize;dur=', server_timing)
+        self.assertIn('render;dur=', server_timing)
+        self.assertIn('total;dur=', server_timing)
+
+    @override_settings(FAST_LIST_SERIALIZERS=True)
+    def test_server_timing_fast_list(self):
+        response = self.client.get(reverse('materials:lessons'))
+
+        self.assertIn('serialize;dur=', response['Server-Timing'])
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0)
+    def test_slow_queries_logged_with_view(self):
+        with self.assertLogs('config.middleware', level='WARNING') as logs:
+            self.client.get(reverse('materials:lessons'))
+
+        self.assertTrue(all('LessonListAPIView.get' in line for line in logs.output))
+
+
+class ResponseCacheTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = User.objects.create(email='test@test.com', password='12345')
+        self.other = User.objects.create(email='other@test.com', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(name='test', owner=self.user)
+        self.lesson = Lesson.objects.create(name='test', course=self.course,
+                                            video='https://www.youtube.com/123',
+                                            owner=self.user)
+
+    def test_course_list_cached_until_lesson_changes(self):
+        self.assertEqual(self.client.get('/courses/')['X-Cache'], 'MISS')
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/courses/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.json()['results'][0]['lesson_count'], 1)
+
+        Lesson.objects.create(name='test 2', course=self.course, video='https://www.youtube.com/123',
+                              owner=self.user)
+        response = self.client.get('/courses/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['results'][0]['lesson_count'], 2)
+
+    def test_other_owner_changes_keep_cache(self):
+        self.client.get(reverse('materials:lessons'))
+
+        Lesson.objects.create(name='test', course=Course.objects.create(name='other', owner=self.other),
+                              video='https://www.youtube.com/123', owner=self.other)
+
+        self.assertEqual(self.client.get(reverse('materials:lessons'))['X-Cache'], 'HIT')
+
+    def test_subscription_invalidates_course(self):
+        self.client.get(f'/courses/{self.course.pk}/')
+
+        self.client.post(reverse('materials:subs_create'), data={'course': self.course.pk})
+
+        response = self.client.get(f'/courses/{self.course.pk}/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertTrue(response.json()['subscription'])
+
+    def test_detail_cache_keeps_object_permissions(self):
+        Group.objects.get_or_create(name='Администраторы DRF')[0].user_set.add(self.other)
+        superuser = User.objects.create(email='super@test.com', is_superuser=True)
+        url = reverse('materials:lesson', kwargs={'pk': self.lesson.pk})
+        self.client.force_authenticate(user=self.other)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+        # Суперпользователь вне группы и не владелец: из кэша группы ответ получать нельзя
+        self.client.force_authenticate(user=superuser)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get(f'/courses/{self.course.pk}/').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_owner_change_without_select(self):
+        self.client.get(reverse('materials:lessons'))
+        lesson = Lesson.objects.get(pk=self.lesson.pk)
+        lesson.owner = self.other
+        # UPDATE и владельцы курсов для тегов кэша; прежний владелец известен с момента загрузки
+        with self.assertNumQueries(2):
+            lesson.save()
+
+        self.assertEqual(self.client.get(reverse('materials:lessons')).json()['count'], 0)
+        self.client.force_authenticate(user=self.other)
+        self.assertEqual(self.client.get(reverse('materials:lessons')).json()['count'], 1)
+
+    def test_cache_stats(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.client.get(reverse('materials:lesson', kwargs={'pk': self.lesson.pk}))
+        self.client.get(reverse('materials:lesson', kwargs={'pk': self.lesson.pk}))
+
+        response = self.client.get(reverse('materials:cache_stats'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertGreaterEqual(response.json()['LessonDetailAPIView.get']['hits'], 1)
+        self.assertGreaterEqual(response.json()['LessonDetailAPIView.get']['misses'], 1)
+
+
+class FastListTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = User.objects.create(email='test@test.com', password='12345', is_superuser=True)
+        self.client.force_authenticate(user=self.user)
+        for i in range(12):
+            course = Course.objects.create(name=f'course {i}', owner=self.user if i % 2 else None,
+                                           preview='materials/course.png' if i % 3 else None,
+                                           description='описание "курса"\u2028' if i % 4 else None,
+                                           last_update=timezone.now() if i % 5 else None)
+            for j in range(i % 4):
+                Lesson.objects.create(name=f'lesson {j}', course=course, owner=self.user, preview='',
+                                      video='https://www.youtube.com/123')
+            if i % 3 == 0:
+                Subscription.objects.create(course=course, user=self.user)
+
+    def assertSameResponse(self, url):
+        responses = []
+        for fast in (False, True):
+            cache.clear()
+            with override_settings(FAST_LIST_SERIALIZERS=fast), \
+                    mock.patch.object(ValuesMapper, 'map', autospec=True, side_effect=ValuesMapper.map) as mapped:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(mapped.called, fast, url)
+            responses.append(response.content)
+        self.assertEqual(responses[0], responses[1], url)
+
+    def test_same_output(self):
+        for url in ('/courses/', '/courses/?page=2', '/courses/?pagination=cursor', '/lesson/',
+                    '/lesson/?pagination=cursor', '/lesson/?page size=3&page=2'):
+            self.assertSameResponse(url)
+
+    def test_list_course_queries(self):
+        cache.clear()
+        with override_settings(FAST_LIST_SERIALIZERS=True), CaptureQueriesContext(connection) as fast:
+            self.client.get('/courses/')
+        cache.clear()
+        with CaptureQueriesContext(connection) as regular:
+            self.client.get('/courses/')
+
+        self.assertEqual(len(fast.captured_queries), len(regular.captured_queries))
+
+    def test_relation_reading_method_falls_back(self):
+        # без аннотаций get_lesson_count и get_subscription читают связи, которых у строки .values() нет
+        with mock.patch.object(CourseViewSet, 'get_queryset', lambda view: Course.objects.order_by('id')):
+            self.assertSameResponse('/courses/')
+            cache.clear()
+            with override_settings(FAST_LIST_SERIALIZERS=True):
+                exported = self.client.get('/courses/export/')
+            lines = [json.loads(line) for line in b''.join(exported.streaming_content).splitlines()]
+
+        self.assertEqual([course['lesson_count'] for course in lines], [i % 4 for i in range(12)])
+
+
+class ORJSONTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = User.objects.create(email='test@test.com', password='12345', is_superuser=True)
+        self.client.force_authenticate(user=self.user)
+        course = Course.objects.create(name='курс', owner=self.user, description='строка\u2028"кавычки"',
+                                       last_update=timezone.now())
+        Lesson.objects.create(name='урок', course=course, owner=self.user, video='https://www.youtube.com/123')
+
+    def test_same_output(self):
+        data = {
+            'date': timezone.now(),
+            'naive': timezone.now().replace(tzinfo=None),
+            'sum': Decimal('10.50'),
+            'id': uuid.uuid4(),
+            'delta': timedelta(seconds=90),
+            'text': 'юникод \u2028\u2029 \x00 "q"',
+            1: 'ключ-число',
+            'big': 2 ** 70,
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_same_response(self):
+        responses = []
+        for renderer in ('config.renderers.ORJSONRenderer', 'rest_framework.renderers.JSONRenderer'):
+            cache.clear()
+            with mock.patch('rest_framework.views.APIView.renderer_classes', [import_string(renderer)]):
+                response = self.client.get('/courses/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            responses.append(response.content)
+        self.assertEqual(responses[0], responses[1])
+
+    def test_indent_fallback(self):
+        data = {'a': [1, 2]}
+        context = {'indent': 2}
+        self.assertEqual(ORJSONRenderer().render(data, renderer_context=context),
+                         JSONRenderer().render(data, renderer_context=context))
+
+    def test_non_finite_float(self):
+        data = {'a': float('nan'), 'b': float('inf')}
+        with self.assertRaises(ValueError):
+            JSONRenderer().render(data)
+        self.assertEqual(ORJSONRenderer().render(data), b'{"a":null,"b":null}')
+
+    def test_without_orjson(self):
+        data = {'date': timezone.now(), 'text': '\u2028'}
+        body = b'{"name": "\xd0\xba\xd1\x83\xd1\x80\xd1\x81"}'
+        with mock.patch('config.renderers.orjson', None), mock.patch('config.parsers.orjson', None):
+            self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+            self.assertEqual(ORJSONParser().parse(BytesIO(body)), {'name': 'курс'})
+
+    def test_parse(self):
+        self.assertEqual(ORJSONParser().parse(BytesIO('{"name": "курс", "n": [1, 2.5]}'.encode())),
+                         {'name': 'курс', 'n': [1, 2.5]})
+        with self.assertRaises(ParseError):
+            ORJSONParser().parse(BytesIO(b'{bad'))
+
+    def test_create_course(self):
+        response = self.client.post('/courses/', data={'name': 'новый курс'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['name'], 'новый курс')
+
+
+class ExportTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = User.objects.create(email='test@test.com', password='12345')
+        self.other = User.objects.create(email='other@test.com', password='12345')
+        self.client.force_authenticate(user=self.user)
+        for i in range(5):
+            course = Course.objects.create(name=f'курс, "{i}"', owner=self.user, description='строка\nвторая')
+            Lesson.objects.create(name=f'урок {i}', course=course, owner=self.user, video='https://www.youtube.com/123')
+            Subscription.objects.create(course=course, user=self.user if i % 2 else self.other)
+        Course.objects.create(name='чужой курс', owner=self.other)
+
+    def read(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_ndjson_same_as_list(self):
+        for fast in (False, True):
+            cache.clear()
+            with override_settings(EXPORT_CHUNK_SIZE=2, FAST_LIST_SERIALIZERS=fast):
+                rows = [json.loads(line) for line in self.read('/courses/export/').splitlines()]
+                listed = self.client.get('/courses/?page_size=100').json()['results']
+            self.assertEqual(rows, listed)
+
+    def test_csv(self):
+        lines = list(csv.reader(io.StringIO(self.read('/courses/export/?output=csv').decode())))
+
+        self.assertEqual(lines[0], ['id', 'name', 'owner', 'preview', 'last_update', 'description',
+                                    'lesson_count', 'subscription'])
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(lines[1][1], 'курс, "0"')
+        self.assertEqual(lines[1][5], 'строка\nвторая')
+
+    def test_scoping(self):
+        self.assertEqual(len(self.read('/lesson/export/').splitlines()), 5)
+        self.assertEqual(len(self.read('/subs/export/').splitlines()), 2)
+
+        self.user.is_superuser = True
+        self.user.save()
+        self.assertEqual(len(self.read('/courses/export/').splitlines()), 6)
+        self.assertEqual(len(self.read('/subs/export/').splitlines()), 5)
+
+    def test_queries_per_chunk(self):
+        with override_settings(EXPORT_CHUNK_SIZE=2), CaptureQueriesContext(connection) as queries:
+            self.read('/courses/export/')
+        # курсы читаются одним курсором, уроки - одним запросом на каждую порцию из трех
+        self.assertEqual(len([q for q in queries.captured_queries if 'materials_lesson' in q['sql']
+                              and 'materials_course' not in q['sql']]), 3)
+
+    def test_unknown_format(self):
+        response = self.client.get('/courses/export/?output=xml')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_anonymous(self):
+        self.client.force_authenticate(user=None)
+        for url in ('/courses/export/', '/lesson/export/', '/subs/export/'):
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class MaterialsQueryBudgetTestCase(QueryBudgetMixin, APITestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = User.objects.create(email='test@test.com', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.courses = []
+        # роль пользователя кэшируется между запросами, бюджеты считаются для прогретого кэша
+        self.client.get(reverse('materials:lessons'))
+
+    def seed(self, size):
+        while len(self.courses) < size:
+            course = Course.objects.create(name=f'test {len(self.courses)}', owner=self.user)
+            for i in range(2):
+                Lesson.objects.create(name=f'test {i}', course=course, video='https://www.youtube.com/123',
+                                      owner=self.user)
+            Subscription.objects.create(course=course, user=self.user)
+            self.courses.append(course)
+
+    def create_lesson(self):
+        return Lesson.objects.create(name='test', course=self.courses[0], video='https://www.youtube.com/123',
+                                     owner=self.user)
+
+    def test_list_course(self):
+        self.assertQueryBudget(lambda: ('get', '/courses/', None), max_queries=4, max_bytes=4500)
+
+    def test_retrieve_course(self):
+        self.assertQueryBudget(lambda: ('get', f'/courses/{self.courses[0].pk}/', None), max_queries=2,
+                               max_bytes=500)
+
+    def test_create_course(self):
+        self.assertQueryBudget(lambda: ('post', '/courses/', {'name': 'test'}), max_queries=4, max_bytes=200)
+
+    def test_update_course(self):
+        # первое переименование сбрасывает продукт stripe курса одним условным UPDATE
+        self.assertQueryBudget(lambda: ('patch', f'/courses/{self.courses[0].pk}/', {'name': 'test_new'}),
+                               max_queries=7, max_bytes=500)
+
+    def test_delete_course(self):
+        def make_request():
+            course = Course.objects.create(name='test', owner=self.user)
+            return 'delete', f'/courses/{course.pk}/', None
+
+        self.assertQueryBudget(make_request, max_queries=7, max_bytes=0)
+
+    def test_list_lessons(self):
+        self.assertQueryBudget(lambda: ('get', reverse('materials:lessons'), None), max_queries=3, max_bytes=1500)
+
+    def test_retrieve_lesson(self):
+        self.assertQueryBudget(lambda: ('get', reverse('materials:lesson', kwargs={'pk': self.create_lesson().pk}),
+                                        None), max_queries=1, max_bytes=200)
+
+    def test_create_lesson(self):
+        data = {'name': 'test', 'course': None, 'video': 'https://www.youtube.com/123'}
+
+        def make_request():
+            data['course'] = self.courses[0].pk
+            return 'post', reverse('materials:lesson_create'), data
+
+        self.assertQueryBudget(make_request, max_queries=3, max_bytes=200)
+
+    def test_update_lesson(self):
+        self.assertQueryBudget(lambda: ('patch', reverse('materials:lesson_update',
+                                                         kwargs={'pk': self.create_lesson().pk}),
+                                        {'name': 'test_new', 'video': 'https://www.youtube.com/1234'}),
+                               max_queries=7, max_bytes=200)
+
+    def test_delete_lesson(self):
+        self.assertQueryBudget(lambda: ('delete', reverse('materials:lesson_delete',
+                                                          kwargs={'pk': self.create_lesson().pk}), None),
+                               max_queries=4, max_bytes=0)
+
+    def test_create_subscription(self):
+        def make_request():
+            course = Course.objects.create(name='test', owner=self.user)
+            return 'post', reverse('materials:subs_create'), {'course': course.pk}
+
+        self.assertQueryBudget(make_request, max_queries=3, max_bytes=100)
+
+
+class LessonBulkTestCase(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create(email='test@test.com', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(name='test', owner=self.user)
+        self.other_course = Course.objects.create(name='other', owner=self.user)
+
+    def test_bulk_create(self):
+        data = [{'name': f'test {i}', 'course': self.course.pk, 'video': 'https://www.youtube.com/123'}
+                for i in range(30)]
+        data.append({'name': 'other', 'course': self.other_course.pk, 'video': 'https://youtu.be/123'})
+
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('materials:lesson_bulk'), data=data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.json()), 31)
+        self.assertEqual(Lesson.objects.filter(course=self.course, owner=self.user).count(), 30)
+        self.assertLess(len(context.captured_queries), 15)
+        self.assertEqual(TaskOutbox.objects.count(), 2)
+        self.course.refresh_from_db()
+        self.assertIsNotNone(self.course.last_update)
+
+    def test_bulk_create_validation(self):
+        data = [{'name': 'test', 'course': self.course.pk, 'video': 'https://www.youtube.com/123'},
+                {'name': 'test', 'course': 0, 'video': 'https://www.test.com/123'}]
+
+        response = self.client.post(reverse('materials:lesson_bulk'), data=data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()[0], {})
+        self.assertEqual(set(response.json()[1]), {'course', 'video'})
+        self.assertFalse(Lesson.objects.exists())
+
+    def test_bulk_update(self):
+        lessons = [Lesson.objects.create(name='test', course=self.course, video='https://www.youtube.com/123',
+                                         owner=self.user) for _ in range(5)]
+        data = [{'id': lesson.pk, 'name': f'new {lesson.pk}'} for lesson in lessons]
+        data[0]['course'] = self.other_course.pk
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(reverse('materials:lesson_bulk'), data=data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([lesson['name'] for lesson in response.json()], [item['name'] for item in data])
+        self.assertEqual(Lesson.objects.filter(course=self.other_course).count(), 1)
+        self.assertEqual(TaskOutbox.objects.count(), 2)
+
+    def test_bulk_update_foreign_lesson(self):
+        other = User.objects.create(email='other@test.com', password='12345')
+        lesson = Lesson.objects.create(name='test', course=self.course, video='https://www.youtube.com/123',
+                                       owner=other)
+
+        response = self.client.patch(reverse('materials:lesson_bulk'), data=[{'id': lesson.pk, 'name': 'new'}],
+                                     format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        lesson.refresh_from_db()
+        self.assertEqual(lesson.name, 'test')
+
+    def test_bulk_delete(self):
+        lessons = [Lesson.objects.create(name='test', course=self.course, video='https://www.youtube.com/123',
+                                         owner=self.user) for _ in range(5)]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(reverse('materials:lesson_bulk'),
+                                          data={'ids': [lesson.pk for lesson in lessons[:3]]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(Lesson.objects.count(), 2)
+        self.assertEqual(TaskOutbox.objects.count(), 1)
+        self.course.refresh_from_db()
+        self.assertIsNotNone(self.course.last_update)
+
+    def test_bulk_delete_foreign_lesson(self):
+        other = User.objects.create(email='other@test.com', password='12345')
+        own = Lesson.objects.create(name='test', course=self.course, video='https://www.youtube.com/123',
+                                    owner=self.user)
+        foreign = Lesson.objects.create(name='test', course=self.course, video='https://www.youtube.com/123',
+                                        owner=other)
+
+        response = self.client.delete(reverse('materials:lesson_bulk'), data={'ids': [own.pk, foreign.pk]},
+                                      format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Lesson.objects.count(), 2)
+
+    @override_settings(LESSON_BULK_MAX_SIZE=2)
+    def test_bulk_size_limit(self):
+        data = [{'name': f'test {i}', 'course': self.course.pk, 'video': 'https://www.youtube.com/123'}
+                for i in range(3)]
+
+        self.assertEqual(self.client.post(reverse('materials:lesson_bulk'), data=data, format='json').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.delete(reverse('materials:lesson_bulk'), data={'ids': [1, 2, 3]},
+                                            format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Lesson.objects.exists())
+
+
+@override_settings(COURSE_MAIL_CHUNK_SIZE=3)
+class SendingMailTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create(email='test@test.com', password='12345')
+        self.course = Course.objects.create(name='test', owner=self.user, last_update=timezone.now())
+        for i in range(7):
+            Subscription.objects.create(course=self.course, user=User.objects.create(email=f'{i}@test.com'))
+
+    @mock.patch('materials.tasks.send_course_update_chunk')
+    def test_sending_mail_chunks(self, send_chunk):
+        with self.assertNumQueries(2):
+            result = sending_mail(self.course.pk, self.course.last_update - timedelta(hours=5))
+
+        self.assertEqual(result, {'recipients': 7, 'chunks': 3})
+        self.assertEqual([len(call.args[1]) for call in send_chunk.delay.call_args_list], [3, 3, 1])
+
+    @mock.patch('materials.tasks.send_course_update_chunk')
+    def test_sending_mail_recent_update(self, send_chunk):
+        self.assertIsNone(sending_mail(self.course.pk, self.course.last_update - timedelta(hours=1)))
+        send_chunk.delay.assert_not_called()
+
+    def test_send_course_update_chunk(self):
+        result = send_course_update_chunk('test', ['1@test.com', '2@test.com'])
+
+        self.assertEqual(result['sent'], 2)
+        self.assertEqual([message.to for message in mail.outbox], [['1@test.com'], ['2@test.com']])
+        self.assertEqual(mail.outbox[0].subject, 'Курс test обновлен')
+
+
+class CourseNotificationTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create(email='test@test.com', password='12345')
+        self.course = Course.objects.create(name='test', owner=self.user, last_update=timezone.now())
+
+    @override_settings(COURSE_NOTIFICATION_WINDOW=60)
+    @mock.patch('materials.tasks.send_course_update_chunk')
+    def test_notifications_coalesced(self, send_chunk):
+        previous = self.course.last_update - timedelta(hours=5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(schedule_course_notification(self.course.pk, previous))
+        for _ in range(3):
+            self.assertFalse(schedule_course_notification(self.course.pk, timezone.now()))
+
+        task = TaskOutbox.objects.get()
+        self.assertEqual(task.task, 'materials.tasks.sending_mail')
+        self.assertEqual(task.args[0], self.course.pk)
+        self.assertAlmostEqual(parse_datetime(task.args[1]), previous, delta=timedelta(milliseconds=1))
+        self.assertIsNotNone(task.eta)
+
+        # Окно закрылось: задача отправлена и отработала, следующая правка снова планирует уведомление
+        TaskOutbox.objects.update(eta=timezone.now())
+        with mock.patch('materials.outbox.current_app') as app:
+            self.assertEqual(relay_outbox_pending(), 1)
+        app.send_task.assert_called_once_with('materials.tasks.sending_mail', args=task.args, kwargs={},
+                                              task_id=f'outbox-{task.pk}', producer=mock.ANY)
+        sending_mail(*task.args)
+        self.assertTrue(schedule_course_notification(self.course.pk, timezone.now()))
+        self.assertEqual(TaskOutbox.objects.filter(published_at__isnull=True).count(), 1)
+
+
+class OutboxTestCase(APITestCase):
+    def test_enqueue_dedup(self):
+        enqueue_task('materials.tasks.sending_mail', (1, None), dedup_key='sending_mail:1')
+        enqueue_task('materials.tasks.sending_mail', (1, None), dedup_key='sending_mail:1')
+        enqueue_task('materials.tasks.check_login')
+
+        self.assertEqual(TaskOutbox.objects.count(), 2)
+
+    @override_settings(OUTBOX_BATCH_SIZE=2)
+    def test_relay_batches(self):
+        for _ in range(5):
+            enqueue_task('materials.tasks.check_login')
+        enqueue_task('materials.tasks.check_login', countdown=60)
+
+        with mock.patch('materials.outbox.current_app') as app:
+            self.assertEqual(relay_outbox_pending(), 5)
+
+        self.assertEqual(app.send_task.call_count, 5)
+        self.assertEqual(app.producer_or_acquire.call_count, 3)
+        self.assertEqual(TaskOutbox.objects.filter(published_at__isnull=True).count(), 1)
+
+    def test_broker_failure_keeps_sent_tasks_published(self):
+        for _ in range(3):
+            enqueue_task('materials.tasks.check_login')
+
+        with mock.patch('materials.outbox.current_app') as app:
+            app.send_task.side_effect = [None, ConnectionError('broker is down')]
+            with self.assertRaises(ConnectionError):
+                relay_outbox_pending()
+
+        self.assertEqual(TaskOutbox.objects.filter(published_at__isnull=True).count(), 2)
+        with mock.patch('materials.outbox.current_app') as app:
+            self.assertEqual(relay_outbox_pending(), 2)
+        self.assertEqual([call.kwargs['task_id'] for call in app.send_task.call_args_list],
+                         [f'outbox-{pk}' for pk in TaskOutbox.objects.order_by('id').values_list('pk', flat=True)[1:]])
+
+    def test_purge(self):
+        enqueue_task('materials.tasks.check_login')
+        enqueue_task('materials.tasks.sending_mail', (1, None))
+        TaskOutbox.objects.filter(task='materials.tasks.check_login').update(
+            published_at=timezone.now() - timedelta(days=2))
+
+        self.assertEqual(purge_outbox(), 1)
+        self.assertEqual(TaskOutbox.objects.count(), 1)
+
+    def test_rollback_discards_task(self):
+        try:
+            with transaction.atomic():
+                enqueue_task('materials.tasks.check_login')
+                raise ValueError
+        except ValueError:
+            pass
+
+        self.assertFalse(TaskOutbox.objects.exists())
+
+
+@override_settings(CHECK_LOGIN_CHUNK_SIZE=2)
+class CheckLoginTestCase(APITestCase):
+    def test_check_login(self):
+        now = timezone.now()
+        stale = [User.objects.create(email=f'stale{i}@test.com') for i in range(5)]
+        fresh = User.objects.create(email='fresh@test.com', last_login=now)
+        never = User.objects.create(email='never@test.com')
+        User.objects.filter(pk__in=[user.pk for user in stale]).update(last_login=now - timedelta(weeks=5))
+        User.objects.filter(pk=never.pk).update(last_login=None)
+
+        with self.assertNumQueries(5):
+            result = check_login()
+
+        self.assertEqual(result, {'deactivated': 5, 'stamped': 1})
+        self.assertFalse(User.objects.filter(pk__in=[user.pk for user in stale], is_active=True).exists())
+        self.assertTrue(User.objects.get(pk=fresh.pk).is_active)
+        never = User.objects.get(pk=never.pk)
+        self.assertTrue(never.is_active)
+        self.assertIsNotNone(never.last_login)
+        self.assertEqual(User.objects.get(pk=stale[0].pk).last_login.date(), (now - timedelta(weeks=5)).date())
+
+
+class GenerateDatasetTestCase(APITestCase):
+    options = {'users': 40, 'courses': 8, 'lessons_per_course': '1-4', 'subscriptions': 60,
+               'payments_per_user': 1.5, 'batch_size': 7, 'stdout': io.StringIO()}
+
+    def snapshot(self, prefix):
+        users = dict(User.objects.filter(email__startswith=prefix).values_list('pk', 'email'))
+        rank = {pk: email.split('-')[-1] for pk, email in users.items()}
+        courses = {pk: i for i, pk in enumerate(Course.objects.filter(owner__in=users).order_by('pk')
+                                                .values_list('pk', flat=True))}
+        return (
+            sorted((rank[owner], name, last_update) for name, owner, last_update
+                   in Course.objects.filter(pk__in=courses).values_list('name', 'owner', 'last_update')),
+            sorted((courses[course], name, video) for course, name, video
+                   in Lesson.objects.filter(course__in=courses).values_list('course', 'name', 'video')),
+            sorted((rank[user], courses[course]) for user, course
+                   in Subscription.objects.filter(course__in=courses).values_list('user', 'course')),
+            sorted((rank[user], courses[course], pay_sum, pay_date, payment_status) for user, course, pay_sum, pay_date,
+                   payment_status in Payments.objects.filter(user__in=users)
+                   .values_list('user', 'paid_course', 'pay_sum', 'pay_date', 'payment_status')),
+        )
+
+    def test_reproducible(self):
+        call_command('generate_dataset', seed=7, prefix='a', **self.options)
+        call_command('generate_dataset', seed=7, prefix='b', **self.options)
+        call_command('generate_dataset', seed=8, prefix='c', **self.options)
+
+        first = self.snapshot('a-7-')
+        self.assertEqual(first, self.snapshot('b-7-'))
+        self.assertNotEqual(first, self.snapshot('c-8-'))
+        courses, lessons, subscriptions, payments = first
+        self.assertEqual(len(courses), 8)
+        self.assertTrue(8 <= len(lessons) <= 32)
+        self.assertEqual(len(payments), 60)
+        anchor = datetime(2024, 6, 1, tzinfo=dt_timezone.utc)
+        self.assertTrue(all(anchor - timedelta(days=365) <= last_update < anchor for _, _, last_update in courses))
+
+    def test_existing_prefix(self):
+        User.objects.create(email='load-0-1@example.com')
+        with self.assertRaises(CommandError):
+            call_command('generate_dataset', **self.options)
+
+    def test_days(self):
+        with self.assertRaises(CommandError):
+            call_command('generate_dataset', days=0, **self.options)
+        self.assertFalse(User.objects.exists())
+
+
+class ReplayLoadTestCase(APITestCase):
+    def setUp(self) -> None:
+        call_command('generate_dataset', users=10, courses=5, authors=0.5, subscriptions=10, payments_per_user=2,
+                     batch_size=50, stdout=io.StringIO())
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_replay(self):
+        output = os.path.join(self.directory, 'results.json')
+        lessons = Lesson.objects.count()
+        payments = Payments.objects.count()
+        call_command('replay_load', requests=60, warmup=5, stripe_latency=0, output=output, stdout=io.StringIO())
+
+        with open(output, encoding='utf-8') as file:
+            results = json.load(file)
+        self.assertEqual(results['total']['requests'], 60)
+        self.assertEqual(results['total']['errors'], 0)
+        self.assertIn('course_list', results['routes'])
+        self.assertGreater(results['routes']['course_list']['queries_mean'], 0)
+        self.assertLessEqual(results['total']['p50_ms'], results['total']['p99_ms'])
+        # Сессии оплаты создаются задачей в процессе, через заглушку Stripe, и в total не входят
+        self.assertEqual(results['routes']['provision_checkout']['errors'], 0)
+        self.assertEqual(results['routes']['provision_checkout']['requests'],
+                         results['routes']['payment_create']['requests'])
+        # Изменения, сделанные запросами, откатываются
+        self.assertEqual(Lesson.objects.count(), lessons)
+        self.assertEqual(Payments.objects.count(), payments)
+        self.assertFalse(User.objects.filter(email=ADMIN_EMAIL).exists())
+
+        stdout = io.StringIO()
+        call_command('replay_load', compare=[output, output], stdout=stdout)
+        self.assertIn('course_list', stdout.getvalue())
+
+    def test_trace(self):
+        trace = os.path.join(self.directory, 'trace.jsonl')
+        with open(trace, 'w', encoding='utf-8') as file:
+            file.write(json.dumps({'name': 'retrieve', 'method': 'GET', 'path': '/courses/{own_course}/'}) + '\n')
+        output = os.path.join(self.directory, 'results.json')
+        call_command('replay_load', requests=10, warmup=0, trace=trace, output=output, stdout=io.StringIO())
+
+        with open(output, encoding='utf-8') as file:
+            self.assertEqual(list(json.load(file)['routes']), ['retrieve'])
+
+    def test_cache_after_rollback(self):
+        # Ответы, закэшированные по ходу прогона, содержат откаченные уроки и не должны отдаваться после него
+        trace = os.path.join(self.directory, 'trace.jsonl')
+        with open(trace, 'w', encoding='utf-8') as file:
+            for entry in DEFAULT_MIX:
+                if entry['name'] in ('lesson_create', 'course_retrieve'):
+                    file.write(json.dumps(entry) + '\n')
+        call_command('replay_load', requests=30, warmup=0, trace=trace, actors=1, stdout=io.StringIO())
+
+        for course in Course.objects.filter(owner__isnull=False):
+            self.client.force_authenticate(user=course.owner)
+            response = self.client.get(f'/courses/{course.pk}/')
+            self.assertEqual(response.json()['lesson_count'], course.lesson_set.count())
+
+    def test_statuses_after_rollback(self):
+        # Статусы от заглушки Stripe, закэшированные за прогон, не переживают откат
+        with ReplayLoadCommand.rollback():
+            cache_statuses({'cs_replay': {'status': 'complete', 'payment_status': 'paid'}})
+            self.assertIsNotNone(cache.get('users:stripe_status:cs_replay'))
+        self.assertIsNone(cache.get('users:stripe_status:cs_replay'))
+
+    def test_admin_required(self):
+        with self.assertRaises(CommandError):
+            call_command('replay_load', requests=1, base_url='http://localhost:9', stdout=io.StringIO())
+        with self.assertRaises(CommandError):
+            call_command('replay_load', requests=1, admin='nobody@example.com', stdout=io.StringIO())
+
+    def test_percentile(self):
+        self.assertEqual([percentile(range(1, 101), p) for p in (50, 95, 99, 100)], [50, 95, 99, 100])
+        self.assertEqual(percentile([7], 99), 7)
+
+    def test_change(self):
+        self.assertEqual(change(10, 12.5), '10 -> 12.5 (+25%)')
+        self.assertEqual(change(0, 3), '0 -> 3')
+        self.assertEqual(change(None, 3), 'None -> 3')
+
+
+class BenchSerializersTestCase(APITestCase):
+    def test_results(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command('bench_serializers', sizes=[1, 3], nested=[0, 2], repeat=1, output=output,
+                         stdout=io.StringIO())
+            with open(output, encoding='utf-8') as file:
+                results = {result['name']: result for result in json.load(file)['results']}
+
+            stdout = io.StringIO()
+            call_command('bench_serializers', sizes=[1], nested=[2], serializers=['lesson'], repeat=1, compare=output,
+                         stdout=stdout)
+
+        self.assertEqual(len(results), 2 * (3 + 2 + 3 + 2))
+        self.assertEqual(results['course to_representation n=3 lessons=2']['queries'], 0)
+        self.assertEqual(results['lesson validate n=3']['queries'], 2)
+        self.assertGreater(results['user to_representation n=3 payments=2']['peak_kib'], 0)
+        self.assertIn('lesson validate n=1', stdout.getvalue())
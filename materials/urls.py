@@ -4,7 +4,8 @@ from materials.apps import MaterialsConfig
 from rest_framework.routers import DefaultRouter
 
 from materials.views import CourseViewSet, LessonCreateAPIView, LessonListAPIView, LessonDetailAPIView, \
-    LessonUpdateAPIView, LessonDestroyAPIView, SubscriptionCreateAPIView
+    LessonUpdateAPIView, LessonDestroyAPIView, SubscriptionCreateAPIView, CacheStatsAPIView, LessonBulkAPIView, \
+    LessonExportAPIView, SubscriptionExportAPIView
 
 app_name = MaterialsConfig.name
 
@@ -17,5 +18,9 @@ urlpatterns = [
                   path('lesson/<int:pk>/', LessonDetailAPIView.as_view(), name='lesson'),
                   path('lesson/update/<int:pk>/', LessonUpdateAPIView.as_view(), name='lesson_update'),
                   path('lesson/delete/<int:pk>/', LessonDestroyAPIView.as_view(), name='lesson_delete'),
+                  path('lesson/bulk/', LessonBulkAPIView.as_view(), name='lesson_bulk'),
+                  path('lesson/export/', LessonExportAPIView.as_view(), name='lesson_export'),
                   path('subs/create/', SubscriptionCreateAPIView.as_view(), name='subs_create'),
+                  path('subs/export/', SubscriptionExportAPIView.as_view(), name='subs_export'),
+                  path('cache/stats/', CacheStatsAPIView.as_view(), name='cache_stats'),
               ] + router.urls
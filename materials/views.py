@@ -1,37 +1,73 @@
 import datetime
+from functools import partial
 
 from drf_yasg.utils import swagger_auto_schema
-from rest_framework import viewsets, generics
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import viewsets, generics, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
 
+from materials.cache import CachedResponseMixin, cache_stats
+from materials.exports import StreamingExportMixin
+from materials.fast_serializers import FastListMixin
 from materials.models import Course, Lesson, Subscription
-from materials.paginators import MaterialsPagination
+from materials.paginators import MaterialsPagination, SwitchablePagination
 from materials.serializers import CourseSerializer, LessonSerializer, SubscriptionSerializer
+from materials.signals import batch_invalidation, invalidate_lessons
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 
-from materials.tasks import sending_mail
+from materials.tasks import schedule_course_notification
 from users.permissions import IsUserAdmDRF, IsUserOwner
+from users.roles import in_drf_admin_group, is_materials_admin
 
 
-class CourseViewSet(viewsets.ModelViewSet):
+def get_scope(request):
+    """Область видимости материалов: администраторы видят все, остальные - только свое"""
+    if is_materials_admin(request):
+        return 'admin'
+    return f'owner:{request.user.id}'
+
+
+def get_detail_scope(request):
+    """Область видимости карточки: общая только у группы администраторов DRF, которой права на объект даны
+    без проверки владельца; суперпользователь вне группы видит из кэша только свои объекты"""
+    if in_drf_admin_group(request):
+        return 'admin'
+    return f'owner:{request.user.id}'
+
+
+def touch_courses(course_ids):
+    """Обновляет last_update курсов и ставит по одному уведомлению подписчикам на курс"""
+    previous = dict(Course.objects.filter(pk__in=course_ids).values_list('pk', 'last_update'))
+    Course.objects.filter(pk__in=previous).update(last_update=timezone.now())
+    for course_id, date in previous.items():
+        schedule_course_notification(course_id, date)
+
+
+class CourseViewSet(CachedResponseMixin, FastListMixin, StreamingExportMixin, viewsets.ModelViewSet):
     serializer_class = CourseSerializer
     queryset = Course.objects.all()
-    pagination_class = MaterialsPagination
+    pagination_class = SwitchablePagination
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
     def get_queryset(self):
-        if self.request.user.is_superuser or self.request.user.groups.filter(name='Администраторы DRF').exists():
-            return Course.objects.all()
+        if is_materials_admin(self.request):
+            queryset = Course.objects.all()
         elif self.request.user.is_anonymous:
             return None
         else:
-            return Course.objects.filter(owner=self.request.user)
+            queryset = Course.objects.filter(owner=self.request.user)
+        return queryset.with_listing_data(self.request.user).order_by('id')
 
     def get_permissions(self):
-        if self.action == 'list':
+        if self.action in ('list', 'export'):
             permission_classes = [IsAuthenticated]
         elif self.action == 'retrieve' or self.action == 'update' or self.action == 'partial_update':
             permission_classes = [IsAuthenticated, IsUserAdmDRF | IsUserOwner]
@@ -45,6 +81,27 @@ class CourseViewSet(viewsets.ModelViewSet):
         serializer = CourseSerializer(paginated_queryset, many=True)
         return self.get_paginated_response(serializer.data)
 
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request,
+            get_scope(request),
+            [f'courses:{get_scope(request)}', f'subscriptions:{request.user.id}'],
+            partial(super().list, request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request,
+            get_detail_scope(request),
+            [f'course:{kwargs["pk"]}', f'subscriptions:{request.user.id}'],
+            partial(super().retrieve, request, *args, **kwargs),
+        )
+
+    @swagger_auto_schema(operation_description="Stream all visible courses, ?output=ndjson|csv")
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        return self.export_response(request, self.get_queryset())
+
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
@@ -52,8 +109,13 @@ class CourseViewSet(viewsets.ModelViewSet):
         instance.last_update = datetime.datetime.now()
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
-        self.perform_update(serializer)
-        sending_mail.delay(instance.id, date)
+        with transaction.atomic():
+            self.perform_update(serializer)
+            schedule_course_notification(instance.id, date)
+
+        if getattr(instance, '_prefetched_objects_cache', None):
+            instance._prefetched_objects_cache = {}
+
         return Response(serializer.data)
 
 
@@ -65,31 +127,47 @@ class LessonCreateAPIView(generics.CreateAPIView):
         serializer.save(owner=self.request.user)
 
 
-class LessonListAPIView(generics.ListAPIView):
+class LessonListAPIView(CachedResponseMixin, FastListMixin, generics.ListAPIView):
     serializer_class = LessonSerializer
     queryset = Lesson.objects.all()
     permission_classes = [IsAuthenticated]
-    pagination_class = MaterialsPagination
+    pagination_class = SwitchablePagination
 
     def get_queryset(self):
-        if self.request.user.is_superuser or self.request.user.groups.filter(name='Администраторы DRF').exists():
-            return Lesson.objects.all()
+        if is_materials_admin(self.request):
+            return Lesson.objects.order_by('id')
         else:
-            return Lesson.objects.filter(owner=self.request.user)
+            return Lesson.objects.filter(owner=self.request.user).order_by('id')
 
     def get(self, request):
-        queryset = Lesson.objects.all()
-        paginated_queryset = self.paginate_queryset(queryset)
-        serializer = LessonSerializer(paginated_queryset, many=True)
-        return self.get_paginated_response(serializer.data)
+        scope = get_scope(request)
+        return self.cached_response(request, scope, [f'lessons:{scope}'], partial(self.list, request))
+
+
+class LessonExportAPIView(StreamingExportMixin, generics.GenericAPIView):
+    serializer_class = LessonSerializer
+    permission_classes = [IsAuthenticated]
+    get_queryset = LessonListAPIView.get_queryset
+
+    @swagger_auto_schema(operation_description="Stream all visible lessons, ?output=ndjson|csv")
+    def get(self, request):
+        return self.export_response(request, self.get_queryset())
 
 
-class LessonDetailAPIView(generics.RetrieveAPIView):
+class LessonDetailAPIView(CachedResponseMixin, generics.RetrieveAPIView):
     serializer_class = LessonSerializer
     queryset = Lesson.objects.all()
     permission_classes = [IsAuthenticated, IsUserAdmDRF | IsUserOwner]
     pagination_class = MaterialsPagination
 
+    def get(self, request, *args, **kwargs):
+        return self.cached_response(
+            request,
+            get_detail_scope(request),
+            [f'lesson:{kwargs["pk"]}'],
+            partial(self.retrieve, request, *args, **kwargs),
+        )
+
 
 class LessonUpdateAPIView(generics.UpdateAPIView):
     serializer_class = LessonSerializer
@@ -98,16 +176,83 @@ class LessonUpdateAPIView(generics.UpdateAPIView):
 
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
-        instance = self.get_object()
-        date = instance.course.last_update
-        instance.course.last_update = datetime.datetime.now()
-        instance.course.save(update_fields=['last_update'])
-        serializer = self.get_serializer(instance, data=request.data, partial=partial)
+        with transaction.atomic():
+            instance = self.get_object()
+            date = instance.course.last_update
+            instance.course.last_update = datetime.datetime.now()
+            instance.course.save(update_fields=['last_update'])
+            serializer = self.get_serializer(instance, data=request.data, partial=partial)
+            serializer.is_valid(raise_exception=True)
+            self.perform_update(serializer)
+            schedule_course_notification(instance.course.id, date)
+        return Response(serializer.data)
+
+
+class LessonBulkAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        if is_materials_admin(self.request):
+            return Lesson.objects.all()
+        return Lesson.objects.filter(owner=self.request.user)
+
+    def get_ids(self, data):
+        if not isinstance(data, list) or not all(str(item).isdigit() for item in data):
+            raise ValidationError({'ids': ['Expected a list of lesson ids']})
+        if len(data) > settings.LESSON_BULK_MAX_SIZE:
+            raise ValidationError({'ids': [f'Ensure this field has no more than {settings.LESSON_BULK_MAX_SIZE} '
+                                           f'elements.']})
+        ids = [int(item) for item in data]
+        if len(set(ids)) != len(ids):
+            raise ValidationError({'ids': ['Lesson ids must be unique']})
+        return ids
+
+    def get_lessons(self, ids):
+        """Уроки по id в порядке запроса; чужие и несуществующие id - ошибка валидации"""
+        lessons = self.get_queryset().in_bulk(ids)
+        missing = [lesson_id for lesson_id in ids if lesson_id not in lessons]
+        if missing:
+            raise ValidationError({'ids': [f'Lessons not found: {missing}']})
+        return [lessons[lesson_id] for lesson_id in ids]
+
+    @swagger_auto_schema(request_body=LessonSerializer(many=True), operation_description="Create lessons in bulk")
+    def post(self, request):
+        serializer = LessonSerializer(data=request.data, many=True, max_length=settings.LESSON_BULK_MAX_SIZE,
+                                      context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            lessons = serializer.save(owner=request.user)
+            invalidate_lessons([(lesson.pk, lesson.owner_id, lesson.course_id) for lesson in lessons],
+                               count_changed=True)
+            touch_courses({lesson.course_id for lesson in lessons})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @swagger_auto_schema(request_body=LessonSerializer(many=True), operation_description="Update lessons in bulk")
+    def patch(self, request):
+        if not isinstance(request.data, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of lessons']})
+        instances = self.get_lessons(
+            self.get_ids([item.get('id') if isinstance(item, dict) else None for item in request.data]))
+        previous = [(lesson.pk, lesson.owner_id, lesson.course_id) for lesson in instances]
+        serializer = LessonSerializer(instances, data=request.data, many=True, partial=True,
+                                      context={'request': request})
         serializer.is_valid(raise_exception=True)
-        self.perform_update(serializer)
-        sending_mail.delay(instance.course.id, date)
+        with transaction.atomic():
+            serializer.save()
+            current = [(lesson.pk, lesson.owner_id, lesson.course_id) for lesson in instances]
+            owner_changed = any(old[1] != new[1] for old, new in zip(previous, current))
+            invalidate_lessons(previous + current, count_changed=owner_changed)
+            touch_courses({course_id for _, _, course_id in previous + current})
         return Response(serializer.data)
 
+    @swagger_auto_schema(operation_description="Delete lessons in bulk, body: {\"ids\": [...]}")
+    def delete(self, request):
+        lessons = self.get_lessons(self.get_ids(request.data.get('ids') if isinstance(request.data, dict) else None))
+        with transaction.atomic(), batch_invalidation():
+            Lesson.objects.filter(pk__in=[lesson.pk for lesson in lessons]).delete()
+            touch_courses({lesson.course_id for lesson in lessons})
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
 class LessonDestroyAPIView(generics.DestroyAPIView):
     queryset = Lesson.objects.all()
@@ -141,3 +286,25 @@ class SubscriptionCreateAPIView(generics.CreateAPIView):
             message = 'подписка добавлена'
 
         return Response({"message": message})
+
+
+class SubscriptionExportAPIView(StreamingExportMixin, generics.GenericAPIView):
+    serializer_class = SubscriptionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        if is_materials_admin(self.request):
+            return Subscription.objects.order_by('id')
+        return Subscription.objects.filter(user=self.request.user).order_by('id')
+
+    @swagger_auto_schema(operation_description="Stream all visible subscriptions, ?output=ndjson|csv")
+    def get(self, request):
+        return self.export_response(request, self.get_queryset())
+
+
+class CacheStatsAPIView(APIView):
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(operation_description="Cache hit/miss counters of the course and lesson views")
+    def get(self, request):
+        return Response(cache_stats())
@@ -1,6 +1,8 @@
 from django.contrib import admin
 
-from users.models import User, Payments
+from users.models import User, Payments, StripeEvent, StripePrice
 
 admin.site.register(User)
 admin.site.register(Payments)
+admin.site.register(StripePrice)
+admin.site.register(StripeEvent)
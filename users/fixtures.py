@@ -0,0 +1,163 @@
+import json
+from collections import Counter, defaultdict
+
+from django.apps import apps
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from config.utils import invalidate_imported
+from users.models import User
+from users.roles import forget_roles
+
+
+class FixtureError(ValueError):
+    pass
+
+
+def iter_records(stream, read_size=1 << 16):
+    """Объекты фикстуры по одному, не читая файл целиком: JSON-массив (формат dumpdata) или NDJSON"""
+    decoder = json.JSONDecoder()
+    buffer, position, eof = '', 0, False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,[]':
+            position += 1
+        if position == len(buffer):
+            if eof:
+                return
+            buffer, position = stream.read(read_size), 0
+            eof = not buffer
+            continue
+        try:
+            record, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as exc:
+            chunk = '' if eof else stream.read(read_size)
+            if not chunk:
+                raise FixtureError(f'Invalid JSON: {exc}') from exc
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        position = end
+        yield record
+
+
+class FixtureImporter:
+    """Пишет объекты фикстуры пачками через bulk_create.
+
+    Объекты копятся по моделям; перед записью пачки записываются накопленные объекты моделей, на которые
+    она ссылается (пользователи -> курсы -> уроки -> подписки и платежи), поэтому связи с уже прочитанными
+    объектами всегда разрешаются. Существующие строки с тем же pk перезаписываются, а их связи
+    многие-ко-многим заменяются значениями из фикстуры, как в loaddata.
+    Сигналы не отправляются: кэш сбрасывается по каждой записанной пачке.
+    """
+
+    def __init__(self, batch_size, using=DEFAULT_DB_ALIAS):
+        self.batch_size = batch_size
+        self.using = using
+        self.pending = defaultdict(list)
+        self.counts = Counter()
+        self.replaced = defaultdict(set)
+        self._fields = {}
+        self._flushing = set()
+
+    def fields(self, model):
+        if model not in self._fields:
+            self._fields[model] = {field.name: field for field in model._meta.get_fields()
+                                   if field.concrete or field.many_to_many}
+        return self._fields[model]
+
+    def dependencies(self, model):
+        return [field.related_model for field in model._meta.concrete_fields
+                if field.is_relation and field.related_model is not model]
+
+    def add(self, record):
+        try:
+            model = apps.get_model(record['model'])
+        except (KeyError, LookupError, ValueError) as exc:
+            raise FixtureError(f'Unknown model in record: {record!r:.200}') from exc
+
+        fields = self.fields(model)
+        pk = record.get('pk')
+        values = {}
+        relations = []
+        for name, value in record.get('fields', {}).items():
+            field = fields.get(name)
+            if field is None:
+                raise FixtureError(f'{model._meta.label} has no field {name!r}')
+            if field.many_to_many:
+                relations.append((field, value))
+            elif field.is_relation:
+                if isinstance(value, list):
+                    raise FixtureError(f'{model._meta.label}.{name}: natural keys are not supported')
+                values[field.attname] = value
+            else:
+                values[field.attname] = field.to_python(value)
+        if pk is not None:
+            values[model._meta.pk.attname] = model._meta.pk.to_python(pk)
+        self.push(model, model(**values))
+
+        for field, related_pks in relations:
+            if pk is None:
+                raise FixtureError(f'{model._meta.label}.{field.name}: many-to-many values need a pk')
+            through = field.remote_field.through
+            source, target = f'{field.m2m_field_name()}_id', f'{field.m2m_reverse_field_name()}_id'
+            self.replaced[through, source].add(values[model._meta.pk.attname])
+            for related_pk in related_pks:
+                self.push(through, through(**{source: values[model._meta.pk.attname], target: related_pk}))
+
+    def push(self, model, instance):
+        rows = self.pending[model]
+        rows.append(instance)
+        if len(rows) >= self.batch_size:
+            self.flush(model)
+
+    def flush(self, model):
+        if model in self._flushing:
+            return
+        self._flushing.add(model)
+        try:
+            for dependency in self.dependencies(model):
+                if self.pending.get(dependency):
+                    self.flush(dependency)
+            if model._meta.auto_created:
+                self.clear_relations(model)
+            instances = self.pending.pop(model, [])
+            if instances:
+                self.write(model, instances)
+        finally:
+            self._flushing.discard(model)
+
+    def clear_relations(self, through):
+        """Удаляет прежние связи многие-ко-многим импортированных объектов перед записью новых"""
+        for (model, source), pks in self.replaced.items():
+            if model is through and pks:
+                through._base_manager.using(self.using).filter(**{f'{source}__in': pks}).delete()
+                if through is User.groups.through:
+                    forget_roles(pks)
+                pks.clear()
+
+    def write(self, model, instances):
+        meta = model._meta
+        update_fields = [field.name for field in meta.concrete_fields if not field.primary_key]
+        queryset = model._base_manager.using(self.using)
+        if meta.auto_created or not update_fields:
+            # Строки связей многие-ко-многим без pk: повторы уже существующих пар пропускаются
+            queryset.bulk_create(instances, ignore_conflicts=True)
+        else:
+            queryset.bulk_create(instances, update_conflicts=True, unique_fields=[meta.pk.name],
+                                 update_fields=update_fields)
+        self.counts[meta.label] += len(instances)
+        invalidate_imported(model, instances)
+
+    def flush_all(self):
+        while self.pending:
+            self.flush(next(iter(self.pending)))
+        # Связи объектов, у которых в фикстуре пустой список, тоже нужно очистить
+        for through, _ in list(self.replaced):
+            self.clear_relations(through)
+
+    def reset_sequences(self):
+        """Сдвигает последовательности pk за вставленные явно значения, как это делает loaddata"""
+        models = [apps.get_model(label) for label in self.counts]
+        connection = connections[self.using]
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
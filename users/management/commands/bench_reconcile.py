@@ -0,0 +1,59 @@
+import time
+
+import stripe
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+
+from users.models import Payments, User
+from users.reconcile import reconcile_payments, stale_payments
+from users.services import forget_statuses
+from users.stripe_stub import StripeStubServer
+
+
+class Command(BaseCommand):
+    help = 'Замеряет сверку статусов платежей на локальной замене Stripe; данные откатываются после замера'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payments', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8])
+        parser.add_argument('--latency', type=float, default=0.05, help='задержка ответа Stripe, сек')
+        parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help='доля ответов 429')
+
+    def handle(self, *args, **options):
+        api_base, api_key = stripe.api_base, stripe.api_key
+        try:
+            with StripeStubServer(options['latency'], options['rate_limit_ratio']) as server:
+                stripe.api_base, stripe.api_key = server.url, 'sk_test_stub'
+                for concurrency in options['concurrency']:
+                    self.run(server, options['payments'], concurrency)
+        finally:
+            stripe.api_base, stripe.api_key = api_base, api_key
+
+    def run(self, server, count, concurrency):
+        try:
+            self.measure(server, count, concurrency)
+        finally:
+            # Сверка кэширует статусы сессий бессрочно, а платежи откатываются вместе с транзакцией
+            forget_statuses(f'cs_bench_{i}' for i in range(count))
+
+    def measure(self, server, count, concurrency):
+        with transaction.atomic():
+            user = User.objects.create(email=f'bench-{time.time_ns()}@example.com')
+            Payments.objects.bulk_create([
+                Payments(user=user, pay_sum=1000, session_id=f'cs_bench_{i}', payment_status='pending')
+                for i in range(count)
+            ])
+            requests_before, limited_before = server.requests, server.rate_limited
+
+            start = time.perf_counter()
+            with override_settings(STRIPE_RECONCILE_BACKOFF=0.05):
+                stats = reconcile_payments(stale_payments().filter(user=user), concurrency=concurrency)
+            elapsed = time.perf_counter() - start
+
+            self.stdout.write(
+                f'concurrency={concurrency}: {stats["checked"]} payments in {elapsed:.2f}s '
+                f'({stats["checked"] / elapsed:.0f}/s), updated={stats["updated"]}, failed={stats["failed"]}, '
+                f'requests={server.requests - requests_before}, 429={server.rate_limited - limited_before}'
+            )
+            transaction.set_rollback(True)
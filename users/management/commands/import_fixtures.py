@@ -0,0 +1,51 @@
+import time
+
+from django.apps import apps
+from django.core.management import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+
+from config.utils import preserve_auto_dates
+from users.fixtures import FixtureError, FixtureImporter, iter_records
+
+
+class Command(BaseCommand):
+    help = ('Быстро загружает большие фикстуры (JSON-массив dumpdata или NDJSON): файл читается потоком, '
+            'объекты пишутся пачками через bulk_create без сигналов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--exclude', '-e', action='append', default=[],
+                            help='приложение или модель (app_label или app_label.Model), которые нужно пропустить')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--progress-every', type=float, default=5.0, help='как часто печатать прогресс, сек')
+
+    def handle(self, *args, **options):
+        excluded = {label.lower() for label in options['exclude']}
+        importer = FixtureImporter(options['batch_size'], options['database'])
+        start = last_report = time.perf_counter()
+        read = 0
+        try:
+            with transaction.atomic(using=options['database']), preserve_auto_dates(apps.get_models()):
+                for path in options['files']:
+                    with open(path, encoding='utf-8') as stream:
+                        for record in iter_records(stream):
+                            label = str(record.get('model', '')).lower()
+                            if label in excluded or label.split('.')[0] in excluded:
+                                continue
+                            importer.add(record)
+                            read += 1
+                            if time.perf_counter() - last_report >= options['progress_every']:
+                                last_report = time.perf_counter()
+                                self.stdout.write(f'{read} objects read, {read / (last_report - start):.0f} rows/s')
+                importer.flush_all()
+                importer.reset_sequences()
+        except (OSError, FixtureError, IntegrityError) as exc:
+            raise CommandError(str(exc)) from exc
+
+        elapsed = time.perf_counter() - start
+        for label, count in importer.counts.items():
+            self.stdout.write(f'{label:<30} {count}')
+        total = sum(importer.counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {total} rows in {elapsed:.1f} s ({total / max(elapsed, 1e-9):.0f} rows/s)'))
@@ -0,0 +1,27 @@
+import requests
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from users.stripe_stub import checkout_session_event, sign_payload
+
+
+class Command(BaseCommand):
+    help = 'Отправляет подписанное событие сессии оплаты на локальный вебхук Stripe'
+
+    def add_arguments(self, parser):
+        parser.add_argument('session_id')
+        parser.add_argument('--url', default='http://127.0.0.1:8000/stripe/webhook/')
+        parser.add_argument('--type', default='checkout.session.completed')
+        parser.add_argument('--status', default='complete')
+        parser.add_argument('--payment-status', default='paid')
+
+    def handle(self, *args, **options):
+        if not settings.STRIPE_WEBHOOK_SECRET:
+            raise CommandError('STRIPE_WEBHOOK_SECRET is not configured')
+        payload = checkout_session_event(options['session_id'], options['type'], options['status'],
+                                         options['payment_status'])
+        response = requests.post(options['url'], data=payload, timeout=10, headers={
+            'Content-Type': 'application/json',
+            'Stripe-Signature': sign_payload(payload, settings.STRIPE_WEBHOOK_SECRET),
+        })
+        self.stdout.write(f'{response.status_code} {response.text}')
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_alter_user_last_login'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payments',
+            name='pay_date',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='дата оплаты'),
+        ),
+    ]
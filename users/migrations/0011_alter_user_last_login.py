@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 10:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_alter_payments_pay_date'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='last_login',
+            field=models.DateTimeField(auto_now=True, db_index=True, null=True, verbose_name='Последний вход'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.14 on 2026-10-18 10:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0013_course_stripe_product_id'),
+        ('users', '0011_alter_user_last_login'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripePrice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveIntegerField(verbose_name='сумма')),
+                ('currency', models.CharField(default='rub', max_length=3, verbose_name='валюта')),
+                ('price_id', models.CharField(max_length=100, verbose_name='id цены stripe')),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='materials.course', verbose_name='курс')),
+            ],
+            options={
+                'verbose_name': 'цена stripe',
+                'verbose_name_plural': 'цены stripe',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='stripeprice',
+            constraint=models.UniqueConstraint(fields=('course', 'amount', 'currency'), name='stripe_price_course_amount'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.14 on 2026-10-18 10:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_stripeprice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=100, unique=True, verbose_name='id события')),
+                ('event_type', models.CharField(max_length=100, verbose_name='тип события')),
+                ('session_id', models.CharField(max_length=250, verbose_name='id сессии')),
+                ('payload', models.JSONField(verbose_name='сессия')),
+                ('created', models.DateTimeField(verbose_name='создано в stripe')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='применено')),
+            ],
+            options={
+                'verbose_name': 'событие stripe',
+                'verbose_name_plural': 'события stripe',
+                'indexes': [models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['created'], name='stripe_event_pending_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.0.14 on 2026-10-18 10:18
+
+import json
+
+from django.db import migrations, models
+
+STATUSES = ('pending', 'open', 'complete', 'paid', 'expired', 'failed')
+
+
+def session_status(session):
+    if session.get('payment_status') in ('paid', 'no_payment_required'):
+        return 'paid'
+    if session.get('status') in ('expired', 'complete'):
+        return session['status']
+    return 'open'
+
+
+def compact_payment_status(apps, schema_editor):
+    """Переносит сохраненную целиком сессию stripe в stripe_session, а в payment_status оставляет короткий статус"""
+    Payments = apps.get_model('users', 'Payments')
+    payments = Payments.objects.filter(payment_status__isnull=False).exclude(payment_status__in=STATUSES)
+    batch = []
+    for payment in payments.only('id', 'payment_status').iterator(chunk_size=500):
+        try:
+            session = json.loads(payment.payment_status)
+        except ValueError:
+            session = None
+        if isinstance(session, dict):
+            payment.stripe_session = session
+            payment.payment_status = session_status(session)
+        else:
+            payment.payment_status = None
+        batch.append(payment)
+        if len(batch) == 500:
+            Payments.objects.bulk_update(batch, ['payment_status', 'stripe_session'])
+            batch = []
+    Payments.objects.bulk_update(batch, ['payment_status', 'stripe_session'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0013_stripeevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payments',
+            name='stripe_session',
+            field=models.JSONField(blank=True, null=True, verbose_name='сессия stripe'),
+        ),
+        migrations.RunPython(compact_payment_status, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='payments',
+            name='payment_status',
+            field=models.CharField(blank=True, choices=[('pending', 'создается'), ('open', 'ожидает оплаты'), ('complete', 'оплата обрабатывается'), ('paid', 'оплачен'), ('expired', 'истек'), ('failed', 'ошибка')], db_index=True, max_length=20, null=True, verbose_name='статус оплаты'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 10:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0014_compact_payment_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payments',
+            name='stripe_event_created',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='время примененного события stripe'),
+        ),
+    ]
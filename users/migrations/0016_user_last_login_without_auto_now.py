@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 11:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0015_payments_stripe_event_created'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='last_login',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Последний вход'),
+        ),
+    ]
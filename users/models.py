@@ -2,6 +2,7 @@ from datetime import datetime
 
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models import Q
 
 from materials.models import Course, Lesson
 
@@ -16,7 +17,7 @@ class User(AbstractUser):
     phone = models.CharField(verbose_name='телефон', **NULLABLE)
     city = models.CharField(max_length=50, verbose_name='город', **NULLABLE)
     is_active = models.BooleanField(default='True', verbose_name='активность')
-    last_login = models.DateTimeField(auto_now=True, verbose_name="Последний вход", **NULLABLE)
+    last_login = models.DateTimeField(db_index=True, verbose_name="Последний вход", **NULLABLE)
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
 
@@ -28,20 +29,98 @@ class User(AbstractUser):
         verbose_name_plural = 'пользователи'
 
 
+class PaymentsManager(models.Manager):
+
+    def get_queryset(self):
+        # Сырая сессия Stripe (несколько КБ JSON на платеж) нужна только для разбора инцидентов и в ответы
+        # не попадает; менеджер по умолчанию используют и вложенные payments_set. Загрузить ее: .defer(None)
+        return super().get_queryset().defer('stripe_session')
+
+
 class Payments(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_OPEN = 'open'
+    STATUS_COMPLETE = 'complete'
+    STATUS_PAID = 'paid'
+    STATUS_EXPIRED = 'expired'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'создается'),
+        (STATUS_OPEN, 'ожидает оплаты'),
+        (STATUS_COMPLETE, 'оплата обрабатывается'),
+        (STATUS_PAID, 'оплачен'),
+        (STATUS_EXPIRED, 'истек'),
+        (STATUS_FAILED, 'ошибка'),
+    )
+    TERMINAL_STATUSES = (STATUS_PAID, STATUS_EXPIRED, STATUS_FAILED)
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='пользователь')
-    pay_date = models.DateTimeField(auto_now=True, verbose_name='дата оплаты')
+    pay_date = models.DateTimeField(auto_now=True, db_index=True, verbose_name='дата оплаты')
     paid_course = models.ForeignKey(Course, on_delete=models.CASCADE, verbose_name='оплаченный курс', **NULLABLE)
     paid_lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, verbose_name='оплаченный урок', **NULLABLE)
     pay_sum = models.PositiveIntegerField(verbose_name='сумма оплаты')
     pay_transfer = models.BooleanField(default=True, verbose_name='оплата переводом')
     session_id = models.CharField(max_length=250, **NULLABLE, verbose_name="id сессии")
     payment_link = models.URLField(max_length=500, **NULLABLE, verbose_name="Ссылка на оплату")
-    payment_status = models.TextField(**NULLABLE, verbose_name="статус оплаты")
+    payment_status = models.CharField(max_length=20, choices=STATUS_CHOICES, db_index=True, **NULLABLE,
+                                      verbose_name="статус оплаты")
+    stripe_session = models.JSONField(**NULLABLE, verbose_name="сессия stripe")
+    stripe_event_created = models.DateTimeField(**NULLABLE, verbose_name="время примененного события stripe")
+
+    objects = PaymentsManager()
 
     def __str__(self):
         return f"{self.user}"
 
+    @classmethod
+    def status_from_session(cls, session):
+        """Сводит сессию оплаты Stripe к статусу платежа"""
+        if session.get("payment_status") in ("paid", "no_payment_required"):
+            return cls.STATUS_PAID
+        if session.get("status") == "expired":
+            return cls.STATUS_EXPIRED
+        if session.get("status") == "complete":
+            return cls.STATUS_COMPLETE
+        return cls.STATUS_OPEN
+
     class Meta:
         verbose_name = 'платеж'
         verbose_name_plural = 'платежи'
+
+
+class StripePrice(models.Model):
+    """Цена stripe, созданная для курса с заданной суммой; переиспользуется между платежами"""
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, verbose_name='курс')
+    amount = models.PositiveIntegerField(verbose_name='сумма')
+    currency = models.CharField(max_length=3, default='rub', verbose_name='валюта')
+    price_id = models.CharField(max_length=100, verbose_name='id цены stripe')
+
+    def __str__(self):
+        return f'{self.course} - {self.amount} {self.currency}'
+
+    class Meta:
+        verbose_name = 'цена stripe'
+        verbose_name_plural = 'цены stripe'
+        constraints = [
+            models.UniqueConstraint(fields=['course', 'amount', 'currency'], name='stripe_price_course_amount'),
+        ]
+
+
+class StripeEvent(models.Model):
+    """Событие сессии оплаты из вебхука Stripe; event_id защищает от повторной доставки"""
+    event_id = models.CharField(max_length=100, unique=True, verbose_name='id события')
+    event_type = models.CharField(max_length=100, verbose_name='тип события')
+    session_id = models.CharField(max_length=250, verbose_name='id сессии')
+    payload = models.JSONField(verbose_name='сессия')
+    created = models.DateTimeField(verbose_name='создано в stripe')
+    processed_at = models.DateTimeField(verbose_name='применено', **NULLABLE)
+
+    def __str__(self):
+        return f'{self.event_type} {self.event_id}'
+
+    class Meta:
+        verbose_name = 'событие stripe'
+        verbose_name_plural = 'события stripe'
+        indexes = [
+            models.Index(fields=['created'], condition=Q(processed_at__isnull=True), name='stripe_event_pending_idx'),
+        ]
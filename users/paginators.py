@@ -0,0 +1,15 @@
+from materials.paginators import MaterialsCursorPagination, SwitchablePagination
+
+
+class PaymentsCursorPagination(MaterialsCursorPagination):
+    # pay_date (auto_now) меняется при каждом обновлении статуса, курсор по нему пропускал бы и повторял строки
+    ordering = ('-id',)
+
+
+class PaymentsPagination(SwitchablePagination):
+    page_class = None
+    cursor_class = PaymentsCursorPagination
+
+
+class UsersPagination(SwitchablePagination):
+    page_class = None
@@ -1,18 +1,18 @@
 from rest_framework.permissions import BasePermission
 
+from users.roles import in_drf_admin_group
+
 
 class IsUserAdmDRF(BasePermission):
 
     def has_permission(self, request, view):
-        if request.user.groups.filter(name='Администраторы DRF').exists:
-            return True
-        return False
+        return in_drf_admin_group(request)
 
 
 class IsUserOwner(BasePermission):
 
     def has_object_permission(self, request, view, obj):
-        return request.user == obj.owner
+        return request.user.id == obj.owner_id
 
 
 class IsUserUser(BasePermission):
@@ -0,0 +1,94 @@
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from users.models import Payments
+from users.services import cache_statuses, check_status_stripe
+
+logger = logging.getLogger(__name__)
+
+
+def stale_payments():
+    """Платежи с сессией оплаты, статус которых еще может измениться"""
+    return Payments.objects.filter(session_id__isnull=False).exclude(payment_status__in=Payments.TERMINAL_STATUSES)
+
+
+def fetch_session(session_id):
+    """Запрашивает сессию в Stripe, при ответе 429 повторяя запрос с экспоненциальной паузой"""
+    retries = settings.STRIPE_RECONCILE_MAX_RETRIES
+    for attempt in range(retries + 1):
+        try:
+            return check_status_stripe(session_id)
+        except stripe.error.RateLimitError:
+            if attempt < retries:
+                time.sleep(settings.STRIPE_RECONCILE_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
+        except stripe.error.StripeError as exc:
+            logger.warning('Session %s was not reconciled: %s', session_id, exc)
+            return None
+    logger.warning('Session %s was not reconciled: rate limited %d times', session_id, retries + 1)
+    return None
+
+
+def store_sessions(payment_ids, sessions, fetched_at, batch_size):
+    """Записывает в платежи статусы сессий, полученные из Stripe. Пока шел запрос, вебхук мог применить
+    событие не старше ответа: такие платежи и уже завершенные не перезаписываются"""
+    with transaction.atomic():
+        payments = list(
+            Payments.objects.select_for_update()
+            .filter(pk__in=payment_ids, session_id__in=sessions)
+            .only('id', 'session_id', 'payment_status', 'stripe_event_created')
+        )
+        updated = []
+        for payment in payments:
+            if payment.payment_status in Payments.TERMINAL_STATUSES:
+                continue
+            if payment.stripe_event_created is not None and payment.stripe_event_created >= fetched_at:
+                continue
+            session = sessions[payment.session_id]
+            payment.payment_status = Payments.status_from_session(session)
+            payment.stripe_session = session
+            payment.stripe_event_created = fetched_at
+            updated.append(payment)
+        Payments.objects.bulk_update(updated, ['payment_status', 'stripe_session', 'stripe_event_created'],
+                                     batch_size=batch_size)
+    return updated
+
+
+def reconcile_payments(queryset=None, concurrency=None, batch_size=None):
+    """Обновляет незавершенные статусы платежей из Stripe не более чем concurrency параллельными запросами"""
+    queryset = stale_payments() if queryset is None else queryset
+    concurrency = concurrency or settings.STRIPE_RECONCILE_CONCURRENCY
+    batch_size = batch_size or settings.STRIPE_RECONCILE_BATCH_SIZE
+    stats = {'checked': 0, 'updated': 0, 'failed': 0}
+    last_pk = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while True:
+            payments = list(
+                queryset.filter(pk__gt=last_pk).order_by('pk').only('id', 'session_id')[:batch_size]
+            )
+            if not payments:
+                break
+            last_pk = payments[-1].pk
+
+            # Ответ Stripe не старше начала запроса: с этим временем он сравнивается с событиями вебхуков
+            fetched_at = timezone.now()
+            sessions = dict(zip(
+                [payment.session_id for payment in payments],
+                pool.map(fetch_session, [payment.session_id for payment in payments]),
+            ))
+            fetched = {session_id: session for session_id, session in sessions.items() if session is not None}
+            updated = []
+            if fetched:
+                updated = store_sessions([payment.pk for payment in payments], fetched, fetched_at, batch_size)
+            cache_statuses({payment.session_id: fetched[payment.session_id] for payment in updated})
+
+            stats['checked'] += len(payments)
+            stats['updated'] += len(updated)
+            stats['failed'] += len(payments) - len(fetched)
+    return stats
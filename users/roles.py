@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+
+DRF_ADMIN_GROUP = 'Администраторы DRF'
+
+
+def _role_key(user_id):
+    return f'users:drf_admin:{user_id}'
+
+
+def forget_roles(user_ids):
+    """Сбрасывает закэшированное членство в группе администраторов DRF"""
+    cache.delete_many([_role_key(user_id) for user_id in user_ids])
+
+
+def in_drf_admin_group(request):
+    """Состоит ли пользователь в группе администраторов DRF; считается один раз за запрос"""
+    if not hasattr(request, '_in_drf_admin_group'):
+        user = request.user
+        if not user.is_authenticated:
+            request._in_drf_admin_group = False
+        else:
+            key = _role_key(user.pk)
+            in_group = cache.get(key)
+            if in_group is None:
+                in_group = Group.objects.filter(user=user.pk, name=DRF_ADMIN_GROUP).exists()
+                cache.set(key, in_group, settings.ROLES_CACHE_TTL)
+            request._in_drf_admin_group = in_group
+    return request._in_drf_admin_group
+
+
+def is_materials_admin(request):
+    """Видит ли пользователь все курсы и уроки, а не только свои"""
+    return request.user.is_superuser or in_drf_admin_group(request)
@@ -1,25 +1,28 @@
-from rest_framework import serializers
-
+from config.serializers import TimedListSerializer, TimedModelSerializer
 from users.models import User, Payments
 
 
-class PaymentsSerializer(serializers.ModelSerializer):
+class PaymentsSerializer(TimedModelSerializer):
     class Meta:
         model = Payments
-        fields = '__all__'
+        exclude = ('stripe_session', 'stripe_event_created')
+        read_only_fields = ('session_id', 'payment_link', 'payment_status')
+        list_serializer_class = TimedListSerializer
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedModelSerializer):
     payments = PaymentsSerializer(source="payments_set", many=True, read_only=True)
 
     class Meta:
         model = User
         fields = ['id', 'email', 'password', 'avatar', 'phone', 'city', 'last_login', 'payments']
+        list_serializer_class = TimedListSerializer
 
 
-class UserSerializerForOthers(serializers.ModelSerializer):
+class UserSerializerForOthers(TimedModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'email', 'avatar', 'last_login', 'phone', 'city']
+        list_serializer_class = TimedListSerializer
 
 
@@ -1,34 +1,175 @@
+import threading
+import time
+from contextlib import contextmanager
+
 import stripe
+from django.core.cache import cache
+
+from config.middleware import track
+from config.settings import (STRIPE_API_BASE, STRIPE_API_KEY, STRIPE_MAX_NETWORK_RETRIES, STRIPE_STATUS_CACHE_TTL,
+                             STRIPE_TIMEOUT)
+from materials.models import Course
+from users.models import Payments, StripePrice
+
+
+def build_http_client():
+    """HTTP-клиент Stripe с keep-alive соединениями, общий для всех вызовов процесса.
+
+    Сессию requests клиент создает сам, отдельную в каждом потоке: requests.Session не потокобезопасна,
+    а reconcile_payments ходит в Stripe из нескольких потоков.
+    """
+    return stripe.http_client.RequestsClient(timeout=STRIPE_TIMEOUT)
 
-from config.settings import STRIPE_API_KEY
 
 stripe.api_key = STRIPE_API_KEY
+if STRIPE_API_BASE:
+    stripe.api_base = STRIPE_API_BASE
+stripe.default_http_client = build_http_client()
+# При повторах POST-запросов stripe сам добавляет ключи идемпотентности
+stripe.max_network_retries = STRIPE_MAX_NETWORK_RETRIES
 
 
+@track('stripe')
 def create_stripe_product(course):
     """Создает продукт stripe"""
     return stripe.Product.create(name=course.name)
 
 
-def create_stripe_price(product, amount):
+@track('stripe')
+def create_stripe_price(product, amount, currency="rub"):
     """Создает цену stripe"""
     return stripe.Price.create(
         product=product.get("id"),
-        currency="rub",
+        currency=currency,
         unit_amount=int(amount) * 100,
     )
 
 
+def get_course_price(course, amount, currency="rub"):
+    """Возвращает цену stripe для курса из локального каталога, создавая продукт и цену только при первой оплате"""
+    price_id = StripePrice.objects.filter(
+        course=course, amount=amount, currency=currency,
+    ).values_list('price_id', flat=True).first()
+    if price_id:
+        return {"id": price_id}
+
+    if not course.stripe_product_id:
+        product = create_stripe_product(course)
+        Course.objects.filter(pk=course.pk, stripe_product_id__isnull=True).update(stripe_product_id=product.get("id"))
+        # При гонке двух оплат побеждает продукт, сохраненный первым
+        course.stripe_product_id = Course.objects.values_list('stripe_product_id', flat=True).get(pk=course.pk)
+
+    price = create_stripe_price({"id": course.stripe_product_id}, amount, currency)
+    stored, _ = StripePrice.objects.get_or_create(
+        course=course, amount=amount, currency=currency, defaults={'price_id': price.get("id")},
+    )
+    return {"id": stored.price_id}
+
+
+@track('stripe')
 def create_stripe_session(price):
     """Создавет сессию stripe"""
-    session = stripe.checkout.Session.create(
+    return stripe.checkout.Session.create(
         success_url="http://127.0.0.1:8000/courses/",
         line_items=[{"price": price.get("id"), "quantity": 1}],
         mode="payment",
     )
-    return session.get("id"), session.get("url")
 
 
+@track('stripe')
 def check_status_stripe(session_id):
     """Проверяет статус оплаты"""
     return stripe.checkout.Session.retrieve(session_id)
+
+
+def _status_key(session_id):
+    return f'users:stripe_status:{session_id}'
+
+
+_status_trackers = []
+
+# Ограниченный набор блокировок: запросы одной сессии внутри процесса ждут друг друга
+_status_locks = [threading.Lock() for _ in range(64)]
+
+
+def is_terminal_status(session):
+    """Истекшая или оплаченная сессия больше не меняется"""
+    return Payments.status_from_session(session) in Payments.TERMINAL_STATUSES
+
+
+def _remember_statuses(session_ids):
+    for tracked in _status_trackers:
+        tracked.update(session_ids)
+
+
+@contextmanager
+def track_statuses():
+    """Собирает id сессий, статусы которых закэшированы внутри блока"""
+    tracked = set()
+    _status_trackers.append(tracked)
+    try:
+        yield tracked
+    finally:
+        _status_trackers.remove(tracked)
+
+
+def _store_status(session_id, session):
+    _remember_statuses([session_id])
+    if is_terminal_status(session):
+        cache.set(_status_key(session_id), session, timeout=None)
+        Payments.objects.filter(session_id=session_id).update(
+            payment_status=Payments.status_from_session(session), stripe_session=session,
+        )
+    else:
+        cache.set(_status_key(session_id), session, STRIPE_STATUS_CACHE_TTL)
+
+
+def forget_statuses(session_ids):
+    """Удаляет закэшированные статусы сессий (после замеров, данные которых откатываются)"""
+    cache.delete_many([_status_key(session_id) for session_id in session_ids])
+
+
+def cache_statuses(sessions):
+    """Кладет в кэш статусы сессий: итоговые бессрочно, остальные на STRIPE_STATUS_CACHE_TTL,
+    чтобы пропущенное или опоздавшее событие не закрепило промежуточный статус навсегда"""
+    _remember_statuses(sessions)
+    terminal = {}
+    pending = {}
+    for session_id, session in sessions.items():
+        (terminal if is_terminal_status(session) else pending)[_status_key(session_id)] = session
+    cache.set_many(terminal, timeout=None)
+    cache.set_many(pending, timeout=STRIPE_STATUS_CACHE_TTL)
+
+
+def get_session_status(session_id):
+    """Статус сессии оплаты из кэша; одновременные запросы одной сессии делают один вызов Stripe"""
+    key = _status_key(session_id)
+    session = cache.get(key)
+    if session is not None:
+        return session
+
+    with _status_locks[hash(session_id) % len(_status_locks)]:
+        session = cache.get(key)
+        if session is not None:
+            return session
+
+        lock_key = f'{key}:lock'
+        if cache.add(lock_key, 1, timeout=STRIPE_TIMEOUT):
+            try:
+                session = check_status_stripe(session_id)
+                _store_status(session_id, session)
+            finally:
+                cache.delete(lock_key)
+            return session
+
+        # Статус уже запрашивает другой процесс: ждем его результат, но не дольше таймаута Stripe
+        deadline = time.monotonic() + STRIPE_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            session = cache.get(key)
+            if session is not None:
+                return session
+        # Владелец блокировки не успел: результат сохраняется так же, чтобы следующие запросы не шли в Stripe
+        session = check_status_stripe(session_id)
+        _store_status(session_id, session)
+        return session
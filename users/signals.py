@@ -0,0 +1,46 @@
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from materials.models import Course
+from users.models import StripePrice, User
+from users.roles import forget_roles
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def forget_changed_roles(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        forget_roles([instance.pk])
+    elif action == 'pre_clear':
+        forget_roles(instance.user_set.values_list('pk', flat=True))
+    else:
+        forget_roles(pk_set)
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def forget_group_roles(sender, instance, **kwargs):
+    forget_roles(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(pre_save, sender=Course)
+def forget_renamed_course_product(sender, instance, update_fields=None, **kwargs):
+    """Переименованному курсу нужен новый продукт stripe, старые продукт и цены больше не используются"""
+    if instance._state.adding:
+        return
+    if update_fields is not None and 'name' not in update_fields:
+        return
+    loaded = getattr(instance, '_loaded_values', {})
+    if 'name' in loaded:
+        previous_name = loaded['name']
+    else:
+        previous_name = Course.objects.filter(pk=instance.pk).values_list('name', flat=True).first()
+    if previous_name is None or previous_name == instance.name:
+        return
+    # stripe_product_id в памяти может быть устаревшим, поэтому продукт сбрасывается по данным базы;
+    # update_fields может не содержать stripe_product_id, поэтому это отдельный запрос
+    instance.stripe_product_id = None
+    if Course.objects.filter(pk=instance.pk, stripe_product_id__isnull=False).update(stripe_product_id=None):
+        StripePrice.objects.filter(course=instance).delete()
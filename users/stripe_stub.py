@@ -0,0 +1,124 @@
+"""Локальная замена Stripe для тестов и замеров: подписанные события вебхука и HTTP API сессий оплаты"""
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+def sign_payload(payload, secret, timestamp=None):
+    """Заголовок Stripe-Signature для тела вебхука, как его формирует Stripe"""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+
+def checkout_session_event(session_id, event_type='checkout.session.completed', status='complete',
+                           payment_status='paid', event_id=None, created=None):
+    """Тело события сессии оплаты в формате Stripe"""
+    return json.dumps({
+        'id': event_id or f'evt_{uuid.uuid4().hex}',
+        'object': 'event',
+        'type': event_type,
+        'created': int(time.time()) if created is None else created,
+        'data': {
+            'object': {
+                'id': session_id,
+                'object': 'checkout.session',
+                'status': status,
+                'payment_status': payment_status,
+            },
+        },
+    })
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Заголовки и тело уходят одним пакетом, иначе keep-alive упирается в задержку ACK
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def begin(self):
+        """Считает запрос и ждет latency; возвращает False, если запрос получил ответ 429"""
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        time.sleep(server.latency)
+        if random.random() < server.rate_limit_ratio:
+            with server.lock:
+                server.rate_limited += 1
+            self.send_json(429, {'error': {'type': 'rate_limit_error', 'message': 'Too many requests'}})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self.path.startswith('/v1/checkout/sessions/'):
+            return self.not_found()
+        if not self.begin():
+            return
+        session_id = self.path.rsplit('/', 1)[-1].split('?')[0]
+        self.send_json(200, {'id': session_id, 'object': 'checkout.session', 'status': 'complete',
+                             'payment_status': 'paid'})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode()
+        path = self.path.split('?')[0].rstrip('/')
+        if path not in ('/v1/products', '/v1/prices', '/v1/checkout/sessions'):
+            return self.not_found()
+        if not self.begin():
+            return
+        params = {key: values[0] for key, values in parse_qs(body).items()}
+        object_id = uuid.uuid4().hex[:24]
+        if path == '/v1/products':
+            return self.send_json(200, {'id': f'prod_{object_id}', 'object': 'product', 'name': params.get('name')})
+        if path == '/v1/prices':
+            return self.send_json(200, {'id': f'price_{object_id}', 'object': 'price', 'product': params.get('product'),
+                                        'currency': params.get('currency'),
+                                        'unit_amount': int(params.get('unit_amount', 0))})
+        session_id = f'cs_stub_{object_id}'
+        self.send_json(200, {'id': session_id, 'object': 'checkout.session', 'status': 'open',
+                             'payment_status': 'unpaid', 'url': f'https://checkout.stripe.com/c/pay/{session_id}'})
+
+    def not_found(self):
+        self.send_json(404, {'error': {'type': 'invalid_request_error', 'message': 'Not found'}})
+
+    def send_json(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StripeStubServer(ThreadingHTTPServer):
+    """HTTP-сервер, отвечающий с задержкой и долей ответов 429 на GET /v1/checkout/sessions/<id> и на создание
+    продукта, цены и сессии оплаты (POST /v1/products, /v1/prices, /v1/checkout/sessions)"""
+    daemon_threads = True
+
+    def __init__(self, latency=0.05, rate_limit_ratio=0.0, port=0):
+        super().__init__(('127.0.0.1', port), _StubHandler)
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.requests = 0
+        self.rate_limited = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,66 @@
+import logging
+
+import stripe
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+
+from users.models import Payments
+from users.services import create_stripe_price, create_stripe_product, create_stripe_session, get_course_price
+from users.reconcile import reconcile_payments
+from users.webhooks import apply_pending_events
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=10)
+def provision_checkout(self, payment_id: int):
+    """Создает продукт, цену и сессию оплаты в Stripe для платежа, сохраненного со статусом pending"""
+    payment = Payments.objects.select_related('paid_course', 'paid_lesson').filter(pk=payment_id).first()
+    if payment is None or payment.session_id:
+        # Платеж удален или уже обработан повторной доставкой задачи
+        return None
+    if payment.paid_course is None and payment.paid_lesson is None:
+        # Оплачивать нечего: повторы задачи не помогут
+        logger.warning('Payment %s has neither a course nor a lesson to pay for', payment_id)
+        Payments.objects.filter(pk=payment_id).update(payment_status=Payments.STATUS_FAILED)
+        return None
+
+    try:
+        if payment.paid_course is not None:
+            price = get_course_price(payment.paid_course, payment.pay_sum)
+        else:
+            product = create_stripe_product(payment.paid_lesson)
+            price = create_stripe_price(product=product, amount=payment.pay_sum)
+        session = create_stripe_session(price)
+    except stripe.error.StripeError as exc:
+        if self.request.retries >= self.max_retries:
+            logger.warning('Checkout for payment %s failed: %s', payment_id, exc)
+            Payments.objects.filter(pk=payment_id).update(payment_status=Payments.STATUS_FAILED)
+            return None
+        raise self.retry(exc=exc)
+
+    Payments.objects.filter(pk=payment_id).update(
+        session_id=session.get('id'),
+        payment_link=session.get('url'),
+        payment_status=Payments.status_from_session(session),
+        stripe_session=session,
+    )
+    return session.get('id')
+
+
+@shared_task
+def apply_stripe_events():
+    return apply_pending_events()
+
+
+@shared_task
+def reconcile_payment_statuses():
+    # Долгая сверка не должна пересекаться со следующим запуском по расписанию
+    lock_key = 'users:reconcile_payments:lock'
+    if not cache.add(lock_key, 1, timeout=int(settings.STRIPE_RECONCILE_INTERVAL.total_seconds())):
+        return None
+    try:
+        return reconcile_payments()
+    finally:
+        cache.delete(lock_key)
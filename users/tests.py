@@ -1,11 +1,34 @@
+import io
 import json
-from datetime import datetime
-
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+
+import stripe
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APITestCase, APIClient
-
-from materials.models import Course, Lesson
-from users.models import User, Payments
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from config.testing import QueryBudgetMixin
+from materials.models import Course, Lesson, TaskOutbox
+from users.fixtures import FixtureError, iter_records
+from users.models import User, Payments, StripeEvent, StripePrice
+from users.services import check_status_stripe, get_session_status
+from users.reconcile import reconcile_payments, stale_payments, store_sessions
+from users.stripe_stub import StripeStubServer, checkout_session_event, sign_payload
+from users.tasks import provision_checkout
+from users.webhooks import apply_pending_events
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 
 
@@ -15,6 +38,22 @@ class UserTestCase(APITestCase):
         self.user = User.objects.create(email='test@test.com', password='12345')
         self.client.force_authenticate(user=self.user)
 
+    def test_last_login_set_on_login_only(self):
+        self.user.set_password('12345')
+        self.user.save()
+        self.assertIsNone(User.objects.get(pk=self.user.pk).last_login)
+
+        self.client.force_authenticate(user=None)
+        response = self.client.post(reverse('users:token_obtain_pair'), {'email': self.user.email, 'password': '12345'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        last_login = User.objects.get(pk=self.user.pk).last_login
+        self.assertIsNotNone(last_login)
+
+        user = User.objects.get(pk=self.user.pk)
+        user.city = 'Москва'
+        user.save()
+        self.assertEqual(User.objects.get(pk=self.user.pk).last_login, last_login)
+
     def test_list_users(self):
         response = self.client.get(
             reverse('users:user_list'),
@@ -118,6 +157,36 @@ class PaymentsTestCase(APITestCase):
               'paid_course': None, 'paid_lesson': None}]
         )
 
+    def test_list_payments_cursor(self):
+        for pay_sum in range(1, 12):
+            Payments.objects.create(user=self.user, pay_sum=pay_sum)
+
+        response = self.client.get('/payments/?pagination=cursor')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([payment['pay_sum'] for payment in response.json()['results']], list(range(11, 1, -1)))
+
+        response = self.client.get(response.json()['next'])
+
+        self.assertEqual([payment['pay_sum'] for payment in response.json()['results']], [1, 1000])
+        self.assertIsNone(response.json()['next'])
+
+    def test_list_payments_cursor_stable_on_update(self):
+        for pay_sum in range(1, 5):
+            Payments.objects.create(user=self.user, pay_sum=pay_sum)
+
+        response = self.client.get('/payments/?pagination=cursor&page_size=2')
+        self.assertEqual([payment['pay_sum'] for payment in response.json()['results']], [4, 3])
+        # обновление (например, статуса из вебхука) сдвигает pay_date, но не порядок страниц
+        Payments.objects.get(pay_sum=1).save()
+        Payments.objects.get(pay_sum=4).save()
+
+        pages = []
+        while response.json()['next']:
+            response = self.client.get(response.json()['next'])
+            pages.extend(payment['pay_sum'] for payment in response.json()['results'])
+        self.assertEqual(pages, [2, 1, 1000])
+
     def test_create_payments(self):
         data = {
             "user": self.user.pk,
@@ -177,3 +246,608 @@ class PaymentsTestCase(APITestCase):
             response.status_code,
             status.HTTP_204_NO_CONTENT
         )
+
+
+class UsersQueryBudgetTestCase(QueryBudgetMixin, APITestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = User.objects.create(email='test@test.com', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(name='test', owner=self.user)
+        self.users = []
+
+    def seed(self, size):
+        while len(self.users) < size:
+            user = User.objects.create(email=f'{len(self.users)}@test.com', password='12345')
+            Payments.objects.create(user=self.user, paid_course=self.course, pay_sum=1000)
+            self.users.append(user)
+
+    def test_list_users(self):
+        self.assertQueryBudget(lambda: ('get', reverse('users:user_list'), None), max_queries=1, max_bytes=250,
+                               per_row=True)
+
+    def test_retrieve_user(self):
+        self.assertQueryBudget(lambda: ('get', reverse('users:user_detail', kwargs={'pk': self.user.pk}), None),
+                               max_queries=3, max_bytes=400, per_row=True)
+
+    def test_create_user(self):
+        def make_request():
+            return 'post', reverse('users:user_create'), {'email': f'new{len(self.users)}@test.com', 'password': '1'}
+
+        self.assertQueryBudget(make_request, max_queries=5, max_bytes=200)
+
+    def test_update_user(self):
+        self.assertQueryBudget(lambda: ('patch', reverse('users:user_update', kwargs={'pk': self.user.pk}),
+                                        {'city': 'test'}), max_queries=3, max_bytes=400, per_row=True)
+
+    def test_delete_user(self):
+        def make_request():
+            user = User.objects.create(email=f'delete{len(self.users)}@test.com', password='12345')
+            self.client.force_authenticate(user=user)
+            return 'delete', reverse('users:user_delete', kwargs={'pk': user.pk}), None
+
+        self.assertQueryBudget(make_request, max_queries=9, max_bytes=0)
+
+    def test_nested_payments_defer_stripe_session(self):
+        Payments.objects.create(user=self.user, pay_sum=1000, stripe_session={'id': 'cs_test', 'blob': 'x' * 4096})
+
+        for method, url, data in (('get', reverse('users:user_detail', kwargs={'pk': self.user.pk}), None),
+                                  ('patch', reverse('users:user_update', kwargs={'pk': self.user.pk}), {'city': 'a'})):
+            with CaptureQueriesContext(connection) as context:
+                response = getattr(self.client, method)(url, data=data, format='json')
+
+            self.assertEqual(len(response.json()['payments']), 1)
+            payments_sql = [query['sql'] for query in context.captured_queries
+                            if 'FROM "users_payments"' in query['sql']]
+            self.assertEqual(len(payments_sql), 1)
+            self.assertNotIn('stripe_session', payments_sql[0])
+
+    def test_obtain_token(self):
+        self.user.set_password('12345')
+        self.user.save()
+        self.client.force_authenticate(user=None)
+        self.assertQueryBudget(lambda: ('post', reverse('users:token_obtain_pair'),
+                                        {'email': self.user.email, 'password': '12345'}),
+                               max_queries=2, max_bytes=600)
+
+    def test_refresh_token(self):
+        refresh = str(RefreshToken.for_user(self.user))
+        self.client.force_authenticate(user=None)
+        self.assertQueryBudget(lambda: ('post', reverse('users:token_refresh'), {'refresh': refresh}),
+                               max_queries=1, max_bytes=400)
+
+
+@mock.patch('users.services.check_status_stripe', return_value={'status': 'open'})
+class PaymentsQueryBudgetTestCase(QueryBudgetMixin, APITestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = User.objects.create(email='test@test.com', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(name='test', owner=self.user)
+        self.payments = []
+
+    def seed(self, size):
+        while len(self.payments) < size:
+            self.payments.append(Payments.objects.create(user=self.user, paid_course=self.course, pay_sum=1000))
+
+    def test_list_payments(self, *stripe_mocks):
+        self.assertQueryBudget(lambda: ('get', '/payments/', None), max_queries=1, max_bytes=200, per_row=True)
+
+    def test_retrieve_payment(self, *stripe_mocks):
+        self.assertQueryBudget(lambda: ('get', f'/payments/{self.payments[0].pk}/', None), max_queries=1,
+                               max_bytes=200)
+
+    def test_create_payment(self, *stripe_mocks):
+        data = {'user': self.user.pk, 'paid_course': self.course.pk, 'pay_sum': 1000}
+        self.assertQueryBudget(lambda: ('post', '/payments/', data), max_queries=4, max_bytes=300)
+
+    def test_update_payment(self, *stripe_mocks):
+        self.assertQueryBudget(lambda: ('patch', f'/payments/{self.payments[0].pk}/', {'pay_sum': 2000}),
+                               max_queries=2, max_bytes=200)
+
+    def test_delete_payment(self, *stripe_mocks):
+        def make_request():
+            payment = Payments.objects.create(user=self.user, pay_sum=1000)
+            return 'delete', f'/payments/{payment.pk}/', None
+
+        self.assertQueryBudget(make_request, max_queries=2, max_bytes=0)
+
+    def test_payment_status(self, *stripe_mocks):
+        self.assertQueryBudget(lambda: ('get', f'/payments/{self.payments[0].pk}/status/', None), max_queries=1,
+                               max_bytes=100)
+
+
+@mock.patch('users.tasks.create_stripe_session',
+            return_value={'id': 'cs_test', 'url': 'https://checkout.stripe.com/c/pay/cs_test', 'status': 'open'})
+@mock.patch('users.services.create_stripe_price', return_value={'id': 'price_test'})
+@mock.patch('users.services.create_stripe_product', return_value={'id': 'prod_test'})
+class CheckoutProvisioningTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = User.objects.create(email='test@test.com', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(name='test', owner=self.user)
+
+    def test_create_payment_pending(self, *stripe_mocks):
+        response = self.client.post('/payments/', data={'user': self.user.pk, 'paid_course': self.course.pk,
+                                                        'pay_sum': 1000})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['payment_status'], Payments.STATUS_PENDING)
+        for stripe_mock in stripe_mocks:
+            stripe_mock.assert_not_called()
+        task = TaskOutbox.objects.get()
+        self.assertEqual((task.task, task.args), ('users.tasks.provision_checkout', [response.json()['id']]))
+
+        response = self.client.get(f'/payments/{response.json()["id"]}/status/')
+
+        self.assertEqual(response.json(), {'status': Payments.STATUS_PENDING, 'payment_link': None})
+
+    def test_provision_checkout(self, create_product, create_price, create_session):
+        payment = Payments.objects.create(user=self.user, paid_course=self.course, pay_sum=1000,
+                                          payment_status=Payments.STATUS_PENDING)
+
+        self.assertEqual(provision_checkout(payment.pk), 'cs_test')
+        # Повторная доставка задачи не создает вторую сессию
+        self.assertIsNone(provision_checkout(payment.pk))
+
+        payment.refresh_from_db()
+        self.assertEqual(payment.session_id, 'cs_test')
+        self.assertEqual(payment.payment_link, 'https://checkout.stripe.com/c/pay/cs_test')
+        create_product.assert_called_once_with(self.course)
+        create_session.assert_called_once_with({'id': 'price_test'})
+
+    def test_provision_checkout_without_product(self, create_product, create_price, create_session):
+        payment = Payments.objects.create(user=self.user, pay_sum=1000, payment_status=Payments.STATUS_PENDING)
+
+        with self.assertLogs('users.tasks', level='WARNING'):
+            self.assertIsNone(provision_checkout(payment.pk))
+
+        payment.refresh_from_db()
+        self.assertEqual(payment.payment_status, Payments.STATUS_FAILED)
+        create_session.assert_not_called()
+
+    def test_course_catalog_reused(self, create_product, create_price, create_session):
+        for pay_sum in (1000, 1000, 2000):
+            provision_checkout(Payments.objects.create(user=self.user, paid_course=self.course, pay_sum=pay_sum).pk)
+
+        self.assertEqual(create_product.call_count, 1)
+        self.assertEqual([call.args[1] for call in create_price.call_args_list], [1000, 2000])
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.stripe_product_id, 'prod_test')
+        self.assertEqual(StripePrice.objects.filter(course=self.course).count(), 2)
+
+    def test_course_rename_invalidates_catalog(self, create_product, create_price, create_session):
+        provision_checkout(Payments.objects.create(user=self.user, paid_course=self.course, pay_sum=1000).pk)
+        self.course.refresh_from_db()
+
+        self.course.last_update = timezone.now()
+        self.course.save(update_fields=['last_update'])
+        self.assertEqual(StripePrice.objects.count(), 1)
+
+        self.course.name = 'renamed'
+        self.course.save(update_fields=['name'])
+
+        self.course.refresh_from_db()
+        self.assertIsNone(self.course.stripe_product_id)
+        self.assertFalse(StripePrice.objects.exists())
+
+        provision_checkout(Payments.objects.create(user=self.user, paid_course=self.course, pay_sum=1000).pk)
+        self.assertEqual(create_product.call_count, 2)
+
+    def test_course_rename_with_stale_product(self, create_product, create_price, create_session):
+        course = Course.objects.get(pk=self.course.pk)
+        provision_checkout(Payments.objects.create(user=self.user, paid_course=self.course, pay_sum=1000).pk)
+
+        # в памяти stripe_product_id еще пустой, а в базе продукт уже создан
+        course.name = 'renamed'
+        with self.assertNumQueries(3):
+            course.save()
+
+        course.refresh_from_db()
+        self.assertIsNone(course.stripe_product_id)
+        self.assertFalse(StripePrice.objects.exists())
+
+    def test_course_save_without_rename(self, create_product, create_price, create_session):
+        provision_checkout(Payments.objects.create(user=self.user, paid_course=self.course, pay_sum=1000).pk)
+        course = Course.objects.get(pk=self.course.pk)
+        course.description = 'new'
+
+        with self.assertNumQueries(1):
+            course.save()
+
+        course.refresh_from_db()
+        self.assertEqual(course.stripe_product_id, 'prod_test')
+
+
+class SessionStatusCacheTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create(email='test@test.com', password='12345')
+        self.payment = Payments.objects.create(user=self.user, pay_sum=1000, session_id='cs_status_test')
+
+    def tearDown(self) -> None:
+        cache.delete_many([f'users:stripe_status:{session_id}' for session_id in ('cs_status_test', 'cs_threads')])
+
+    @mock.patch('users.services.check_status_stripe', return_value={'status': 'open', 'payment_status': 'unpaid'})
+    def test_open_status_cached_briefly(self, check_status):
+        self.assertEqual(get_session_status('cs_status_test')['status'], 'open')
+        self.assertEqual(get_session_status('cs_status_test')['status'], 'open')
+
+        self.assertEqual(check_status.call_count, 1)
+        self.assertIsNone(Payments.objects.get(pk=self.payment.pk).payment_status)
+
+    @mock.patch('users.services.check_status_stripe', return_value={'status': 'complete', 'payment_status': 'paid'})
+    def test_paid_status_stored(self, check_status):
+        with mock.patch('users.services.cache.set', wraps=cache.set) as cache_set:
+            get_session_status('cs_status_test')
+
+        self.assertIsNone(cache_set.call_args.kwargs['timeout'])
+        payment = Payments.objects.get(pk=self.payment.pk)
+        self.assertEqual(payment.payment_status, Payments.STATUS_PAID)
+        self.assertEqual(payment.stripe_session, {'status': 'complete', 'payment_status': 'paid'})
+
+    def test_single_flight(self):
+        def slow_status(session_id):
+            time.sleep(0.2)
+            return {'status': 'open', 'payment_status': 'unpaid'}
+
+        with mock.patch('users.services.check_status_stripe', side_effect=slow_status) as check_status:
+            threads = [threading.Thread(target=get_session_status, args=('cs_threads',)) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(check_status.call_count, 1)
+
+    @mock.patch('users.services.STRIPE_TIMEOUT', 0.1)
+    @mock.patch('users.services.check_status_stripe', return_value={'status': 'open', 'payment_status': 'unpaid'})
+    def test_lock_timeout_result_cached(self, check_status):
+        # блокировку держит зависший процесс
+        cache.add('users:stripe_status:cs_status_test:lock', 1)
+        try:
+            get_session_status('cs_status_test')
+            get_session_status('cs_status_test')
+        finally:
+            cache.delete('users:stripe_status:cs_status_test:lock')
+
+        self.assertEqual(check_status.call_count, 1)
+
+
+class PaymentStatusTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = User.objects.create(email='test@test.com', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.paid = Payments.objects.create(user=self.user, pay_sum=1000, session_id='cs_paid',
+                                            payment_status=Payments.STATUS_PAID,
+                                            stripe_session={'id': 'cs_paid', 'payment_status': 'paid'})
+        self.open = Payments.objects.create(user=self.user, pay_sum=1000, session_id='cs_open',
+                                            payment_status=Payments.STATUS_OPEN)
+
+    def tearDown(self) -> None:
+        cache.delete('users:stripe_status:cs_open')
+
+    @mock.patch('users.services.check_status_stripe', return_value={'status': 'expired', 'payment_status': 'unpaid'})
+    def test_status(self, check_status):
+        response = self.client.get(f'/payments/{self.paid.pk}/status/')
+
+        self.assertEqual(response.json(), {'status': Payments.STATUS_PAID, 'payment_link': None})
+
+        # Незавершенный статус тоже читается из базы, его обновляют вебхуки и сверка
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/payments/{self.open.pk}/status/')
+
+        self.assertEqual(response.json()['status'], Payments.STATUS_OPEN)
+        check_status.assert_not_called()
+
+    def test_filter_by_status(self):
+        response = self.client.get('/payments/', {'payment_status': Payments.STATUS_OPEN})
+
+        self.assertEqual([payment['id'] for payment in response.json()], [self.open.pk])
+        self.assertNotIn('stripe_session', response.json()[0])
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class StripeWebhookTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create(email='test@test.com', password='12345')
+        self.payment = Payments.objects.create(user=self.user, pay_sum=1000, session_id='cs_webhook')
+
+    def tearDown(self) -> None:
+        cache.delete('users:stripe_status:cs_webhook')
+
+    def post_event(self, payload, secret='whsec_test'):
+        return self.client.post(reverse('users:stripe_webhook'), data=payload, content_type='application/json',
+                                HTTP_STRIPE_SIGNATURE=sign_payload(payload, secret))
+
+    def test_invalid_signature(self):
+        response = self.post_event(checkout_session_event('cs_webhook'), secret='whsec_other')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_duplicate_delivery(self):
+        payload = checkout_session_event('cs_webhook', event_id='evt_1')
+
+        self.assertEqual(self.post_event(payload).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.post_event(payload).status_code, status.HTTP_200_OK)
+        self.post_event(checkout_session_event('cs_webhook', event_type='payment_intent.created'))
+
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        self.assertEqual(TaskOutbox.objects.filter(task='users.tasks.apply_stripe_events').count(), 1)
+
+    @mock.patch('users.services.check_status_stripe')
+    def test_apply_events(self, check_status):
+        self.post_event(checkout_session_event('cs_webhook', event_type='checkout.session.completed',
+                                               payment_status='paid', created=2000))
+        self.post_event(checkout_session_event('cs_webhook', status='open', payment_status='unpaid', created=1000))
+        self.post_event(checkout_session_event('cs_unknown', created=1500))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(apply_pending_events(), 3)
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.payment_status, Payments.STATUS_PAID)
+        self.assertEqual(self.payment.stripe_session['id'], 'cs_webhook')
+        self.assertFalse(StripeEvent.objects.filter(processed_at__isnull=True).exists())
+        self.assertEqual(get_session_status('cs_webhook')['payment_status'], 'paid')
+        check_status.assert_not_called()
+
+    @mock.patch('users.services.check_status_stripe')
+    def test_late_event_ignored(self, check_status):
+        self.post_event(checkout_session_event('cs_webhook', payment_status='paid', created=2000))
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_pending_events()
+
+        # более старое событие пришло следующей пачкой: ни платеж, ни кэш не откатываются
+        self.post_event(checkout_session_event('cs_webhook', status='open', payment_status='unpaid', created=1000))
+        self.post_event(checkout_session_event('cs_webhook', event_type='checkout.session.expired', status='open',
+                                               payment_status='unpaid', created=2000))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(apply_pending_events(), 2)
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.payment_status, Payments.STATUS_PAID)
+        self.assertEqual(get_session_status('cs_webhook')['payment_status'], 'paid')
+        check_status.assert_not_called()
+
+    def test_open_status_cached_with_ttl(self):
+        self.post_event(checkout_session_event('cs_webhook', status='open', payment_status='unpaid'))
+
+        with mock.patch('users.services.cache.set_many', wraps=cache.set_many) as set_many, \
+                self.captureOnCommitCallbacks(execute=True):
+            apply_pending_events()
+
+        timeouts = {call.kwargs['timeout'] for call in set_many.call_args_list if call.args[0]}
+        self.assertEqual(timeouts, {settings.STRIPE_STATUS_CACHE_TTL})
+
+
+@override_settings(STRIPE_RECONCILE_BACKOFF=0, STRIPE_RECONCILE_CONCURRENCY=4)
+class ReconcilePaymentsTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create(email='test@test.com', password='12345')
+        self.pending = [Payments.objects.create(user=self.user, pay_sum=1000, session_id=f'cs_reconcile_{i}',
+                                                payment_status=Payments.STATUS_PENDING) for i in range(3)]
+        self.paid = Payments.objects.create(user=self.user, pay_sum=1000, session_id='cs_reconcile_paid',
+                                            payment_status=Payments.STATUS_PAID)
+        Payments.objects.create(user=self.user, pay_sum=1000)
+
+    def tearDown(self) -> None:
+        cache.delete_many([f'users:stripe_status:cs_reconcile_{i}' for i in range(3)])
+
+    def test_reconcile(self):
+        responses = {
+            'cs_reconcile_0': [{'status': 'complete', 'payment_status': 'paid'}],
+            'cs_reconcile_1': [stripe.error.RateLimitError('Too many requests'),
+                               {'status': 'expired', 'payment_status': 'unpaid'}],
+            'cs_reconcile_2': [stripe.error.InvalidRequestError('No such session', 'id')],
+        }
+
+        def check_status(session_id):
+            response = responses[session_id].pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        # выборка пачки, блокировка и UPDATE в своей транзакции (SAVEPOINT/RELEASE), пустая выборка в конце
+        with mock.patch('users.reconcile.check_status_stripe', side_effect=check_status) as check_status_mock, \
+                self.assertNumQueries(7):
+            stats = reconcile_payments(batch_size=2)
+
+        self.assertEqual(stats, {'checked': 3, 'updated': 2, 'failed': 1})
+        self.assertEqual(check_status_mock.call_count, 4)
+        self.assertEqual(Payments.objects.get(pk=self.pending[1].pk).payment_status, Payments.STATUS_EXPIRED)
+        self.assertEqual(Payments.objects.get(pk=self.pending[2].pk).payment_status, Payments.STATUS_PENDING)
+        self.assertEqual(list(stale_payments()), [self.pending[2]])
+
+    def test_webhook_during_fetch_wins(self):
+        # вебхук применил событие уже после того, как начался запрос в Stripe
+        now = timezone.now()
+        Payments.objects.filter(pk=self.pending[0].pk).update(payment_status=Payments.STATUS_OPEN,
+                                                              stripe_event_created=now)
+        with mock.patch('users.reconcile.check_status_stripe', return_value={'status': 'expired'}), \
+                mock.patch('users.reconcile.timezone.now', return_value=now - timedelta(seconds=1)):
+            stats = reconcile_payments(stale_payments().filter(pk=self.pending[0].pk))
+
+        self.assertEqual(stats, {'checked': 1, 'updated': 0, 'failed': 0})
+        self.assertEqual(Payments.objects.get(pk=self.pending[0].pk).payment_status, Payments.STATUS_OPEN)
+        self.assertIsNone(cache.get('users:stripe_status:cs_reconcile_0'))
+
+        # итоговый статус, примененный вебхуком, сверка тоже не откатывает
+        self.assertEqual(store_sessions([self.paid.pk], {'cs_reconcile_paid': {'status': 'open'}}, now, 10), [])
+        self.assertEqual(Payments.objects.get(pk=self.paid.pk).payment_status, Payments.STATUS_PAID)
+
+    def test_reconcile_sets_event_time(self):
+        with mock.patch('users.reconcile.check_status_stripe', return_value={'status': 'open', 'payment_status': 'unpaid'}):
+            reconcile_payments(stale_payments().filter(pk=self.pending[0].pk))
+
+        payment = Payments.objects.get(pk=self.pending[0].pk)
+        self.assertEqual(payment.payment_status, Payments.STATUS_OPEN)
+        self.assertIsNotNone(payment.stripe_event_created)
+
+    def test_reconcile_stripe_stub(self):
+        api_base, api_key = stripe.api_base, stripe.api_key
+        try:
+            with StripeStubServer(latency=0) as server:
+                stripe.api_base, stripe.api_key = server.url, 'sk_test_stub'
+                stats = reconcile_payments()
+        finally:
+            stripe.api_base, stripe.api_key = api_base, api_key
+
+        self.assertEqual(stats, {'checked': 3, 'updated': 3, 'failed': 0})
+        self.assertEqual(server.requests, 3)
+        self.assertFalse(stale_payments().exists())
+
+    def test_http_session_per_thread(self):
+        client = stripe.default_http_client
+        sessions = []
+        api_base, api_key = stripe.api_base, stripe.api_key
+        try:
+            with StripeStubServer(latency=0) as server:
+                stripe.api_base, stripe.api_key = server.url, 'sk_test_stub'
+                for _ in range(2):
+                    thread = threading.Thread(target=lambda: (check_status_stripe('cs_thread'),
+                                                              sessions.append(client._thread_local.session)))
+                    thread.start()
+                    thread.join()
+        finally:
+            stripe.api_base, stripe.api_key = api_base, api_key
+
+        self.assertEqual(len(sessions), 2)
+        self.assertIsNot(sessions[0], sessions[1])
+
+
+class FastListTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = User.objects.create(email='test@test.com', password='12345', avatar='users/avatar.png',
+                                        city='Москва')
+        self.client.force_authenticate(user=self.user)
+        course = Course.objects.create(name='test', owner=self.user)
+        for i in range(5):
+            User.objects.create(email=f'{i}@test.com', phone='+7 900 000-00-00' if i % 2 else None)
+            Payments.objects.create(user=self.user, pay_sum=1000 + i, paid_course=course if i % 2 else None,
+                                    session_id=f'cs_{i}' if i % 3 else None,
+                                    payment_status=Payments.STATUS_CHOICES[i][0] if i % 4 else None,
+                                    stripe_session={'id': f'cs_{i}'})
+
+    def test_same_output(self):
+        for url in ('/user/', '/payments/', '/payments/?pagination=cursor&page_size=2', '/payments/?ordering=pay_date',
+                    '/payments/?payment_status=open'):
+            responses = []
+            for fast in (False, True):
+                with override_settings(FAST_LIST_SERIALIZERS=fast):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                responses.append(response.content)
+            self.assertEqual(responses[0], responses[1], url)
+
+
+class PaymentsExportTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = User.objects.create(email='test@test.com', password='12345')
+        self.other = User.objects.create(email='other@test.com', password='12345')
+        self.client.force_authenticate(user=self.user)
+        for i in range(5):
+            Payments.objects.create(user=self.user, pay_sum=1000 + i, payment_status=Payments.STATUS_PAID)
+        Payments.objects.create(user=self.other, pay_sum=500, payment_status=Payments.STATUS_OPEN)
+
+    def test_export_own_payments(self):
+        with override_settings(EXPORT_CHUNK_SIZE=2):
+            response = self.client.get('/payments/export/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+        self.assertEqual([row['pay_sum'] for row in rows], [1000, 1001, 1002, 1003, 1004])
+        self.assertNotIn('stripe_session', rows[0])
+
+    def test_export_filters(self):
+        self.user.is_superuser = True
+        self.user.save()
+        response = self.client.get('/payments/export/?output=csv&payment_status=open')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(len(lines), 2)
+        self.assertIn('500', lines[1])
+
+
+class FixtureImportTestCase(APITestCase):
+    records = [
+        {'model': 'users.user', 'pk': 10, 'fields': {'email': 'imported@test.com', 'password': 'x',
+                                                     'last_login': '2024-04-30T13:17:38.985Z', 'groups': []}},
+        {'model': 'materials.course', 'pk': 20, 'fields': {'name': 'курс', 'owner': 10}},
+        {'model': 'materials.lesson', 'pk': 30, 'fields': {'name': 'урок', 'course': 20, 'owner': 10}},
+        {'model': 'materials.subscription', 'pk': 40, 'fields': {'user': 10, 'course': 20}},
+        {'model': 'users.payments', 'pk': 50, 'fields': {'user': 10, 'paid_course': 20, 'pay_sum': 1000,
+                                                         'pay_date': '2024-04-30T13:20:18.242Z'}},
+    ]
+
+    def write(self, content):
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False, encoding='utf-8') as file:
+            file.write(content)
+        self.addCleanup(os.remove, file.name)
+        return file.name
+
+    def test_iter_records(self):
+        array = json.dumps(self.records, ensure_ascii=False, indent=2)
+        ndjson = '\n'.join(json.dumps(record) for record in self.records)
+        for content in (array, ndjson):
+            self.assertEqual(list(iter_records(io.StringIO(content), read_size=7)), self.records)
+
+        with self.assertRaises(FixtureError):
+            list(iter_records(io.StringIO('[{"model": "users.user"'), read_size=7))
+
+    def test_import(self):
+        # Дочерние записи идут раньше родительских: пачки пишутся в порядке зависимостей
+        path = self.write('\n'.join(json.dumps(record) for record in reversed(self.records)))
+        call_command('import_fixtures', path, batch_size=2, stdout=io.StringIO())
+
+        payment = Payments.objects.get(pk=50)
+        self.assertEqual(payment.pay_date, datetime(2024, 4, 30, 13, 20, 18, 242000, tzinfo=dt_timezone.utc))
+        self.assertEqual(User.objects.get(pk=10).last_login.year, 2024)
+        self.assertEqual(Lesson.objects.get(pk=30).course.owner.email, 'imported@test.com')
+        self.assertGreater(Course.objects.create(name='новый').pk, 20)
+
+    def test_overwrite_and_exclude(self):
+        User.objects.create(pk=10, email='old@test.com')
+        path = self.write(json.dumps(self.records))
+        call_command('import_fixtures', path, exclude=['materials', 'users.payments'], stdout=io.StringIO())
+
+        self.assertEqual(User.objects.get(pk=10).email, 'imported@test.com')
+        self.assertFalse(Course.objects.exists())
+        self.assertFalse(Payments.objects.exists())
+
+    def test_invalidates_cache(self):
+        admin = User.objects.create(email='admin@test.com', is_superuser=True)
+        self.client.force_authenticate(user=admin)
+        self.assertEqual(self.client.get('/courses/').json()['count'], 0)
+
+        call_command('import_fixtures', self.write(json.dumps(self.records)), stdout=io.StringIO())
+        self.assertEqual(self.client.get('/courses/').json()['count'], 1)
+
+    def test_replaces_many_to_many(self):
+        old, new = Group.objects.create(name='old'), Group.objects.create(name='new')
+        user = User.objects.create(pk=10, email='old@test.com')
+        user.groups.add(old)
+        other = User.objects.create(pk=11, email='other@test.com')
+        other.groups.add(old)
+        records = [dict(self.records[0], fields=dict(self.records[0]['fields'], groups=[new.pk])),
+                   {'model': 'users.user', 'pk': 11, 'fields': {'email': 'other@test.com', 'groups': []}}]
+        call_command('import_fixtures', self.write(json.dumps(records)), batch_size=1, stdout=io.StringIO())
+
+        self.assertEqual(list(user.groups.all()), [new])
+        self.assertFalse(other.groups.exists())
+
+    def test_integrity_error(self):
+        User.objects.create(pk=11, email='imported@test.com')
+        with self.assertRaises(CommandError):
+            call_command('import_fixtures', self.write(json.dumps(self.records[:1])), stdout=io.StringIO())
+        self.assertFalse(User.objects.filter(pk=10).exists())
+
+    def test_unknown_model(self):
+        path = self.write('[{"model": "users.unknown", "pk": 1, "fields": {}}]')
+        with self.assertRaises(CommandError):
+            call_command('import_fixtures', path, stdout=io.StringIO())
@@ -7,7 +7,8 @@ from rest_framework_simplejwt.views import (
     TokenRefreshView,
 )
 
-from users.views import PaymentsViewSet, UserListView, UserCreateView, UserDetailView, UserUpdateView, UserDeleteView
+from users.views import (PaymentsViewSet, UserListView, UserCreateView, UserDetailView, UserUpdateView, UserDeleteView,
+                         StripeWebhookAPIView)
 
 app_name = UsersConfig.name
 
@@ -22,4 +23,5 @@ urlpatterns = [
                   path('user/delete/<int:pk>/', UserDeleteView.as_view(), name='user_delete'),
                   path('user/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
                   path('user/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+                  path('stripe/webhook/', StripeWebhookAPIView.as_view(), name='stripe_webhook'),
               ] + router.urls
@@ -1,14 +1,22 @@
+from django.db import transaction
 from django_filters.rest_framework.backends import DjangoFilterBackend
 from rest_framework import viewsets, status, generics
 from rest_framework.decorators import action
 from rest_framework.filters import OrderingFilter
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from materials.exports import StreamingExportMixin
+from materials.fast_serializers import FastListMixin
+from materials.outbox import enqueue_task
 from users.models import User, Payments
+from users.paginators import PaymentsPagination, UsersPagination
 from users.permissions import IsUserUser
+from users.roles import is_materials_admin
 from users.serializers import UserSerializer, PaymentsSerializer, UserSerializerForOthers
-from users.services import create_stripe_product, create_stripe_session, create_stripe_price, check_status_stripe
+from users.tasks import apply_stripe_events, provision_checkout
+from users.webhooks import parse_event, store_event
 
 
 class UserCreateView(generics.CreateAPIView):
@@ -54,32 +62,57 @@ class UserDeleteView(generics.DestroyAPIView):
     permission_classes = [IsAuthenticated, IsUserUser]
 
 
-class UserListView(generics.ListAPIView):
+class UserListView(FastListMixin, generics.ListAPIView):
     serializer_class = UserSerializerForOthers
     queryset = User.objects.all()
     permission_classes = [IsAuthenticated]
+    pagination_class = UsersPagination
 
 
-class PaymentsViewSet(viewsets.ModelViewSet):
+class PaymentsViewSet(FastListMixin, StreamingExportMixin, viewsets.ModelViewSet):
     serializer_class = PaymentsSerializer
     queryset = Payments.objects.all()
+    pagination_class = PaymentsPagination
 
     filter_backends = [DjangoFilterBackend, OrderingFilter]
-    filterset_fields = ('paid_lesson', 'paid_course', 'pay_transfer')
+    filterset_fields = ('paid_lesson', 'paid_course', 'pay_transfer', 'payment_status')
     ordering_fields = ['pay_date']
 
     def perform_create(self, serializer):
-        payment = serializer.save(user=self.request.user)
-        product = create_stripe_product(payment.paid_course)
-        price = create_stripe_price(product=product, amount=payment.pay_sum)
-        session_id, session_url = create_stripe_session(price)
-        payment.session_id = session_id
-        payment.payment_link = session_url
-        payment.payment_status = check_status_stripe(payment.session_id)
-        payment.save()
+        # Сессия оплаты создается в задаче; ссылку клиент получает через .../payments/<int:pk>/status/
+        with transaction.atomic():
+            payment = serializer.save(user=self.request.user, payment_status=Payments.STATUS_PENDING)
+            enqueue_task(provision_checkout, (payment.pk,))
 
     @action(detail=True, methods=['get']) #доступно по адресу .../payments/<int:pk>/status/
     def status(self, request, pk=None):
+        # Статус в базе поддерживают вебхуки (apply_stripe_events) и сверка reconcile_payments,
+        # поэтому запрос не ходит в Stripe
         payment = self.get_object()
-        payment_status = check_status_stripe(payment.session_id)
-        return Response({"status": payment_status})
+        return Response({"status": payment.payment_status, "payment_link": payment.payment_link})
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
+    def export(self, request):
+        # Выгрузка учитывает фильтры списка; администраторы выгружают все платежи, остальные - свои
+        queryset = self.filter_queryset(self.get_queryset())
+        if not is_materials_admin(request):
+            queryset = queryset.filter(user=request.user)
+        return self.export_response(request, queryset.order_by('id'))
+
+
+class StripeWebhookAPIView(APIView):
+    """Принимает события сессий оплаты от Stripe и откладывает их применение в задачу"""
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        try:
+            event = parse_event(request.body, request.META.get('HTTP_STRIPE_SIGNATURE', ''))
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        if event['type'].startswith('checkout.session.'):
+            with transaction.atomic():
+                store_event(event)
+                enqueue_task(apply_stripe_events, dedup_key='apply_stripe_events')
+        return Response(status=status.HTTP_200_OK)
@@ -0,0 +1,92 @@
+from datetime import datetime, timezone as dt_timezone
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from users.models import Payments, StripeEvent
+from users.services import cache_statuses
+
+
+def parse_event(payload, signature):
+    """Проверяет подпись вебхука Stripe и возвращает событие; при неверной подписи бросает ValueError"""
+    if not settings.STRIPE_WEBHOOK_SECRET:
+        raise ValueError('STRIPE_WEBHOOK_SECRET is not configured')
+    try:
+        return stripe.Webhook.construct_event(payload, signature, settings.STRIPE_WEBHOOK_SECRET)
+    except stripe.error.SignatureVerificationError as exc:
+        raise ValueError(str(exc)) from exc
+
+
+def store_event(event):
+    """Сохраняет событие сессии оплаты; повторная доставка того же события ничего не добавляет"""
+    session = event['data']['object']
+    StripeEvent.objects.bulk_create([
+        StripeEvent(
+            event_id=event['id'],
+            event_type=event['type'],
+            session_id=session['id'],
+            payload=session,
+            created=datetime.fromtimestamp(event['created'], tz=dt_timezone.utc),
+        )
+    ], ignore_conflicts=True)
+
+
+def is_stale(payment, event, status):
+    """Событие старше уже примененного (опоздавшее или повторно доставленное) не должно откатывать статус;
+    created у Stripe с точностью до секунды, поэтому при равном времени итоговый статус не сменяется промежуточным"""
+    if payment.stripe_event_created is None:
+        return False
+    if event.created != payment.stripe_event_created:
+        return event.created < payment.stripe_event_created
+    return payment.payment_status in Payments.TERMINAL_STATUSES and status not in Payments.TERMINAL_STATUSES
+
+
+def apply_event_batch(batch_size):
+    """Применяет пачку необработанных событий к платежам: по каждой сессии берется самое позднее событие,
+    если оно не старше события, уже примененного к платежу"""
+    with transaction.atomic():
+        events = list(
+            StripeEvent.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True)
+            .order_by('created', 'id')[:batch_size]
+        )
+        if not events:
+            return 0
+
+        latest = {event.session_id: event for event in events}
+        payments = list(
+            Payments.objects.select_for_update()
+            .filter(session_id__in=latest)
+            .only('id', 'session_id', 'payment_status', 'stripe_event_created')
+        )
+        applied = {}
+        stale = set()
+        for payment in payments:
+            event = latest[payment.session_id]
+            status = Payments.status_from_session(event.payload)
+            if is_stale(payment, event, status):
+                stale.add(payment.session_id)
+                continue
+            payment.payment_status = status
+            payment.stripe_session = event.payload
+            payment.stripe_event_created = event.created
+            applied[payment.session_id] = event.payload
+        Payments.objects.bulk_update([payment for payment in payments if payment.session_id in applied],
+                                     ['payment_status', 'stripe_session', 'stripe_event_created'],
+                                     batch_size=batch_size)
+        StripeEvent.objects.filter(pk__in=[event.pk for event in events]).update(processed_at=timezone.now())
+        # Сессии без платежа (вебхук пришел раньше, чем задача сохранила session_id) тоже кэшируются
+        sessions = {session_id: event.payload for session_id, event in latest.items() if session_id not in stale}
+        transaction.on_commit(lambda: cache_statuses(sessions))
+    return len(events)
+
+
+def apply_pending_events():
+    applied = 0
+    while True:
+        count = apply_event_batch(settings.STRIPE_EVENT_BATCH_SIZE)
+        applied += count
+        if count < settings.STRIPE_EVENT_BATCH_SIZE:
+            return applied